@@ -5,12 +5,23 @@ class ChatApp {
         this.mainContent = document.getElementById('mainContent');
         this.loginSection = document.getElementById('loginSection');
         
+        this.avatarElement = document.querySelector('.avatar-placeholder');
         this.messageInput = document.getElementById('messageInput');
         this.sendButton = document.getElementById('sendButton');
         this.chatMessages = document.getElementById('chatMessages');
         
         this.authToken = null;
         this.currentConversationId = null;
+        // One socket per session carries every turn; SSE requests are the fallback while it's down
+        this.socket = null;
+        this.socketReady = false;
+        this.reconnectDelay = 1000;
+        this.lastMessageId = null;
+        this.replies = new Map();
+        this.audioContext = null;
+        // Sentences are decoded and scheduled one after another, in the order they arrive
+        this.speechQueue = Promise.resolve();
+        this.speechEndTime = 0;
         this.apiBaseUrl = 'https://threed-avatar-connected-to-ai-1.onrender.com';
 
         this.init();
@@ -79,33 +90,209 @@ class ChatApp {
         if (!message) return;
 
         try {
+            // Browsers only allow audio to start from a user action like this one
+            if (!this.audioContext) {
+                this.audioContext = new AudioContext();
+            }
             if (!this.currentConversationId) {
                 await this.createNewConversation();
             }
 
-            const response = await fetch(`${this.apiBaseUrl}/chat/conversations/${this.currentConversationId}/send_message/`, {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'Authorization': `Token ${this.authToken}`
-                },
-                body: JSON.stringify({ message })
-            });
-
-            if (!response.ok) {
-                throw new Error('Failed to send message');
+            if (this.socketReady) {
+                this.sendOverSocket(message);
+            } else {
+                await this.sendOverEventStream(message);
             }
 
-            const data = await response.json();
-            this.addMessage(message, 'user');
-            this.addMessage(data.message, 'assistant');
-            this.messageInput.value = '';
-
         } catch (error) {
             this.addMessage('Error sending message', 'system');
         }
     }
 
+    sendOverSocket(message) {
+        // Unique across tabs, since every socket on the conversation sees each reply
+        const id = crypto.randomUUID();
+        this.socket.send(JSON.stringify({ type: 'message', message, voice: true, id }));
+        this.addMessage(message, 'user');
+        this.messageInput.value = '';
+        this.replies.set(id, { div: this.addMessage('', 'assistant'), own: true, done: false });
+    }
+
+    async sendOverEventStream(message) {
+        const response = await fetch(`${this.apiBaseUrl}/chat/conversations/${this.currentConversationId}/send_message_stream/`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': 'text/event-stream',
+                'Authorization': `Token ${this.authToken}`
+            },
+            body: JSON.stringify({ message, voice: true })
+        });
+
+        if (!response.ok) {
+            throw new Error('Failed to send message');
+        }
+
+        this.addMessage(message, 'user');
+        this.messageInput.value = '';
+
+        // Show tokens as they arrive instead of waiting for the full reply
+        const assistantDiv = this.addMessage('', 'assistant');
+        await this.readEventStream(response, (event, data) => {
+            if (event === 'token') {
+                assistantDiv.textContent += data.token;
+            } else if (event === 'speech') {
+                this.playSpeech(data);
+            } else if (event === 'done') {
+                assistantDiv.textContent = data.message;
+                this.lastMessageId = data.ai_message.id ?? this.lastMessageId;
+            } else if (event === 'error') {
+                throw new Error(data.error);
+            }
+            this.chatMessages.scrollTop = this.chatMessages.scrollHeight;
+        });
+    }
+
+    connectSocket() {
+        const url = `${this.apiBaseUrl.replace(/^http/, 'ws')}/ws/chat/conversations/${this.currentConversationId}/`;
+        const socket = new WebSocket(url);
+        this.socket = socket;
+
+        socket.addEventListener('open', () => {
+            // Authenticate once per connection; after a reconnect, ask for whatever was saved meanwhile
+            socket.send(JSON.stringify({ type: 'auth', token: this.authToken, resume_after: this.lastMessageId }));
+        });
+        socket.addEventListener('message', (e) => this.handleSocketFrame(JSON.parse(e.data)));
+        socket.addEventListener('close', (e) => {
+            this.socketReady = false;
+            // Bad token or conversation gone: retrying won't help
+            if (this.socket !== socket || e.code === 4401 || e.code === 4404) return;
+            setTimeout(() => this.connectSocket(), this.reconnectDelay);
+            this.reconnectDelay = Math.min(this.reconnectDelay * 2, 30000);
+        });
+    }
+
+    handleSocketFrame(frame) {
+        if (frame.type === 'ping') {
+            this.socket.send(JSON.stringify({ type: 'pong' }));
+        } else if (frame.type === 'ready') {
+            this.socketReady = true;
+            this.reconnectDelay = 1000;
+            this.lastMessageId = frame.last_message_id ?? this.lastMessageId;
+        } else if (frame.type === 'message') {
+            this.resumeMessage(frame.message);
+        } else if (frame.type === 'error' && !frame.reply_to) {
+            console.error('Chat socket error:', frame.error);
+        } else if (frame.reply_to) {
+            this.handleReplyFrame(frame);
+        }
+    }
+
+    resumeMessage(message) {
+        if (message.id <= this.lastMessageId) return;
+        this.lastMessageId = message.id;
+        // A reply cut off by the disconnect was saved in full; finish it instead of showing it twice
+        const unfinished = [...this.replies.values()].find((reply) => !reply.done);
+        if (unfinished && message.role === 'assistant') {
+            unfinished.div.textContent = message.content;
+            unfinished.done = true;
+        } else if (!unfinished || message.role !== 'user') {
+            this.addMessage(message.content, message.role);
+        }
+    }
+
+    handleReplyFrame(frame) {
+        let reply = this.replies.get(frame.reply_to);
+        if (!reply) {
+            // Sent from another tab bound to the same conversation
+            reply = { div: this.addMessage('', 'assistant'), own: false, done: false };
+            this.replies.set(frame.reply_to, reply);
+        }
+
+        if (frame.type === 'token') {
+            reply.div.textContent += frame.token;
+        } else if (frame.type === 'speech') {
+            if (reply.own) this.playSpeech(frame);
+        } else if (frame.type === 'done') {
+            if (!reply.own && !reply.done) {
+                reply.div.before(this.createMessage(frame.user_message.content, 'user'));
+            }
+            reply.div.textContent = frame.message;
+            reply.done = true;
+            this.lastMessageId = frame.ai_message.id ?? this.lastMessageId;
+        } else if (frame.type === 'error') {
+            reply.div.remove();
+            reply.done = true;
+            if (reply.own) this.addMessage('Error sending message', 'system');
+        }
+        this.chatMessages.scrollTop = this.chatMessages.scrollHeight;
+    }
+
+    async readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+
+            buffer += decoder.decode(value, { stream: true });
+            const frames = buffer.split('\n\n');
+            buffer = frames.pop();
+
+            for (const frame of frames) {
+                let event = 'message';
+                let data = '';
+                for (const line of frame.split('\n')) {
+                    if (line.startsWith('event: ')) event = line.slice(7);
+                    else if (line.startsWith('data: ')) data += line.slice(6);
+                }
+                if (data) onEvent(event, JSON.parse(data));
+            }
+        }
+    }
+
+    playSpeech(segment) {
+        // Start downloading right away; only playback waits for the previous sentence
+        const audio = segment.audio_url
+            ? this.fetchAudio(segment.audio_url)
+            : Promise.resolve(Uint8Array.from(atob(segment.audio), (char) => char.charCodeAt(0)).buffer);
+        this.speechQueue = this.speechQueue.then(async () => {
+            const buffer = await this.audioContext.decodeAudioData(await audio);
+            const source = this.audioContext.createBufferSource();
+            source.buffer = buffer;
+            source.connect(this.audioContext.destination);
+
+            // Right after the previous sentence, or now if nothing is playing
+            const startAt = Math.max(this.audioContext.currentTime, this.speechEndTime);
+            source.start(startAt);
+            this.speechEndTime = startAt + buffer.duration;
+
+            const delayMs = (startAt - this.audioContext.currentTime) * 1000;
+            for (const { time_ms, viseme } of segment.visemes) {
+                setTimeout(() => this.setViseme(viseme), delayMs + time_ms);
+            }
+            setTimeout(() => this.setViseme('sil'), delayMs + buffer.duration * 1000);
+        }).catch((error) => console.error('Speech playback error:', error));
+    }
+
+    async fetchAudio(url) {
+        const response = await fetch(url, {
+            headers: { 'Authorization': `Token ${this.authToken}` }
+        });
+        if (!response.ok) {
+            throw new Error('Failed to load speech audio');
+        }
+        return response.arrayBuffer();
+    }
+
+    setViseme(viseme) {
+        // The avatar renderer listens for this to drive its mouth shapes
+        this.avatarElement.dataset.viseme = viseme;
+        this.avatarElement.dispatchEvent(new CustomEvent('viseme', { detail: { viseme } }));
+    }
+
     async createNewConversation() {
         const response = await fetch(`${this.apiBaseUrl}/chat/conversations/`, {
             method: 'POST',
@@ -121,14 +308,21 @@ class ChatApp {
 
         const data = await response.json();
         this.currentConversationId = data.id;
+        this.connectSocket();
     }
 
-    addMessage(content, role) {
+    createMessage(content, role) {
         const messageDiv = document.createElement('div');
         messageDiv.className = `message ${role}`;
         messageDiv.textContent = content;
+        return messageDiv;
+    }
+
+    addMessage(content, role) {
+        const messageDiv = this.createMessage(content, role);
         this.chatMessages.appendChild(messageDiv);
         this.chatMessages.scrollTop = this.chatMessages.scrollHeight;
+        return messageDiv;
     }
 }
 
@@ -1,5 +1,6 @@
 from django.contrib import admin
 from .models import Conversation, Message
+from .services.search import matching_message_ids
 
 @admin.register(Conversation)
 class ConversationAdmin(admin.ModelAdmin):
@@ -15,6 +16,14 @@ class MessageAdmin(admin.ModelAdmin):
     search_fields = ('content', 'conversation__title')
     ordering = ('-timestamp',)
 
+    def get_search_results(self, request, queryset, search_term):
+        # Content is searched through the full-text index instead of a LIKE scan over every message
+        matching = matching_message_ids(search_term) if search_term.strip() else None
+        if matching is None:
+            return super().get_search_results(request, queryset, search_term)
+        by_title = queryset.filter(conversation__title__icontains=search_term.strip())
+        return queryset.filter(pk__in=matching) | by_title, False
+
     def content_preview(self, obj):
         return obj.content[:50] + '...' if len(obj.content) > 50 else obj.content
     content_preview.short_description = 'Content Preview'
\ No newline at end of file
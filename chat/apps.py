@@ -1,5 +1,5 @@
 from django.apps import AppConfig
-from django.db.models.signals import post_migrate
+from django.db.models.signals import post_migrate, post_save, post_delete
 
 def create_demo_user(sender, **kwargs):
     from django.contrib.auth.models import User
@@ -13,4 +13,16 @@ class ChatConfig(AppConfig):
     name = 'chat'
 
     def ready(self):
-        post_migrate.connect(create_demo_user, sender=self) 
\ No newline at end of file
+        from django.contrib.auth.models import User
+        from rest_framework.authtoken.models import Token
+        from .models import Conversation, Message
+        from .signals import message_saved, message_deleted, conversation_deleted, token_changed, user_changed
+        
+        post_migrate.connect(create_demo_user, sender=self)
+        post_save.connect(message_saved, sender=Message)
+        post_delete.connect(message_deleted, sender=Message)
+        post_delete.connect(conversation_deleted, sender=Conversation)
+        post_save.connect(token_changed, sender=Token)
+        post_delete.connect(token_changed, sender=Token)
+        post_save.connect(user_changed, sender=User)
+        post_delete.connect(user_changed, sender=User) 
\ No newline at end of file
@@ -0,0 +1,23 @@
+from rest_framework.authentication import TokenAuthentication
+
+from .services.token_cache import token_cache
+
+
+class CachingTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication that remembers valid tokens, saving the token and user query on most requests.
+
+    Unknown tokens are never cached, so they always hit the database.
+    """
+
+    def authenticate_credentials(self, key):
+        if not token_cache.enabled:
+            return super().authenticate_credentials(key)
+
+        cached = token_cache.get(key)
+        if cached is not None:
+            return cached
+
+        mutations = token_cache.mutations()
+        user, token = super().authenticate_credentials(key)
+        token_cache.put(key, user, token, mutations)
+        return user, token
@@ -0,0 +1,237 @@
+import contextlib
+import json
+import logging
+import os
+import queue
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+
+from .models import Conversation, Message
+
+logger = logging.getLogger(__name__)
+
+# Fixed question set; with the seed it makes every run send the same messages in the same order
+QUESTIONS = [
+    "How do I renew my passport?",
+    "What documents do I need to register a new address?",
+    "When is the next municipal election?",
+    "How can I apply for a parking permit?",
+    "Where do I report a broken street light?",
+    "What are the opening hours of the town hall?",
+    "How do I pay my property tax online?",
+    "Can I get a copy of my birth certificate?",
+    "How do I register my child for school?",
+    "What is the recycling schedule in my neighbourhood?",
+    "How do I apply for housing benefits?",
+    "Who do I contact about a noise complaint?",
+]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of ``values``, or None when there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, round(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def distribution(values):
+    return {
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'mean': sum(values) / len(values) if values else None,
+        'max': max(values) if values else None,
+    }
+
+
+def peak_memory_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+@contextlib.contextmanager
+def throwaway_database():
+    """Run the block against a fresh, migrated copy of the default database, destroyed afterwards.
+
+    Benchmarks never touch real data and every run starts from the same
+    state. SQLite gets a file rather than memory so threads share it.
+    """
+    test_dir = None
+    if connection.vendor == 'sqlite':
+        test_dir = tempfile.mkdtemp(prefix='bench_')
+        connection.settings_dict['TEST']['NAME'] = os.path.join(test_dir, 'bench.sqlite3')
+    # Keep post_migrate output (the demo user) out of reports printed on stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        if test_dir is not None:
+            os.rmdir(test_dir)
+
+
+class _Sample:
+    def __init__(self, latency_ms, ttft_ms, tokens, queries, error=None):
+        self.latency_ms = latency_ms
+        self.ttft_ms = ttft_ms
+        self.tokens = tokens
+        self.queries = queries
+        self.error = error
+
+
+class LoadTestHarness:
+    """Drives the send_message endpoints in-process with concurrent simulated users.
+
+    ``conversations`` conversations, each pre-filled with ``history`` messages,
+    are worked through by ``concurrency`` threads; a conversation's ``turns``
+    are sent one after another, like a real user waiting for each reply.
+    Requests go through the full middleware and view stack with Django's test
+    client, so database queries can be counted per request. Expects a
+    throwaway database.
+    """
+
+    def __init__(self, tokenizer, concurrency=4, conversations=8, turns=5, history=0, stream=False, seed=0):
+        self.tokenizer = tokenizer
+        self.concurrency = concurrency
+        self.conversations = conversations
+        self.turns = turns
+        self.history = history
+        self.stream = stream
+        self.seed = seed
+        self._samples = []
+        self._samples_lock = threading.Lock()
+
+    def setup(self):
+        user, _ = User.objects.get_or_create(username='bench')
+        self.token = Token.objects.get_or_create(user=user)[0].key
+
+        rng = random.Random(self.seed)
+        self.plan = []
+        for index in range(self.conversations):
+            # A user per conversation, as per-user limits would otherwise queue them behind each other
+            owner, _ = User.objects.get_or_create(username=f'bench-{index}')
+            token = Token.objects.get_or_create(user=owner)[0].key
+            conversation = Conversation.objects.create(user=owner, title=f'Benchmark conversation {index}')
+            Message.objects.bulk_create([
+                Message(
+                    conversation=conversation,
+                    role='user' if turn % 2 == 0 else 'assistant',
+                    content=rng.choice(QUESTIONS) if turn % 2 == 0 else f'Here is some information about that ({turn}).'
+                )
+                for turn in range(self.history)
+            ])
+            self.plan.append((conversation.id, token, [rng.choice(QUESTIONS) for _ in range(self.turns)]))
+
+    def warm_up(self):
+        """Send one untimed message so the first measured request doesn't pay one-off costs."""
+        conversation = Conversation.objects.create(user=User.objects.get(username='bench'), title='Warm-up')
+        self._send(self._client(self.token), conversation.id, QUESTIONS[0])
+
+    def run(self):
+        pending = queue.Queue()
+        for item in self.plan:
+            pending.put(item)
+
+        started_at = time.monotonic()
+        threads = [
+            threading.Thread(target=self._work, args=(pending,), name=f'bench-user-{index}')
+            for index in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self._summarize(time.monotonic() - started_at)
+
+    def _client(self, token):
+        # The test client's default host isn't in ALLOWED_HOSTS
+        return Client(HTTP_HOST='localhost', HTTP_AUTHORIZATION=f'Token {token}')
+
+    def _work(self, pending):
+        try:
+            while True:
+                try:
+                    conversation_id, token, messages = pending.get_nowait()
+                except queue.Empty:
+                    return
+                client = self._client(token)
+                for message in messages:
+                    sample = self._send(client, conversation_id, message)
+                    with self._samples_lock:
+                        self._samples.append(sample)
+        finally:
+            connection.close()
+
+    def _send(self, client, conversation_id, message):
+        action = 'conversation-send-message-stream' if self.stream else 'conversation-send-message'
+        url = reverse(action, args=[conversation_id])
+
+        with CaptureQueriesContext(connection) as queries:
+            started_at = time.monotonic()
+            # secure=True avoids the SSL redirect when DEBUG is off
+            response = client.post(url, {'message': message}, content_type='application/json', secure=True)
+            ttft_ms = None
+            if self.stream and response.status_code == 200:
+                events = []
+                for chunk in response.streaming_content:
+                    if ttft_ms is None and chunk.startswith(b'event: token'):
+                        ttft_ms = (time.monotonic() - started_at) * 1000
+                    events.append(chunk.decode())
+                payload = self._last_event(events)
+            else:
+                payload = response.json() if response.status_code == 200 else {'error': response.status_code}
+            latency_ms = (time.monotonic() - started_at) * 1000
+
+        if response.status_code != 200 or 'error' in payload:
+            return _Sample(latency_ms, ttft_ms, 0, len(queries), error=str(payload.get('error', response.status_code)))
+
+        tokens = len(self.tokenizer.encode(payload['message'], add_special_tokens=False))
+        # Without streaming the first token reaches the client with the whole reply
+        return _Sample(latency_ms, ttft_ms if ttft_ms is not None else latency_ms, tokens, len(queries))
+
+    @staticmethod
+    def _last_event(events):
+        for event in reversed(events):
+            name, _, data = event.strip().partition('\n')
+            if name in ('event: done', 'event: error'):
+                return json.loads(data[len('data: '):])
+        return {'error': 'stream ended without a done event'}
+
+    def _summarize(self, duration):
+        ok = [sample for sample in self._samples if sample.error is None]
+        errors = [sample.error for sample in self._samples if sample.error is not None]
+        if errors:
+            logger.warning(f"{len(errors)} benchmark requests failed, first error: {errors[0]}")
+
+        generated_tokens = sum(sample.tokens for sample in ok)
+        return {
+            'requests': len(self._samples),
+            'errors': len(errors),
+            'duration_seconds': duration,
+            'requests_per_second': len(ok) / duration if duration else None,
+            'latency_ms': distribution([sample.latency_ms for sample in ok]),
+            'ttft_ms': distribution([sample.ttft_ms for sample in ok]),
+            'tokens_per_second': {
+                # What one user sees, and what the server delivers across all users
+                'per_request': distribution([
+                    sample.tokens / (sample.latency_ms / 1000) for sample in ok if sample.latency_ms
+                ]),
+                'aggregate': generated_tokens / duration if duration else None,
+            },
+            'db_queries_per_request': distribution([sample.queries for sample in self._samples]),
+            'peak_rss_mb': peak_memory_mb(),
+        }
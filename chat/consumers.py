@@ -0,0 +1,273 @@
+import asyncio
+import json
+import logging
+import math
+import re
+import time
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework.exceptions import AuthenticationFailed
+
+from .authentication import CachingTokenAuthentication
+from .models import Conversation, Message
+from .serializers import MessageSerializer
+from .services import metrics
+from .services.archive import rehydrate
+from .services.channel_layer import channel_layer
+from .services.inference_executor import LLMOverloadedError, LLMUserLimitError
+from .services.persistence import wait_for_pending
+from .streaming import reply_events, start_reply
+from .throttling import check_message_rate
+
+logger = logging.getLogger(__name__)
+
+CONVERSATION_PATH = re.compile(r'^/ws/chat/conversations/(?P<pk>\d+)/$')
+
+# Close codes past 4000 are the application's own; these mirror the HTTP statuses
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_NOT_FOUND = 4404
+CLOSE_TIMEOUT = 4408
+
+_sockets = set()
+# Replies run on after their socket closes, so they're saved and a reconnecting client can resume them
+_replies = set()
+
+metrics.CallbackMetric('chat_websocket_connections', 'Open chat WebSocket connections', lambda: len(_sockets))
+socket_messages = metrics.Counter('chat_websocket_messages_total', 'Chat messages received over WebSocket')
+
+
+class _Close(Exception):
+    def __init__(self, code, reason=''):
+        super().__init__(reason)
+        self.code = code
+        self.reason = reason
+
+
+class _Disconnected(Exception):
+    pass
+
+
+async def chat_socket(scope, receive, send):
+    """ASGI application for the chat WebSocket at ``/ws/chat/conversations/<id>/``."""
+    match = CONVERSATION_PATH.match(scope['path'])
+    if match is None:
+        await receive()
+        # Closing before accepting turns the handshake down with a 403
+        await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+        return
+    await ChatSocket(scope, receive, send, int(match['pk'])).run()
+
+
+class ChatSocket:
+    """A chat session over one WebSocket, bound to one conversation of the user it authenticated as.
+
+    Frames are JSON objects with a ``type``. The client's first frame is
+    ``{"type": "auth", "token": ..., "resume_after": <message id>}``; it
+    gets the conversation's messages newer than ``resume_after`` (if given)
+    as ``message`` frames, then ``ready``. Each
+    ``{"type": "message", "message": ..., "voice": ..., "id": ...}`` is
+    answered with the ``token``, ``speech``, ``done`` and ``error`` events
+    of send_message_stream, sent to every socket bound to the conversation
+    with the client's ``id`` as ``reply_to``. Either side may send ``ping``
+    and the other answers ``pong``.
+    """
+
+    def __init__(self, scope, receive, send, conversation_id, layer=channel_layer):
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.conversation_id = conversation_id
+        self.group = f'conversation.{conversation_id}'
+        self.layer = layer
+        self.user = None
+        self.last_seen = time.monotonic()
+
+    async def run(self):
+        if (await self.receive())['type'] != 'websocket.connect':
+            return
+        await self.send({'type': 'websocket.accept'})
+        self.channel = self.layer.new_channel()
+        _sockets.add(self)
+        # Everything sent goes through the channel, so frames from replies and heartbeats never interleave
+        forwarder = asyncio.create_task(self._forward())
+        heartbeat = None
+        try:
+            frame = await self._authenticate()
+            # Join before looking for missed messages, so nothing saved in between is lost
+            self.layer.group_add(self.group, self.channel)
+            heartbeat = asyncio.create_task(self._heartbeat())
+            await self._resume(frame.get('resume_after'))
+            await self._receive_frames()
+        except _Close as close:
+            await self._close(close.code, close.reason)
+            await forwarder
+        except _Disconnected:
+            pass
+        finally:
+            if heartbeat is not None:
+                heartbeat.cancel()
+            forwarder.cancel()
+            self.layer.discard_channel(self.channel)
+            _sockets.discard(self)
+
+    async def _authenticate(self):
+        """Wait for the ``auth`` frame and load its user and the conversation; returns the frame."""
+        try:
+            frame = await asyncio.wait_for(self._next_frame(), settings.CHAT_WS_AUTH_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            raise _Close(CLOSE_UNAUTHORIZED, 'Authentication timed out')
+        token = frame.get('token') if frame.get('type') == 'auth' else None
+        if not isinstance(token, str) or not token:
+            raise _Close(CLOSE_UNAUTHORIZED, 'Authentication credentials were not provided.')
+        try:
+            with metrics.stage('auth'):
+                self.user, _ = await sync_to_async(CachingTokenAuthentication().authenticate_credentials)(token)
+        except AuthenticationFailed as e:
+            raise _Close(CLOSE_UNAUTHORIZED, str(e.detail))
+        if not await Conversation.objects.filter(pk=self.conversation_id, user=self.user).aexists():
+            raise _Close(CLOSE_NOT_FOUND, 'Not found.')
+        return frame
+
+    async def _resume(self, after_id):
+        missed, last_id = await sync_to_async(self._load_missed)(after_id)
+        for message in missed:
+            await self._send_frame({'type': 'message', 'message': message})
+        await self._send_frame({'type': 'ready', 'conversation_id': self.conversation_id, 'last_message_id': last_id})
+
+    def _load_missed(self, after_id):
+        """The messages saved after ``after_id``, serialized, and the id of the conversation's last message."""
+        conversation = Conversation.objects.get(pk=self.conversation_id)
+        # Turns still in the write-behind queue must be visible to their own conversation
+        wait_for_pending(conversation.pk)
+        if conversation.archived_at is not None:
+            rehydrate(conversation)
+        messages = Message.objects.filter(conversation_id=conversation.pk)
+        last_id = messages.order_by('-id').values_list('id', flat=True).first()
+        if isinstance(after_id, bool) or not isinstance(after_id, int):
+            return [], last_id
+        missed = messages.filter(pk__gt=after_id).order_by('timestamp', 'id')
+        return MessageSerializer(missed, many=True).data, last_id
+
+    async def _receive_frames(self):
+        while True:
+            frame = await self._next_frame()
+            kind = frame.get('type')
+            if kind == 'message':
+                await self._start_reply(frame)
+            elif kind == 'ping':
+                await self._send_frame({'type': 'pong'})
+            elif kind != 'pong':
+                await self._send_frame({'type': 'error', 'error': 'Unknown frame type'})
+
+    async def _next_frame(self):
+        while True:
+            message = await self.receive()
+            if message['type'] == 'websocket.disconnect':
+                raise _Disconnected()
+            self.last_seen = time.monotonic()
+            try:
+                frame = json.loads(message.get('text') or message.get('bytes') or '')
+            except ValueError:
+                frame = None
+            if isinstance(frame, dict):
+                return frame
+            await self._send_frame({'type': 'error', 'error': 'Frames must be JSON objects'})
+
+    async def _start_reply(self, frame):
+        reply_to = frame.get('id')
+        message_content = frame.get('message')
+        if not isinstance(message_content, str) or not message_content.strip():
+            await self._send_frame({'type': 'error', 'reply_to': reply_to, 'error': 'Message is empty'})
+            return
+        socket_messages.inc()
+
+        wait = check_message_rate(f'user:{self.user.pk}')
+        if wait:
+            await self._send_frame({
+                'type': 'error', 'reply_to': reply_to,
+                'error': 'Request was throttled.', 'retry_after': math.ceil(wait)
+            })
+            return
+
+        speak = settings.VOICE_SYNTHESIS_ENABLED and bool(frame.get('voice'))
+        task = asyncio.create_task(
+            sync_to_async(self._run_reply, thread_sensitive=False)(message_content, speak, reply_to)
+        )
+        _replies.add(task)
+        task.add_done_callback(_replies.discard)
+
+    def _run_reply(self, message_content, speak, reply_to):
+        """Generate, publish and save one reply; runs on a worker thread of its own."""
+        group_send = async_to_sync(self.layer.group_send)
+
+        def publish(event, data):
+            group_send(self.group, {'type': event, 'reply_to': reply_to, **data})
+
+        close_old_connections()
+        try:
+            try:
+                conversation = Conversation.objects.get(pk=self.conversation_id)
+                if conversation.archived_at is not None:
+                    rehydrate(conversation)
+                llm_service, chunk_stream = start_reply(conversation, message_content, self.user.pk)
+            except LLMOverloadedError as e:
+                if isinstance(e, LLMUserLimitError):
+                    error = 'Too many messages in progress'
+                else:
+                    error = 'Server is busy generating other responses'
+                publish('error', {'error': error, 'retry_after': e.retry_after})
+                return
+            except Exception as e:
+                logger.error(f"Error in chat socket: {str(e)}")
+                publish('error', {
+                    'error': 'Failed to process message',
+                    'detail': str(e) if settings.DEBUG else 'Internal server error'
+                })
+                return
+
+            events = reply_events(
+                llm_service, conversation, message_content, chunk_stream, speak, self.build_absolute_uri
+            )
+            for event, data in events:
+                publish(event, data)
+        finally:
+            close_old_connections()
+
+    async def _heartbeat(self):
+        interval = settings.CHAT_WS_HEARTBEAT_SECONDS
+        while True:
+            await asyncio.sleep(interval)
+            if time.monotonic() - self.last_seen > 2 * interval:
+                logger.info(f"Closing chat socket of conversation {self.conversation_id} after missed heartbeats")
+                await self._close(CLOSE_TIMEOUT, 'Heartbeat timeout')
+                return
+            await self._send_frame({'type': 'ping'})
+
+    async def _forward(self):
+        while True:
+            message = await self.layer.receive(self.channel)
+            try:
+                if message['type'] == 'websocket.close':
+                    await self.send(message)
+                    return
+                await self.send({'type': 'websocket.send', 'text': json.dumps(message)})
+            except Exception as e:
+                # The client went away; the receive side notices and cleans up
+                logger.debug(f"Chat socket send failed: {str(e)}")
+                return
+
+    async def _send_frame(self, frame):
+        await self.layer.send(self.channel, frame)
+
+    async def _close(self, code, reason=''):
+        await self.layer.send(self.channel, {'type': 'websocket.close', 'code': code, 'reason': reason})
+
+    def build_absolute_uri(self, path):
+        headers = dict(self.scope.get('headers') or ())
+        host = headers.get(b'host', b'')
+        if settings.USE_X_FORWARDED_HOST and b'x-forwarded-host' in headers:
+            host = headers[b'x-forwarded-host'].split(b',')[0].strip()
+        scheme = 'https' if self.scope.get('scheme') == 'wss' else 'http'
+        return f"{scheme}://{host.decode('latin-1')}{path}"
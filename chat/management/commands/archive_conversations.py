@@ -0,0 +1,47 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat.models import Conversation
+from chat.services.archive import archive_conversations, get_archive
+
+
+class Command(BaseCommand):
+    help = 'Moves the messages of idle conversations out of the database into compressed archive segments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--idle-days', type=float, default=settings.CHAT_ARCHIVE_IDLE_DAYS,
+                            help='Archive conversations not updated for this many days (default: CHAT_ARCHIVE_IDLE_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Conversations archived per transaction')
+        parser.add_argument('--limit', type=int, default=0, help='Stop after this many conversations; 0 for no limit')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the conversations that would be archived')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - datetime.timedelta(days=options['idle_days'])
+        idle = Conversation.objects.filter(archived_at__isnull=True, updated_at__lt=cutoff, messages__isnull=False).distinct()
+
+        if options['dry_run']:
+            self.stdout.write(f'{idle.count()} conversations idle since {cutoff:%Y-%m-%d %H:%M} would be archived')
+            return
+
+        archive = get_archive()
+        archived = selected = 0
+        last_pk = 0
+        while not options['limit'] or selected < options['limit']:
+            batch_size = options['batch_size']
+            if options['limit']:
+                batch_size = min(batch_size, options['limit'] - selected)
+            batch = list(idle.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            selected += len(batch)
+            archived += archive_conversations(batch, archive)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {archived} conversations idle since {cutoff:%Y-%m-%d %H:%M} into {archive.directory}'
+            + (f' ({selected - archived} changed meanwhile and were skipped)' if selected > archived else '')
+        ))
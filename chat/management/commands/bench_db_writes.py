@@ -0,0 +1,137 @@
+import json
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+
+from chat.benchmark import distribution, throwaway_database
+from chat.models import Conversation, Message
+from chat.services.persistence import save_turn, touch_conversation
+
+REPLY = "Thank you for your question. " * 10
+
+
+def _save_separately(conversation, user_content, ai_content):
+    # How turns were written before save_turn: three autocommitted writes
+    Message.objects.create(conversation=conversation, content=user_content, role='user')
+    Message.objects.create(conversation=conversation, content=ai_content, role='assistant')
+    touch_conversation(conversation)
+
+
+MODES = {
+    'turn': save_turn,
+    'separate': _save_separately,
+}
+
+
+class Command(BaseCommand):
+    help = 'Measures chat turn writes under contention from concurrent writers (and readers) and prints JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=16, help='Threads writing turns at once')
+        parser.add_argument('--readers', type=int, default=4,
+                            help='Threads loading conversation history while the writers run')
+        parser.add_argument('--turns', type=int, default=50, help='Turns written per writer')
+        parser.add_argument('--modes', default=','.join(MODES),
+                            help='Comma-separated write paths to compare: turn (one transaction), separate')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        report = {'config': {key: options[key] for key in ('writers', 'readers', 'turns')}, 'results': {}}
+        with throwaway_database():
+            report['database'] = self._describe_database()
+            for mode in options['modes'].split(','):
+                report['results'][mode] = self._run(MODES[mode.strip()], options)
+                results = report['results'][mode]
+                self.stderr.write(
+                    f"{mode}: {results['turns_per_second']:.0f} turns/s, "
+                    f"p95 {results['write_latency_ms']['p95'] or 0:.1f}ms, "
+                    f"p99 {results['write_latency_ms']['p99'] or 0:.1f}ms, {results['errors']} errors"
+                )
+
+        rendered = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(rendered + '\n')
+        else:
+            self.stdout.write(rendered)
+
+    def _describe_database(self):
+        description = {'vendor': connection.vendor}
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                description['journal_mode'] = cursor.execute('PRAGMA journal_mode').fetchone()[0]
+                description['busy_timeout_ms'] = cursor.execute('PRAGMA busy_timeout').fetchone()[0]
+        return description
+
+    def _run(self, write_turn, options):
+        user, _ = User.objects.get_or_create(username='bench')
+        conversations = [
+            Conversation.objects.create(user=user, title=f'Writer {index}') for index in range(options['writers'])
+        ]
+        write_latencies = []
+        read_latencies = []
+        errors = []
+        lock = threading.Lock()
+        writers_done = threading.Event()
+        start = threading.Barrier(options['writers'] + options['readers'])
+
+        def write(conversation):
+            try:
+                start.wait()
+                for turn in range(options['turns']):
+                    started_at = time.perf_counter()
+                    try:
+                        write_turn(conversation, f'Question {turn}', REPLY)
+                    except OperationalError as e:
+                        with lock:
+                            errors.append(str(e))
+                        continue
+                    with lock:
+                        write_latencies.append((time.perf_counter() - started_at) * 1000)
+            finally:
+                connection.close()
+
+        def read():
+            try:
+                start.wait()
+                turn = 0
+                while not writers_done.is_set():
+                    conversation = conversations[turn % len(conversations)]
+                    turn += 1
+                    started_at = time.perf_counter()
+                    try:
+                        list(conversation.messages.order_by('-timestamp').values('id', 'content', 'role')[:50])
+                    except OperationalError as e:
+                        with lock:
+                            errors.append(str(e))
+                        continue
+                    with lock:
+                        read_latencies.append((time.perf_counter() - started_at) * 1000)
+            finally:
+                connection.close()
+
+        writers = [threading.Thread(target=write, args=(conversation,)) for conversation in conversations]
+        readers = [threading.Thread(target=read) for _ in range(options['readers'])]
+        for thread in writers + readers:
+            thread.start()
+        started_at = time.perf_counter()
+        for thread in writers:
+            thread.join()
+        duration = time.perf_counter() - started_at
+        writers_done.set()
+        for thread in readers:
+            thread.join()
+
+        return {
+            'turns': len(write_latencies),
+            'errors': len(errors),
+            'first_error': errors[0] if errors else None,
+            'duration_seconds': duration,
+            'turns_per_second': len(write_latencies) / duration if duration else 0,
+            'write_latency_ms': distribution(write_latencies),
+            'read_latency_ms': distribution(read_latencies),
+            'reads': len(read_latencies),
+        }
@@ -0,0 +1,145 @@
+import json
+import os
+import platform
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from chat.benchmark import LoadTestHarness, throwaway_database
+from chat.services.llm_service import LLMService
+
+# Metrics compared against --baseline: (path, True if higher is worse)
+REGRESSION_CHECKS = [
+    (('latency_ms', 'p95'), True),
+    (('ttft_ms', 'p95'), True),
+    (('tokens_per_second', 'aggregate'), False),
+    (('db_queries_per_request', 'mean'), True),
+    (('peak_rss_mb',), True),
+]
+
+
+class Command(BaseCommand):
+    help = 'Load-tests the send_message endpoint and reports latency, throughput, DB queries and memory as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', default=settings.LLM_BACKEND,
+                            help="LLM backend to load; use 'stub' in CI to skip downloading a model")
+        parser.add_argument('--model', default=settings.LLM_MODEL, help='Model to load (default: LLM_MODEL)')
+        parser.add_argument('--draft-model', default=settings.LLM_DRAFT_MODEL,
+                            help="Draft model for speculative decoding; '' to benchmark without it")
+        parser.add_argument('--concurrency', type=int, default=4, help='Simulated users sending at once')
+        parser.add_argument('--conversations', type=int, default=8, help='Conversations to work through')
+        parser.add_argument('--turns', type=int, default=5, help='Messages sent per conversation')
+        parser.add_argument('--history', type=int, default=0,
+                            help='Messages each conversation already has before the first timed turn')
+        parser.add_argument('--stream', action='store_true',
+                            help='Use send_message_stream and measure time to first token')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the generated conversations')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+        parser.add_argument('--baseline', help='Previous JSON report to compare against; fails on regressions')
+        parser.add_argument('--tolerance', type=float, default=0.1,
+                            help='Allowed relative change against --baseline (default: 0.1)')
+
+    def handle(self, *args, **options):
+        with override_settings(
+            LLM_BACKEND=options['backend'],
+            LLM_MODEL=options['model'],
+            LLM_DRAFT_MODEL=options['draft_model'],
+            # Simulated users send as fast as replies come back; the rate limit would only measure itself
+            CHAT_RATE_LIMIT_PER_MINUTE=0
+        ):
+            report = self._run(options)
+
+        rendered = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(rendered + '\n')
+        else:
+            self.stdout.write(rendered)
+
+        results = report['results']
+        self.stderr.write(
+            f"{results['requests']} requests, {results['errors']} errors: "
+            f"p50 {results['latency_ms']['p50'] or 0:.0f}ms, p95 {results['latency_ms']['p95'] or 0:.0f}ms, "
+            f"{results['tokens_per_second']['aggregate'] or 0:.1f} tokens/s, "
+            f"{results['db_queries_per_request']['mean'] or 0:.1f} queries/request, "
+            f"peak RSS {results['peak_rss_mb']:.0f}MB"
+        )
+
+        if options['baseline']:
+            self._compare(results, options['baseline'], options['tolerance'])
+
+    def _run(self, options):
+        try:
+            llm_service = LLMService.preload()
+        except Exception as e:
+            raise CommandError(f'Failed to load LLM: {str(e)}')
+
+        with throwaway_database():
+            harness = LoadTestHarness(
+                llm_service.tokenizer,
+                concurrency=options['concurrency'],
+                conversations=options['conversations'],
+                turns=options['turns'],
+                history=options['history'],
+                stream=options['stream'],
+                seed=options['seed']
+            )
+            harness.setup()
+            harness.warm_up()
+            results = harness.run()
+            if llm_service.speculative is not None:
+                results['speculative'] = llm_service.speculative.get_stats()
+            if llm_service.single_flight is not None:
+                results['single_flight'] = llm_service.single_flight.get_stats()
+
+        return {
+            'config': {
+                key: options[key]
+                for key in ('backend', 'model', 'draft_model', 'concurrency', 'conversations', 'turns', 'history', 'stream', 'seed')
+            },
+            'environment': self._environment(),
+            'load_seconds': LLMService.status()['load_seconds'],
+            'results': results,
+        }
+
+    def _environment(self):
+        import torch
+        import transformers
+        import django
+
+        return {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'torch': torch.__version__,
+            'transformers': transformers.__version__,
+            'database': connection.vendor,
+            'cpu_count': os.cpu_count(),
+            'torch_threads': torch.get_num_threads(),
+        }
+
+    def _compare(self, results, baseline_path, tolerance):
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+
+        regressions = []
+        for path, higher_is_worse in REGRESSION_CHECKS:
+            current, previous = results, baseline
+            for key in path:
+                # A metric missing on either side, at any level, is skipped
+                if not isinstance(current, dict) or not isinstance(previous, dict):
+                    current = previous = None
+                    break
+                current, previous = current.get(key), previous.get(key)
+            if current is None or not previous:
+                continue
+
+            change = (current - previous) / previous
+            if (change if higher_is_worse else -change) > tolerance:
+                regressions.append(f"{'.'.join(path)}: {previous:.2f} -> {current:.2f} ({change:+.0%})")
+
+        if regressions:
+            raise CommandError('Regressions against baseline:\n  ' + '\n  '.join(regressions))
+        self.stderr.write(self.style.SUCCESS(f'No regressions against {baseline_path}'))
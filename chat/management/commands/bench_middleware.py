@@ -0,0 +1,115 @@
+import gc
+import json
+import time
+
+from django.conf import settings
+from django.core.handlers.base import BaseHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.urls import path
+from django.utils.module_loading import import_string
+
+from chat.benchmark import distribution
+
+ORIGIN = 'http://localhost:5500'
+
+
+def _empty_view(request):
+    return HttpResponse('{}', content_type='application/json')
+
+
+# Requests resolve against this instead of the project's URLs, so only middleware and routing are timed
+urlpatterns = [path('chat/conversations/', _empty_view)]
+
+SCENARIOS = {
+    # A chat API call from the frontend
+    'cors_get': lambda factory: factory.get(
+        '/chat/conversations/', HTTP_ORIGIN=ORIGIN, HTTP_AUTHORIZATION='Token x', secure=True
+    ),
+    'preflight': lambda factory: factory.options(
+        '/chat/conversations/', HTTP_ORIGIN=ORIGIN, HTTP_ACCESS_CONTROL_REQUEST_METHOD='POST',
+        HTTP_ACCESS_CONTROL_REQUEST_HEADERS='authorization, content-type', secure=True
+    ),
+    'same_origin_get': lambda factory: factory.get('/chat/conversations/', secure=True),
+}
+
+
+class Command(BaseCommand):
+    help = 'Times the middleware stack per request against an empty view and prints JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=5000, help='Requests per timed round')
+        parser.add_argument('--repeats', type=int, default=5,
+                            help='Timed rounds per scenario; percentiles are over the rounds')
+        parser.add_argument('--cors', action='append', default=[],
+                            help='Dotted path of another CORS middleware to put in place of the configured '
+                                 'one for comparison, e.g. corsheaders.middleware.CorsMiddleware (repeatable)')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        configured = list(settings.MIDDLEWARE)
+        cors = next((name for name in configured if name.endswith('CorsMiddleware')), None)
+        stacks = {'configured': configured}
+        if cors is not None:
+            stacks['without_cors'] = [name for name in configured if name != cors]
+        for alternative in options['cors']:
+            try:
+                import_string(alternative)
+            except ImportError as e:
+                raise CommandError(f"Can't import {alternative}: {e}")
+            if cors is None:
+                stacks[alternative] = [alternative] + configured
+            else:
+                stacks[alternative] = [alternative if name == cors else name for name in configured]
+
+        report = {
+            'config': {'iterations': options['iterations'], 'repeats': options['repeats'], 'middleware': configured},
+            'results': {},
+        }
+        factory = RequestFactory(HTTP_HOST='localhost')
+        for stack_name, middleware in stacks.items():
+            report['results'][stack_name] = {}
+            for scenario, build_request in SCENARIOS.items():
+                result = self._time(middleware, factory, build_request, options['iterations'], options['repeats'])
+                report['results'][stack_name][scenario] = result
+                self.stderr.write(
+                    f"{stack_name} {scenario}: {result['us_per_request']['p50']:.1f}us/request, "
+                    f"status {result['status']}, {result['headers']} headers"
+                )
+
+        rendered = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(rendered + '\n')
+        else:
+            self.stdout.write(rendered)
+
+    def _time(self, middleware, factory, build_request, iterations, repeats):
+        # Middleware read their settings when the handler is built, so build it inside the override
+        with override_settings(MIDDLEWARE=middleware, ROOT_URLCONF=__name__):
+            handler = BaseHandler()
+            handler.load_middleware()
+            # Warm up, and keep a response to report what the stack answered
+            response = handler.get_response(build_request(factory))
+
+            rounds = []
+            for _ in range(repeats):
+                # Requests are built up front so only handling them is timed
+                requests = [build_request(factory) for _ in range(iterations)]
+                # As timeit does, keep collector pauses out of the numbers
+                gc.disable()
+                try:
+                    started_at = time.perf_counter()
+                    for request in requests:
+                        handler.get_response(request)
+                    rounds.append((time.perf_counter() - started_at) / iterations * 1e6)
+                finally:
+                    gc.enable()
+
+        return {
+            'us_per_request': distribution(rounds),
+            'status': response.status_code,
+            'headers': len(response.headers),
+            'cors_headers': sorted(name for name in response.headers if name.lower().startswith('access-control')),
+        }
@@ -0,0 +1,134 @@
+import json
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.services.backends import BACKENDS, get_backend
+from chat.services.llm_service import resident_memory_mb
+
+PROMPTS = [
+    "User: Hello, who are you?\nAssistant:",
+    "User: How do I renew my passport?\nAssistant:",
+    "User: What are the opening hours of the town hall?\nAssistant:",
+]
+
+
+class Command(BaseCommand):
+    help = 'Compares latency, throughput and memory of the LLM inference backends side by side'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backends', default=','.join(name for name in BACKENDS if name != 'stub'),
+                            help='Comma-separated backends to compare (default: all but stub)')
+        parser.add_argument('--model', default=settings.LLM_MODEL, help='Model to load (default: LLM_MODEL)')
+        parser.add_argument('--runs', type=int, default=3, help='Timed passes over the prompt set')
+        parser.add_argument('--max-new-tokens', type=int, default=64)
+        parser.add_argument('--json', action='store_true', help='Print results as JSON')
+        # Internal: measure one backend in this process; the parent runs one subprocess per backend
+        # so memory numbers aren't polluted by the previously loaded models
+        parser.add_argument('--single', help='Measure only this backend in-process and print JSON')
+
+    def handle(self, *args, **options):
+        if options['single']:
+            self.stdout.write(json.dumps(self._measure(options['single'], options)))
+            return
+
+        results = []
+        for name in [backend.strip() for backend in options['backends'].split(',') if backend.strip()]:
+            if name not in BACKENDS:
+                raise CommandError(f"Unknown backend '{name}', expected one of: {', '.join(BACKENDS)}")
+            self.stderr.write(f'Measuring {name} backend...')
+            completed = subprocess.run(
+                [
+                    sys.executable, '-m', 'django', 'compare_llm_backends',
+                    '--single', name,
+                    '--model', options['model'],
+                    '--runs', str(options['runs']),
+                    '--max-new-tokens', str(options['max_new_tokens']),
+                ],
+                cwd=settings.BASE_DIR,
+                capture_output=True,
+                text=True,
+            )
+            if completed.returncode != 0:
+                error = completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else 'unknown error'
+                results.append({'backend': name, 'error': error})
+                continue
+            results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+        reference = next((r for r in results if r.get('backend') == 'transformers' and 'error' not in r), None)
+        for result in results:
+            if reference is not None and 'error' not in result:
+                result['matches_reference'] = result['outputs'] == reference['outputs']
+                result['speedup'] = reference['mean_latency_seconds'] / result['mean_latency_seconds']
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self._print_table(results)
+
+    def _measure(self, name, options):
+        backend = get_backend(name)
+        started_at = time.monotonic()
+        model = backend.load_model(options['model'], settings.HF_API_TOKEN)
+        tokenizer = backend.load_tokenizer(options['model'], settings.HF_API_TOKEN)
+        load_seconds = time.monotonic() - started_at
+
+        def generate(prompt):
+            inputs = tokenizer(prompt, return_tensors='pt')
+            started_at = time.monotonic()
+            output_ids = model.generate(
+                **inputs,
+                max_new_tokens=options['max_new_tokens'],
+                do_sample=False,
+                pad_token_id=tokenizer.eos_token_id
+            )
+            new_tokens = output_ids[0, inputs['input_ids'].shape[1]:]
+            return time.monotonic() - started_at, len(new_tokens), tokenizer.decode(new_tokens, skip_special_tokens=True)
+
+        # The first call includes one-off costs (compilation, session warm-up); report it separately
+        first_generation_seconds, _, _ = generate(PROMPTS[0])
+
+        latencies = []
+        generated_tokens = 0
+        outputs = []
+        for run in range(options['runs']):
+            for prompt in PROMPTS:
+                latency, tokens, text = generate(prompt)
+                latencies.append(latency)
+                generated_tokens += tokens
+                if run == 0:
+                    outputs.append(text)
+
+        return {
+            'backend': name,
+            'model': options['model'],
+            'load_seconds': load_seconds,
+            'first_generation_seconds': first_generation_seconds,
+            'mean_latency_seconds': statistics.mean(latencies),
+            'p50_latency_seconds': statistics.median(latencies),
+            'tokens_per_second': generated_tokens / sum(latencies),
+            'resident_memory_mb': resident_memory_mb(),
+            # ru_maxrss is in kilobytes on Linux
+            'peak_memory_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'outputs': outputs,
+        }
+
+    def _print_table(self, results):
+        header = f"{'backend':<14}{'load s':>9}{'first s':>9}{'mean s':>9}{'p50 s':>9}{'tok/s':>9}{'RSS MB':>9}{'peak MB':>9}{'speedup':>9}  same output"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for r in results:
+            if 'error' in r:
+                self.stdout.write(f"{r['backend']:<14}failed: {r['error']}")
+                continue
+            self.stdout.write(
+                f"{r['backend']:<14}{r['load_seconds']:>9.2f}{r['first_generation_seconds']:>9.2f}"
+                f"{r['mean_latency_seconds']:>9.3f}{r['p50_latency_seconds']:>9.3f}{r['tokens_per_second']:>9.1f}"
+                f"{r['resident_memory_mb']:>9.0f}{r['peak_memory_mb']:>9.0f}"
+                f"{r.get('speedup', float('nan')):>9.2f}  {r.get('matches_reference', 'n/a')}"
+            )
@@ -0,0 +1,37 @@
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.services.llm_service import LLMService, resident_memory_mb
+
+
+class Command(BaseCommand):
+    help = 'Loads the LLM (downloading it into the local cache if needed) and optionally runs a warm-up generation'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--generate',
+            action='store_true',
+            help='Run one short generation after loading so the first real request is not the slowest',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            llm_service = LLMService.preload()
+        except Exception as e:
+            raise CommandError(f'Failed to load LLM: {str(e)}')
+
+        status = LLMService.status()
+        self.stdout.write(self.style.SUCCESS(
+            f'Loaded "{status["model"]}" in {status["load_seconds"]:.1f}s '
+            f'(resident memory {resident_memory_mb():.0f}MB)'
+        ))
+
+        if options['generate']:
+            started_at = time.monotonic()
+            asyncio.run(llm_service.get_response('Hello', []))
+            self.stdout.write(self.style.SUCCESS(
+                f'Warm-up generation took {time.monotonic() - started_at:.1f}s '
+                f'(resident memory {resident_memory_mb():.0f}MB)'
+            ))
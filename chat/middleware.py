@@ -1,40 +1,82 @@
-from django.middleware.csrf import CsrfViewMiddleware
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.conf import settings
 from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
 import logging
 
 logger = logging.getLogger(__name__)
 
-class ApiCSRFMiddleware(CsrfViewMiddleware):
-    def _add_cors_headers(self, response, request):
-        origin = request.headers.get('Origin', '')
-        
-        # Check if origin is in allowed origins
-        if origin in settings.CORS_ALLOWED_ORIGINS:
-            response['Access-Control-Allow-Origin'] = origin
-            response['Access-Control-Allow-Credentials'] = 'true'
-            response['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
-            response['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-Requested-With'
-            
-            # Log successful CORS handling
-            logger.debug(f"CORS headers added for origin: {origin}")
-        else:
-            logger.warning(f"Origin not allowed: {origin}")
-            
-        return response
+class CorsMiddleware:
+    """Adds CORS headers and answers preflight requests; keep it first in MIDDLEWARE.
 
-    def process_view(self, request, callback, callback_args, callback_kwargs):
-        # Skip CSRF check for login endpoint
-        if request.path.startswith('/chat/login/'):
-            return None
-            
-        # Handle OPTIONS requests
-        if request.method == 'OPTIONS':
-            response = self._add_cors_headers(HttpResponse(), request)
+    Everything it needs from the CORS_* settings is worked out once at
+    startup, so a request costs a set lookup and a few header assignments.
+    Preflights are answered here, before any other middleware or URL
+    resolution, and ``CORS_PREFLIGHT_MAX_AGE`` lets browsers skip them for
+    repeat calls.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+        self.allow_all_origins = getattr(settings, 'CORS_ALLOW_ALL_ORIGINS', False)
+        self.allow_credentials = getattr(settings, 'CORS_ALLOW_CREDENTIALS', False)
+        self.allowed_origins = frozenset(origin.rstrip('/') for origin in getattr(settings, 'CORS_ALLOWED_ORIGINS', ()))
+        # With credentials the origin has to be echoed back; '*' isn't accepted
+        self.wildcard = self.allow_all_origins and not self.allow_credentials
+
+        self.response_headers = {}
+        if self.allow_credentials:
+            self.response_headers['Access-Control-Allow-Credentials'] = 'true'
+        expose_headers = getattr(settings, 'CORS_EXPOSE_HEADERS', ())
+        if expose_headers:
+            self.response_headers['Access-Control-Expose-Headers'] = ', '.join(expose_headers)
+
+        self.preflight_headers = {
+            'Access-Control-Allow-Methods': ', '.join(settings.CORS_ALLOW_METHODS),
+            'Access-Control-Allow-Headers': ', '.join(settings.CORS_ALLOW_HEADERS),
+        }
+        max_age = getattr(settings, 'CORS_PREFLIGHT_MAX_AGE', 0)
+        if max_age:
+            self.preflight_headers['Access-Control-Max-Age'] = str(max_age)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if self._is_preflight(request):
+            return self._add_headers(request, HttpResponse(headers={'Content-Length': '0'}))
+        return self._add_headers(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        if self._is_preflight(request):
+            return self._add_headers(request, HttpResponse(headers={'Content-Length': '0'}))
+        return self._add_headers(request, await self.get_response(request))
+
+    @staticmethod
+    def _is_preflight(request):
+        return request.method == 'OPTIONS' and 'access-control-request-method' in request.headers
+
+    def _add_headers(self, request, response):
+        # Responses differ by Origin, so shared caches mustn't mix them up
+        patch_vary_headers(response, ('Origin',))
+
+        origin = request.headers.get('Origin')
+        if not origin:
+            return response
+        if not self.allow_all_origins and origin not in self.allowed_origins:
+            # Browsers block the response without an Allow-Origin header; nothing else to do
             return response
-            
-        return super().process_view(request, callback, callback_args, callback_kwargs)
 
-    def process_response(self, request, response):
-        response = super().process_response(request, response)
-        return self._add_cors_headers(response, request)
\ No newline at end of file
+        response['Access-Control-Allow-Origin'] = '*' if self.wildcard else origin
+        for name, value in self.response_headers.items():
+            response[name] = value
+        if request.method == 'OPTIONS':
+            for name, value in self.preflight_headers.items():
+                response[name] = value
+        return response
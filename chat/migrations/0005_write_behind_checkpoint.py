@@ -0,0 +1,21 @@
+# Generated by Django 5.1.2 on 2026-10-17 20:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_message_conversation_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WriteBehindCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('journal_id', models.CharField(max_length=64, unique=True)),
+                ('last_seq', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
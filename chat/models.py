@@ -1,11 +1,20 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class Conversation(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     title = models.CharField(max_length=255, blank=True)
+    # Rolling summary of the turns that no longer fit in the prompt
+    summary = models.TextField(blank=True, default='')
+    summary_last_message_id = models.BigIntegerField(null=True, blank=True)
+    # Set while the messages live in an archive segment instead of the message table
+    archived_at = models.DateTimeField(null=True, blank=True)
+    archive_segment = models.CharField(max_length=255, blank=True, default='')
+    archive_offset = models.BigIntegerField(null=True, blank=True)
+    archive_length = models.BigIntegerField(null=True, blank=True)
 
     class Meta:
         ordering = ['-updated_at']
@@ -20,7 +29,17 @@ class Message(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
     content = models.TextField()
     role = models.CharField(max_length=10, choices=ROLE_CHOICES, default='user')
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add, so rehydrated messages keep their original time
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     
     class Meta:
-        ordering = ['timestamp']
\ No newline at end of file
+        ordering = ['timestamp']
+        indexes = [
+            # Serves "latest N messages of a conversation" without scanning or sorting
+            models.Index(fields=['conversation', 'timestamp'], name='message_conv_timestamp_idx'),
+        ]
+
+class WriteBehindCheckpoint(models.Model):
+    """Last journal entry the write-behind queue committed, updated in the same transaction as the messages."""
+    journal_id = models.CharField(max_length=64, unique=True)
+    last_seq = models.BigIntegerField(default=0)
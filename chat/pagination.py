@@ -0,0 +1,67 @@
+from rest_framework.pagination import BasePagination, CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class ConversationCursorPagination(CursorPagination):
+    # id breaks ties so cursors stay stable when updated_at collides
+    ordering = ('-updated_at', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class MessageCursorPagination(CursorPagination):
+    ordering = ('timestamp', 'id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class SearchPagination(BasePagination):
+    """Page-numbered results without a COUNT; one extra row tells whether there's a next page.
+
+    Expects ``fetch(limit, offset)`` rather than a queryset, since search
+    results come from raw full-text queries.
+    """
+    page_size = 20
+    max_page_size = 50
+    page_query_param = 'page'
+    page_size_query_param = 'page_size'
+
+    def paginate_results(self, fetch, request):
+        self.request = request
+        self.page_size = self._get_int(request, self.page_size_query_param, self.page_size, self.max_page_size)
+        self.page = self._get_int(request, self.page_query_param, 1)
+        rows = fetch(self.page_size + 1, (self.page - 1) * self.page_size)
+        self.has_next = len(rows) > self.page_size
+        return rows[:self.page_size]
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.page_query_param, self.page + 1)
+
+    def get_previous_link(self):
+        if self.page <= 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.page == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, self.page - 1)
+
+    def _get_int(self, request, param, default, maximum=None):
+        try:
+            value = int(request.query_params[param])
+        except (KeyError, ValueError):
+            return default
+        if value < 1:
+            return default
+        return min(value, maximum) if maximum else value
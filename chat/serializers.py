@@ -11,4 +11,36 @@ class ConversationSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Conversation
-        fields = ['id', 'title', 'created_at', 'updated_at', 'messages'] 
\ No newline at end of file
+        fields = ['id', 'title', 'created_at', 'updated_at', 'messages']
+
+class ConversationListSerializer(serializers.ModelSerializer):
+    """Conversation without its messages; counts and preview come from queryset annotations."""
+    message_count = serializers.IntegerField(read_only=True)
+    last_message = serializers.SerializerMethodField()
+    # Archived conversations have no messages to count or preview until they're opened
+    archived = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = Conversation
+        fields = ['id', 'title', 'created_at', 'updated_at', 'message_count', 'last_message', 'archived']
+    
+    def get_last_message(self, obj):
+        if obj.last_message_role is None:
+            return None
+        return {
+            'role': obj.last_message_role,
+            'content': obj.last_message_preview,
+        }
+    
+    def get_archived(self, obj):
+        return obj.archived_at is not None
+
+class MessageSearchResultSerializer(serializers.Serializer):
+    """A message matching a search; ``snippet`` is HTML-escaped with matches in ``<mark>``."""
+    id = serializers.IntegerField()
+    conversation_id = serializers.IntegerField()
+    conversation_title = serializers.CharField()
+    role = serializers.CharField()
+    timestamp = serializers.DateTimeField()
+    snippet = serializers.CharField()
+    rank = serializers.FloatField()
@@ -0,0 +1,250 @@
+import contextlib
+import fcntl
+import gzip
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from ..models import Conversation, Message
+from . import metrics
+from .history import history_cache
+from .persistence import write_lock
+
+logger = logging.getLogger(__name__)
+
+archived_conversations = metrics.Counter(
+    'chat_archived_conversations_total', 'Conversations moved from the message table to archive segments'
+)
+rehydrated_conversations = metrics.Counter(
+    'chat_rehydrated_conversations_total', 'Archived conversations moved back into the message table on access'
+)
+
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.jsonl.gz'
+
+
+def conversation_record(conversation, messages):
+    """The JSON object a conversation is archived and exported as; ``messages`` are Message objects or dicts."""
+    return {
+        'id': conversation.pk,
+        'title': conversation.title,
+        'created_at': conversation.created_at.isoformat(),
+        'updated_at': conversation.updated_at.isoformat(),
+        'summary': conversation.summary,
+        'summary_last_message_id': conversation.summary_last_message_id,
+        'messages': [_message_record(message) for message in messages],
+    }
+
+
+def _message_record(message):
+    if isinstance(message, dict):
+        return message
+    return {
+        'id': message.pk,
+        'role': message.role,
+        'content': message.content,
+        'timestamp': message.timestamp.isoformat(),
+    }
+
+
+class ConversationArchive:
+    """Append-only segment files holding archived conversations.
+
+    Each conversation is one JSON line compressed as its own gzip member, so
+    a segment is a valid ``.jsonl.gz`` file as a whole while a single
+    conversation can be read back from its offset and length alone. A new
+    segment is started once the current one reaches ``segment_bytes``.
+    """
+
+    def __init__(self, directory, segment_bytes):
+        self.directory = str(directory)
+        self.segment_bytes = segment_bytes
+
+    @contextlib.contextmanager
+    def writer(self):
+        """Lock the archive for appending; yields an ``append(record)`` function returning ``(segment, offset, length)``.
+
+        Everything appended is fsynced before the block exits, so callers may
+        drop the archived rows afterwards.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock_file:
+            # One archiving job at a time, across processes
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            segment, segment_file = None, None
+            try:
+                def append(record):
+                    nonlocal segment, segment_file
+                    if segment_file is None or segment_file.tell() >= self.segment_bytes:
+                        if segment_file is not None:
+                            self._sync(segment_file)
+                            segment_file.close()
+                        segment = self._current_segment()
+                        segment_file = open(self._path(segment), 'ab')
+                    line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+                    data = gzip.compress(line.encode('utf-8'), mtime=0)
+                    offset = segment_file.tell()
+                    segment_file.write(data)
+                    return segment, offset, len(data)
+
+                yield append
+            finally:
+                if segment_file is not None:
+                    self._sync(segment_file)
+                    segment_file.close()
+
+    def read(self, segment, offset, length):
+        with open(self._path(segment), 'rb') as segment_file:
+            segment_file.seek(offset)
+            data = segment_file.read(length)
+        if len(data) != length:
+            raise ValueError(f"Archive segment {segment} is truncated at offset {offset}")
+        return json.loads(gzip.decompress(data))
+
+    def _current_segment(self):
+        segments = sorted(
+            name for name in os.listdir(self.directory)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+        )
+        if segments and os.path.getsize(self._path(segments[-1])) < self.segment_bytes:
+            return segments[-1]
+        # Names sort in creation order
+        return f'{SEGMENT_PREFIX}{time.strftime("%Y%m%d-%H%M%S")}-{time.time_ns() % 10**9:09d}{SEGMENT_SUFFIX}'
+
+    def _path(self, segment):
+        # Segment names come from the database; never let one point outside the archive
+        return os.path.join(self.directory, os.path.basename(segment))
+
+    def _sync(self, segment_file):
+        segment_file.flush()
+        os.fsync(segment_file.fileno())
+
+
+def get_archive():
+    return ConversationArchive(settings.CHAT_ARCHIVE_DIR, settings.CHAT_ARCHIVE_SEGMENT_MB * 1024 * 1024)
+
+
+def archive_conversations(conversations, archive=None):
+    """Move the messages of ``conversations`` into archive segments, leaving the conversation rows as stubs.
+
+    A conversation that changed after it was selected is left alone. Returns
+    the number of conversations archived.
+    """
+    archive = archive or get_archive()
+    conversations = [conversation for conversation in conversations if conversation.archived_at is None]
+    messages_by_conversation = {conversation.pk: [] for conversation in conversations}
+    for message in Message.objects.filter(conversation__in=conversations).order_by('conversation', 'timestamp', 'id'):
+        messages_by_conversation[message.conversation_id].append(message)
+
+    locations = {}
+    with archive.writer() as append:
+        for conversation in conversations:
+            messages = messages_by_conversation[conversation.pk]
+            if messages:
+                locations[conversation.pk] = append(conversation_record(conversation, messages))
+
+    archived = []
+    now = timezone.now()
+    with write_lock(), transaction.atomic():
+        for conversation in conversations:
+            if conversation.pk not in locations:
+                continue
+            segment, offset, length = locations[conversation.pk]
+            # Unchanged since it was read, or a turn came in meanwhile and it's not idle any more
+            updated = Conversation.objects.filter(
+                pk=conversation.pk, updated_at=conversation.updated_at, archived_at__isnull=True
+            ).update(archived_at=now, archive_segment=segment, archive_offset=offset, archive_length=length)
+            if not updated:
+                continue
+            # Only what went into the segment; anything newer stays hot and is merged back on rehydration
+            last_id = max(message.pk for message in messages_by_conversation[conversation.pk])
+            Message.objects.filter(conversation_id=conversation.pk, pk__lte=last_id).delete()
+            archived.append(conversation.pk)
+
+    for conversation_id in archived:
+        history_cache.invalidate(conversation_id)
+    archived_conversations.inc(len(archived))
+    return len(archived)
+
+
+def read_archived(conversation, archive=None):
+    """The archived record of ``conversation``, without moving it back into the database."""
+    archive = archive or get_archive()
+    return archive.read(conversation.archive_segment, conversation.archive_offset, conversation.archive_length)
+
+
+def rehydrate(conversation, archive=None):
+    """Move an archived conversation's messages back into the message table; a no-op if it isn't archived.
+
+    Updates ``conversation`` in place and returns True if it was archived.
+    """
+    if conversation.archived_at is None:
+        return False
+    archive = archive or get_archive()
+
+    with metrics.stage('rehydrate'):
+        try:
+            with write_lock(), transaction.atomic():
+                stub = Conversation.objects.select_for_update().filter(pk=conversation.pk, archived_at__isnull=False).values(
+                    'archive_segment', 'archive_offset', 'archive_length'
+                ).first()
+                if stub is not None:
+                    record = archive.read(stub['archive_segment'], stub['archive_offset'], stub['archive_length'])
+                    Message.objects.bulk_create([
+                        Message(
+                            id=message['id'], conversation_id=conversation.pk, role=message['role'],
+                            content=message['content'], timestamp=parse_datetime(message['timestamp'])
+                        )
+                        for message in record['messages']
+                    ], batch_size=500)
+                    Conversation.objects.filter(pk=conversation.pk).update(
+                        archived_at=None, archive_segment='', archive_offset=None, archive_length=None
+                    )
+        except IntegrityError:
+            # Another process put the messages back first
+            logger.info(f"Conversation {conversation.pk} was already rehydrated")
+            stub = None
+
+    conversation.archived_at = None
+    conversation.archive_segment = ''
+    conversation.archive_offset = conversation.archive_length = None
+    history_cache.invalidate(conversation.pk)
+    if stub is not None:
+        rehydrated_conversations.inc()
+        logger.info(f"Rehydrated conversation {conversation.pk} with {len(record['messages'])} messages")
+    return True
+
+
+def export_lines(user_id, archive=None, chunk_size=100):
+    """Yield every conversation of ``user_id`` as a line of JSON, archived ones included.
+
+    Conversations are read ``chunk_size`` at a time, so memory use doesn't
+    grow with the size of the export. Archived conversations are read from
+    their segment and stay archived.
+    """
+    archive = archive or get_archive()
+    last_pk = 0
+    while True:
+        conversations = list(Conversation.objects.filter(user_id=user_id, pk__gt=last_pk).order_by('pk')[:chunk_size])
+        if not conversations:
+            return
+        last_pk = conversations[-1].pk
+
+        hot_messages = defaultdict(list)
+        messages = Message.objects.filter(conversation__in=conversations).order_by('conversation', 'timestamp', 'id')
+        for message in messages.iterator(chunk_size=1000):
+            hot_messages[message.conversation_id].append(message)
+
+        for conversation in conversations:
+            messages = hot_messages.pop(conversation.pk, [])
+            if conversation.archived_at is not None:
+                messages = read_archived(conversation, archive)['messages'] + messages
+            record = conversation_record(conversation, messages)
+            yield (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+KEY_LENGTH = 64
+
+
+class AudioCache:
+    """Synthesized speech on local disk, addressed by a hash of everything that shaped it.
+
+    Each entry is the audio file plus a small JSON file with its media type,
+    duration and viseme timeline. Once the audio files add up to more than
+    ``max_bytes``, the least recently used entries are deleted. Several
+    processes may share the directory; each one only evicts what it has seen,
+    and a file another process deleted is just a miss.
+    """
+
+    LOCK_STRIPES = 64
+
+    def __init__(self, directory, max_bytes):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self._entries = None
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        # Concurrent misses of the same phrase wait for one synthesis instead of each calling the provider
+        self._key_locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(text, voice_id, provider, params):
+        payload = json.dumps({'text': text, 'voice_id': voice_id, 'provider': provider, 'params': params}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def audio_path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get_or_create(self, key, synthesize):
+        """Return the entry under ``key``, calling ``synthesize()`` and storing its result on a miss."""
+        entry = self.entry(key)
+        if entry is None:
+            with self._key_locks[int(key[:8], 16) % self.LOCK_STRIPES]:
+                # Someone else may have just made it
+                entry = self.entry(key)
+                if entry is None:
+                    with self._lock:
+                        self.misses += 1
+                    return self.put(key, synthesize())
+        with self._lock:
+            self.hits += 1
+        return entry
+
+    def put(self, key, speech):
+        """Store ``speech`` as returned by a provider; returns the entry without the audio bytes."""
+        meta = {field: speech[field] for field in ('media_type', 'duration_ms', 'visemes')}
+        audio_path = self.audio_path(key)
+        os.makedirs(os.path.dirname(audio_path), exist_ok=True)
+        # The metadata goes last, since readers take it to mean the audio is complete
+        self._write_atomic(audio_path, speech['audio'])
+        self._write_atomic(audio_path + '.json', json.dumps(meta).encode('utf-8'))
+        self._track(key, len(speech['audio']))
+        return {**meta, 'audio_key': key}
+
+    def total_bytes(self):
+        with self._lock:
+            self._load_index()
+            return self._total_bytes
+
+    def entry(self, key):
+        """The entry's ``media_type``, ``duration_ms`` and ``visemes``, plus ``audio_key``; None if it's not cached.
+
+        Doesn't count as a lookup, but does count as a use.
+        """
+        audio_path = self.audio_path(key)
+        try:
+            with open(audio_path + '.json', 'rb') as meta_file:
+                meta = json.load(meta_file)
+            size = os.path.getsize(audio_path)
+            # The modification time doubles as the last use, so recency survives restarts
+            os.utime(audio_path)
+        except (OSError, ValueError):
+            return None
+        self._track(key, size)
+        return {**meta, 'audio_key': key}
+
+    def _track(self, key, size):
+        with self._lock:
+            self._load_index()
+            previous = self._entries.pop(key, None)
+            self._entries[key] = size
+            self._total_bytes += size - (previous or 0)
+            evicted = []
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._total_bytes -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            for path in (self.audio_path(old_key) + '.json', self.audio_path(old_key)):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+    def _load_index(self):
+        """Index what's already on disk, oldest first, the first time the cache is used."""
+        if self._entries is not None:
+            return
+        found = []
+        if os.path.isdir(self.directory):
+            for prefix in os.listdir(self.directory):
+                subdirectory = os.path.join(self.directory, prefix)
+                if not os.path.isdir(subdirectory):
+                    continue
+                for name in os.listdir(subdirectory):
+                    if len(name) != KEY_LENGTH:
+                        continue
+                    try:
+                        stat = os.stat(os.path.join(subdirectory, name))
+                    except OSError:
+                        continue
+                    found.append((stat.st_mtime, name, stat.st_size))
+        found.sort()
+        self._entries = OrderedDict((key, size) for _, key, size in found)
+        self._total_bytes = sum(self._entries.values())
+        if found:
+            logger.info(f"Speech audio cache has {len(found)} entries, {self._total_bytes / 1024 / 1024:.1f}MB")
+
+    def _write_atomic(self, path, data):
+        descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(descriptor, 'wb') as temp_file:
+                temp_file.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+
+audio_cache = AudioCache(settings.VOICE_AUDIO_CACHE_DIR, settings.VOICE_AUDIO_CACHE_MB * 1024 * 1024)
+
+metrics.CallbackMetric(
+    'chat_speech_audio_cache_bytes',
+    'Size of the synthesized speech audio kept on disk',
+    audio_cache.total_bytes
+)
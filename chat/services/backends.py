@@ -0,0 +1,144 @@
+import logging
+
+import torch
+from django.core.exceptions import ImproperlyConfigured
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+logger = logging.getLogger(__name__)
+
+
+class TransformersBackend:
+    """Plain fp32 transformers model; the reference the other backends are compared against.
+
+    Every backend returns a model with the usual ``generate()`` API, so the
+    pipeline, batching and streaming paths in ``LLMService`` work unchanged.
+    """
+
+    name = 'transformers'
+    # Whether generate() accepts and returns a transformers Cache for KV reuse across turns
+    supports_kv_cache = True
+
+    def load_tokenizer(self, model_name, token=None):
+        return AutoTokenizer.from_pretrained(model_name, token=token)
+
+    def load_model(self, model_name, token=None):
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            token=token,
+            low_cpu_mem_usage=True
+        )
+        model.eval()
+        return model
+
+
+class DynamicInt8Backend(TransformersBackend):
+    """Linear layers quantized to int8 weights with dynamically quantized activations."""
+
+    name = 'int8'
+
+    def load_model(self, model_name, token=None):
+        model = super().load_model(model_name, token)
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class TorchCompileBackend(TransformersBackend):
+    """Forward pass compiled with ``torch.compile``; the first calls pay the compilation cost."""
+
+    name = 'compile'
+
+    def load_model(self, model_name, token=None):
+        model = super().load_model(model_name, token)
+        # Prompt and cache lengths change every call, so compile for dynamic shapes
+        model.forward = torch.compile(model.forward, dynamic=True)
+        return model
+
+
+class OnnxRuntimeBackend(TransformersBackend):
+    """The same model exported to ONNX and run by ONNX Runtime (needs ``optimum[onnxruntime]``)."""
+
+    name = 'onnx'
+    supports_kv_cache = False
+
+    def load_model(self, model_name, token=None):
+        try:
+            from optimum.onnxruntime import ORTModelForCausalLM
+        except ImportError as e:
+            raise ImproperlyConfigured(
+                "The 'onnx' LLM backend requires optimum with ONNX Runtime: pip install optimum[onnxruntime]"
+            ) from e
+        return ORTModelForCausalLM.from_pretrained(
+            model_name,
+            token=token,
+            export=True,
+            provider='CPUExecutionProvider'
+        )
+
+
+class StubBackend(TransformersBackend):
+    """Tiny randomly initialized model with a byte-level tokenizer, for benchmarks in CI.
+
+    Nothing is downloaded and ``model_name`` is ignored. Weights are seeded,
+    so runs are reproducible. Generation is limited to printable ASCII and can
+    never emit the end-of-sequence token, so every reply is exactly
+    ``max_new_tokens`` tokens (one per character). The output is gibberish;
+    it exercises the serving stack, not the model.
+    """
+
+    name = 'stub'
+
+    # Byte-level alphabet characters for printable ASCII; 'Ġ' stands for the space byte
+    PRINTABLE = {chr(code) for code in range(ord('!'), ord('~') + 1)} | {'Ġ'}
+
+    @staticmethod
+    def _alphabet():
+        from tokenizers import pre_tokenizers
+
+        return sorted(pre_tokenizers.ByteLevel.alphabet())
+
+    def load_tokenizer(self, model_name, token=None):
+        from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+        from transformers import PreTrainedTokenizerFast
+
+        tokenizer = Tokenizer(models.BPE(vocab={char: i for i, char in enumerate(self._alphabet())}, merges=[]))
+        tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+        tokenizer.decoder = decoders.ByteLevel()
+        return PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token='<|endoftext|>')
+
+    def load_model(self, model_name, token=None):
+        from transformers import GPT2Config, GPT2LMHeadModel
+
+        alphabet = self._alphabet()
+        # One id past the byte vocabulary: the tokenizer's eos
+        eos_token_id = len(alphabet)
+        config = GPT2Config(
+            vocab_size=eos_token_id + 1,
+            n_positions=4096,
+            n_embd=64,
+            n_layer=2,
+            n_head=2,
+            bos_token_id=eos_token_id,
+            eos_token_id=eos_token_id
+        )
+        with torch.random.fork_rng():
+            torch.manual_seed(0)
+            model = GPT2LMHeadModel(config)
+        model.generation_config.suppress_tokens = [
+            token_id for token_id, char in enumerate(alphabet) if char not in self.PRINTABLE
+        ] + [eos_token_id]
+        model.eval()
+        return model
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (TransformersBackend, DynamicInt8Backend, TorchCompileBackend, OnnxRuntimeBackend, StubBackend)
+}
+
+
+def get_backend(name):
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ImproperlyConfigured(
+            f"Unknown LLM_BACKEND '{name}', expected one of: {', '.join(BACKENDS)}"
+        )
@@ -0,0 +1,195 @@
+import copy
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+from transformers import StoppingCriteriaList
+
+from . import metrics
+from .inference_executor import FairQueue
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingRequest:
+    def __init__(self, prompt, generation_kwargs):
+        self.prompt = prompt
+        self.generation_kwargs = generation_kwargs
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+    @property
+    def group_key(self):
+        # Only requests with identical generation parameters can share a generate() call
+        return tuple(sorted(self.generation_kwargs.items()))
+
+
+class BatchScheduler:
+    """Gathers concurrent prompts into dynamic batches and generates them together.
+
+    Callers get a ``concurrent.futures.Future`` back from ``submit`` that resolves
+    to the generated continuation (without the prompt). Batches are filled
+    round-robin across the users prompts are submitted for. Everything
+    submitted before ``shutdown`` is still generated; ``submit`` raises afterwards.
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size=8, max_wait_ms=20):
+        self.model = model
+        # A copy, since the padding set up below would otherwise change it for every other user of the tokenizer
+        self.tokenizer = copy.deepcopy(tokenizer)
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0, max_wait_ms) / 1000.0
+
+        # Decoder-only models need left padding so every prompt ends where generation starts
+        self.tokenizer.padding_side = 'left'
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+        self._queue = FairQueue()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'batches': 0,
+            'requests': 0,
+            'generated_tokens': 0,
+            'generation_seconds': 0.0,
+            'total_queue_wait_seconds': 0.0,
+            'total_occupancy': 0.0,
+        }
+        self._closed = False
+        # Orders submits against shutdown, so nothing is queued behind the stop sentinel
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='llm-batch-scheduler', daemon=True)
+        self._thread.start()
+
+    def submit(self, prompt, user=None, **generation_kwargs):
+        request = _PendingRequest(prompt, generation_kwargs)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Batch scheduler has been shut down")
+            self._queue.put(request, user)
+        return request.future
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.close()
+        if wait:
+            self._thread.join()
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        batches = stats['batches'] or 1
+        requests = stats['requests'] or 1
+        stats['avg_occupancy'] = stats.pop('total_occupancy') / batches
+        stats['avg_queue_wait_ms'] = stats.pop('total_queue_wait_seconds') / requests * 1000
+        stats['tokens_per_second'] = (
+            stats['generated_tokens'] / stats['generation_seconds']
+            if stats['generation_seconds'] else 0.0
+        )
+        stats['queue_depth'] = self._queue.qsize()
+        return stats
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                return
+            groups = {}
+            for request in batch:
+                groups.setdefault(request.group_key, []).append(request)
+            for group in groups.values():
+                self._generate(group)
+
+    def _collect_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                break
+            batch.append(request)
+        return batch
+
+    def _generate(self, group):
+        started_at = time.monotonic()
+        for request in group:
+            # Nobody is waiting on a cancelled future, so don't spend compute on it
+            if not request.future.set_running_or_notify_cancel():
+                request.future = None
+        group = [request for request in group if request.future is not None]
+        if not group:
+            return
+
+        try:
+            inputs = self.tokenizer(
+                [request.prompt for request in group],
+                return_tensors='pt',
+                padding=True,
+            )
+            timer = metrics.GenerationTimer()
+            with torch.inference_mode():
+                output_ids = self.model.generate(
+                    input_ids=inputs['input_ids'],
+                    attention_mask=inputs['attention_mask'],
+                    stopping_criteria=StoppingCriteriaList([timer]),
+                    **group[0].generation_kwargs
+                )
+            stages = timer.stages()
+
+            new_tokens = output_ids[:, inputs['input_ids'].shape[1]:]
+            completions = self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+            # Rows that finish early are padded out to the longest one, so count each up to its first eos
+            finished = (new_tokens == self.tokenizer.eos_token_id).cumsum(dim=1) > 0
+            generated_tokens = int((~finished).sum())
+        except Exception as e:
+            logger.error(f"Error generating batch of {len(group)}: {str(e)}")
+            for request in group:
+                request.future.set_exception(e)
+            return
+
+        finished_at = time.monotonic()
+        for request, completion in zip(group, completions):
+            request.future.set_result(completion)
+
+        self._record_batch(group, started_at, finished_at, generated_tokens, stages)
+
+    def _record_batch(self, group, started_at, finished_at, generated_tokens, stages):
+        occupancy = len(group) / self.max_batch_size
+        queue_wait = sum(started_at - request.enqueued_at for request in group)
+        elapsed = finished_at - started_at
+
+        # Every request of the batch waited on its own, then shared the batch's prefill and decode
+        for request in group:
+            metrics.stage_seconds.observe(started_at - request.enqueued_at, stage='queue_wait')
+            if stages is not None:
+                metrics.observe_generation(*stages)
+
+        with self._stats_lock:
+            self._stats['batches'] += 1
+            self._stats['requests'] += len(group)
+            self._stats['generated_tokens'] += generated_tokens
+            self._stats['generation_seconds'] += elapsed
+            self._stats['total_queue_wait_seconds'] += queue_wait
+            self._stats['total_occupancy'] += occupancy
+
+        logger.info(
+            f"Generated batch of {len(group)}/{self.max_batch_size} "
+            f"(occupancy {occupancy:.0%}, avg queue wait {queue_wait / len(group) * 1000:.1f}ms, "
+            f"{generated_tokens} tokens in {elapsed:.2f}s, "
+            f"{generated_tokens / elapsed if elapsed else 0:.1f} tokens/s)"
+        )
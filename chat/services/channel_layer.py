@@ -0,0 +1,86 @@
+import asyncio
+import itertools
+import logging
+from collections import defaultdict
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+overflowed_channels = metrics.Counter(
+    'chat_channel_overflows_total', 'Channels closed because their reader fell too far behind'
+)
+
+
+class InMemoryChannelLayer:
+    """Named message queues, and groups of them, within one process and event loop.
+
+    Every chat WebSocket reads from its own channel and joins the group of its
+    conversation, so a reply reaches every socket bound to that conversation.
+    A channel holds at most ``capacity`` messages. When a reader falls further
+    behind than that, its queued messages are replaced by a
+    ``websocket.close`` message and it leaves its groups. One slow client
+    can't hold up the rest, and it resumes from its last message once it
+    reconnects.
+
+    Sockets served by other processes never see these messages, so with
+    several server processes only sockets in the same process share replies.
+    """
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self._channels = {}
+        self._groups = defaultdict(set)
+        self._names = itertools.count(1)
+
+    def new_channel(self, prefix='chat'):
+        channel = f'{prefix}.{next(self._names)}'
+        self._channels[channel] = asyncio.Queue(self.capacity)
+        return channel
+
+    def discard_channel(self, channel):
+        self._channels.pop(channel, None)
+        for group in [group for group, channels in self._groups.items() if channel in channels]:
+            self.group_discard(group, channel)
+
+    async def send(self, channel, message):
+        """Queue ``message`` on ``channel``; returns False if it was dropped."""
+        queue = self._channels.get(channel)
+        if queue is None:
+            return False
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self._overflow(channel, queue)
+            return False
+        return True
+
+    async def receive(self, channel):
+        return await self._channels[channel].get()
+
+    def group_add(self, group, channel):
+        self._groups[group].add(channel)
+
+    def group_discard(self, group, channel):
+        channels = self._groups.get(group)
+        if channels is not None:
+            channels.discard(channel)
+            if not channels:
+                del self._groups[group]
+
+    async def group_send(self, group, message):
+        for channel in list(self._groups.get(group, ())):
+            await self.send(channel, message)
+
+    def _overflow(self, channel, queue):
+        while not queue.empty():
+            queue.get_nowait()
+        # 1013: try again later
+        queue.put_nowait({'type': 'websocket.close', 'code': 1013, 'reason': 'Too far behind'})
+        for group in [group for group, channels in self._groups.items() if channel in channels]:
+            self.group_discard(group, channel)
+        overflowed_channels.inc()
+        logger.warning(f"Channel {channel} overflowed after {self.capacity} messages; closing it")
+
+
+channel_layer = InMemoryChannelLayer()
@@ -0,0 +1,73 @@
+import logging
+import threading
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationHistoryCache:
+    """Keeps the last ``window`` messages of recently active conversations in memory.
+
+    A miss costs one query for the newest messages through the
+    ``(conversation, timestamp)`` index; new messages are appended to cached
+    windows as they are saved, so a busy conversation needs no history query.
+    """
+
+    def __init__(self, window, max_conversations):
+        self.window = window
+        self.max_conversations = max_conversations
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every change so a load that raced with a write isn't cached
+        self._mutations = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, conversation):
+        """Return the newest messages of ``conversation`` as ``id``/``content``/``role`` dicts, oldest first."""
+        with self._lock:
+            window = self._windows.get(conversation.pk)
+            if window is not None:
+                self._windows.move_to_end(conversation.pk)
+                self.hits += 1
+                return list(window)
+            self.misses += 1
+            mutations = self._mutations
+
+        # Both messages of a turn can get the same timestamp; the id keeps the user's first
+        messages = list(
+            conversation.messages.order_by('-timestamp', '-id').values('id', 'content', 'role')[:self.window]
+        )
+        messages.reverse()
+
+        with self._lock:
+            if mutations == self._mutations:
+                self._windows[conversation.pk] = deque(messages, maxlen=self.window)
+                while len(self._windows) > self.max_conversations:
+                    self._windows.popitem(last=False)
+        return messages
+
+    def append(self, message):
+        with self._lock:
+            self._mutations += 1
+            window = self._windows.get(message.conversation_id)
+            if window is not None:
+                window.append({'id': message.pk, 'content': message.content, 'role': message.role})
+
+    def invalidate(self, conversation_id):
+        with self._lock:
+            self._mutations += 1
+            self._windows.pop(conversation_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._mutations += 1
+            self._windows.clear()
+
+
+history_cache = ConversationHistoryCache(
+    window=settings.CHAT_HISTORY_WINDOW,
+    max_conversations=settings.CHAT_HISTORY_CACHE_SIZE
+)
@@ -0,0 +1,194 @@
+import contextlib
+import logging
+import queue
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+rejections = metrics.Counter('llm_rejected_total', 'Generations refused admission, by reason', ['reason'])
+
+
+class LLMOverloadedError(Exception):
+    """Raised when the inference queue is full and the request should be retried later."""
+
+    reason = "Inference queue is full"
+
+    def __init__(self, retry_after):
+        super().__init__(f"{self.reason}, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class LLMUserLimitError(LLMOverloadedError):
+    """Raised when a user already has as many generations admitted as they're allowed."""
+
+    reason = "Too many generations in progress for this user"
+
+
+class FairQueue:
+    """A FIFO per user, served round-robin across users.
+
+    ``get`` takes the oldest item of the user whose turn it is, so one user's
+    backlog can't hold everyone else's items up. ``None`` is the user for
+    everything not tied to one. After ``close``, ``get`` still hands out what
+    is left, then returns ``None``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        # user -> deque of items; the first user is served next and moves to the back
+        self._queues = OrderedDict()
+        self._size = 0
+        self._closed = False
+
+    def put(self, item, user=None):
+        with self._lock:
+            self._queues.setdefault(user, deque()).append(item)
+            self._size += 1
+            self._not_empty.notify()
+
+    def get(self, timeout=None):
+        """The next item; raises ``queue.Empty`` if none comes within ``timeout`` seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while not self._queues:
+                if self._closed:
+                    return None
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty
+                self._not_empty.wait(remaining)
+            user, items = self._queues.popitem(last=False)
+            item = items.popleft()
+            if items:
+                self._queues[user] = items
+            self._size -= 1
+            return item
+
+    def qsize(self):
+        return self._size
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+
+
+class InferenceExecutor:
+    """Worker threads for model calls that refuse work instead of queueing without bound.
+
+    At most ``max_workers`` jobs run at once and at most ``max_queue_size``
+    more wait for a worker; anything beyond that raises ``LLMOverloadedError``.
+    Jobs are queued per user and workers take them round-robin across users,
+    so one user's backlog can't hold everyone else's requests up. With
+    ``max_pending_per_user`` set, a user with that many jobs queued or running
+    gets ``LLMUserLimitError`` for the next one.
+    """
+
+    def __init__(self, max_workers, max_queue_size, retry_after=5, max_pending_per_user=0):
+        self.max_workers = max(1, int(max_workers))
+        self.max_queue_size = max(0, int(max_queue_size))
+        self.retry_after = retry_after
+        self.max_pending_per_user = max(0, int(max_pending_per_user))
+
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._pending_by_user = Counter()
+        self._jobs = FairQueue()
+        self._shutdown = False
+        self._threads = [
+            threading.Thread(target=self._work, name=f'llm-inference_{index}', daemon=True)
+            for index in range(self.max_workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def pending(self):
+        """Number of admitted jobs that are queued or running."""
+        return self._pending
+
+    def acquire(self, user=None):
+        """Admit one job for ``user``; ``None`` is everything not tied to a user."""
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue_size:
+                logger.warning(f"Inference queue full ({self._pending} pending), rejecting request")
+                rejections.inc(reason='queue_full')
+                raise LLMOverloadedError(self.retry_after)
+            if (user is not None and self.max_pending_per_user
+                    and self._pending_by_user[user] >= self.max_pending_per_user):
+                logger.warning(f"User {user} has {self._pending_by_user[user]} generations pending, rejecting request")
+                rejections.inc(reason='user_limit')
+                raise LLMUserLimitError(self.retry_after)
+            self._pending += 1
+            self._pending_by_user[user] += 1
+
+    def release(self, user=None):
+        with self._lock:
+            self._pending -= 1
+            self._pending_by_user[user] -= 1
+            if not self._pending_by_user[user]:
+                del self._pending_by_user[user]
+
+    @contextlib.contextmanager
+    def admit(self, user=None):
+        """Admit one job for ``user`` that runs elsewhere, e.g. in the batch scheduler.
+
+        Start the job inside the block and ``track`` its future. If starting
+        it raises, the slot is given back.
+        """
+        self.acquire(user)
+        try:
+            yield
+        except BaseException:
+            self.release(user)
+            raise
+
+    def track(self, future, user=None):
+        """Release an acquired slot once ``future`` finishes."""
+        future.add_done_callback(lambda _: self.release(user))
+        return future
+
+    def submit(self, fn, *args, **kwargs):
+        return self.submit_for(None, fn, *args, **kwargs)
+
+    def submit_for(self, user, fn, *args, **kwargs):
+        """Queue ``fn(*args, **kwargs)`` behind ``user``'s earlier jobs and return a Future."""
+        self.acquire(user)
+        future = Future()
+        with self._lock:
+            accepted = not self._shutdown
+            if accepted:
+                self._jobs.put((future, fn, args, kwargs), user)
+        if not accepted:
+            self.release(user)
+            raise RuntimeError("Inference executor has been shut down")
+        return self.track(future, user)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            self._shutdown = True
+            self._jobs.close()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            future, fn, args, kwargs = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
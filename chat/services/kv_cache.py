@@ -0,0 +1,107 @@
+import logging
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _cache_nbytes(past_key_values):
+    if hasattr(past_key_values, 'layers'):
+        tensors = []
+        for layer in past_key_values.layers:
+            tensors += [layer.keys, layer.values]
+    else:
+        tensors = list(past_key_values.key_cache) + list(past_key_values.value_cache)
+    return sum(t.numel() * t.element_size() for t in tensors if t is not None)
+
+
+class _CacheEntry:
+    def __init__(self, token_ids, past_key_values):
+        self.token_ids = token_ids
+        self.past_key_values = past_key_values
+        self.nbytes = _cache_nbytes(past_key_values)
+
+
+class ConversationKVCache:
+    """LRU cache of past key/values per conversation, bounded by total tensor size.
+
+    An entry holds the token ids its key/values were computed for. A new turn
+    reuses the longest common prefix with those ids, so only the tokens after
+    it have to be prefilled; anything that diverges is cropped away.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def take(self, conversation_id, input_ids):
+        """Remove and return ``(past_key_values, reused_tokens)`` for a prompt, or ``(None, 0)``.
+
+        The entry is removed so two concurrent turns of one conversation never
+        extend the same cache; ``put`` it back once generation is done.
+        """
+        with self._lock:
+            entry = self._entries.pop(conversation_id, None)
+            if entry is not None:
+                self._total_bytes -= entry.nbytes
+
+        if entry is None:
+            self.misses += 1
+            return None, 0
+
+        prompt_ids = input_ids[0]
+        cached_ids = entry.token_ids[0]
+        limit = min(len(cached_ids), len(prompt_ids) - 1)
+        mismatches = (cached_ids[:limit] != prompt_ids[:limit]).nonzero()
+        reused = int(mismatches[0]) if len(mismatches) else limit
+
+        if reused == 0:
+            self.misses += 1
+            return None, 0
+
+        # generate() needs at least one uncached token, and nothing past the common prefix
+        entry.past_key_values.crop(reused)
+        self.hits += 1
+        return entry.past_key_values, reused
+
+    def put(self, conversation_id, token_ids, past_key_values):
+        entry = _CacheEntry(token_ids, past_key_values)
+        if entry.nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(conversation_id, None)
+            if previous is not None:
+                self._total_bytes -= previous.nbytes
+            self._entries[conversation_id] = entry
+            self._total_bytes += entry.nbytes
+
+            while self._total_bytes > self.max_bytes:
+                evicted_id, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= evicted.nbytes
+                logger.debug(f"Evicted KV cache for conversation {evicted_id}")
+
+    def invalidate(self, conversation_id):
+        with self._lock:
+            entry = self._entries.pop(conversation_id, None)
+            if entry is not None:
+                self._total_bytes -= entry.nbytes
+                logger.debug(f"Invalidated KV cache for conversation {conversation_id}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+
+kv_cache = ConversationKVCache(max_bytes=settings.LLM_KV_CACHE_MAX_MB * 1024 * 1024)
@@ -1,95 +1,570 @@
 import os
-from transformers import AutoTokenizer, pipeline
+from transformers import pipeline, TextIteratorStreamer, StoppingCriteria, StoppingCriteriaList
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 import logging
 import torch
-from concurrent.futures import ThreadPoolExecutor
 import asyncio
+import queue
+import threading
+import time
+from .audio_cache import audio_cache
+from .backends import get_backend
+from .batch_scheduler import BatchScheduler
+from .inference_executor import InferenceExecutor, LLMOverloadedError
+from .history import history_cache
+from .kv_cache import kv_cache
+from . import metrics
+from .prompt_builder import PromptBuilder, extract_reply
+from .response_cache import ResponseCache
+from .single_flight import SingleFlight
+from .speculative import SpeculativeDecoder
+from .token_cache import token_cache
+from .worker_pool import InferenceWorkerPool
 
 logger = logging.getLogger(__name__)
 
+def resident_memory_mb():
+    """Current resident set size of this process, falling back to the peak where /proc is missing."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (OSError, ValueError, IndexError):
+        import resource
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class _CancelledCriteria(StoppingCriteria):
+    """Stops generation once the streaming client has gone away."""
+
+    def __init__(self, cancelled):
+        self.cancelled = cancelled
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return self.cancelled.is_set()
+
 class LLMService:
+    FALLBACK_RESPONSE = "I apologize, but I'm having trouble generating a response right now. Please try again later."
+    STREAM_POLL_SECONDS = 0.5
+
+    # Lifecycle: not_loaded -> loading -> ready (or failed); read by the readiness endpoint
+    NOT_LOADED, LOADING, READY, FAILED = 'not_loaded', 'loading', 'ready', 'failed'
+
     _instance = None
-    _executor = ThreadPoolExecutor(max_workers=2)
+    _lock = threading.Lock()
+    _state = NOT_LOADED
+    _load_seconds = None
+    _load_error = None
 
     def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super(LLMService, cls).__new__(cls)
-            cls._instance._initialized = False
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(LLMService, cls).__new__(cls)
+                cls._instance._initialized = False
         return cls._instance
 
     def __init__(self):
         if self._initialized:
             return
-            
+        
+        # Concurrent first requests wait for one load instead of each loading the model
+        with self._lock:
+            if self._initialized:
+                return
+            self._load()
+
+    @classmethod
+    def preload(cls, background=False):
+        """Load the model ahead of the first request, optionally without blocking the caller."""
+        if background:
+            thread = threading.Thread(target=cls, name='llm-preload', daemon=True)
+            thread.start()
+            return thread
+        return cls()
+
+    @classmethod
+    def status(cls):
+        return {
+            'status': cls._state,
+            'model': settings.LLM_MODEL,
+            'load_seconds': cls._load_seconds,
+            'error': cls._load_error,
+        }
+
+    def _load(self):
+        LLMService._state = self.LOADING
+        started_at = time.monotonic()
+        
         try:
             self.model_name = settings.LLM_MODEL
             self.hf_token = settings.HF_API_TOKEN
             
-            logger.info(f"Initializing LLM service with model: {self.model_name}")
+            self.backend = get_backend(settings.LLM_BACKEND)
+            
+            logger.info(f"Initializing LLM service with model: {self.model_name} ({self.backend.name} backend)")
             
             # Initialize tokenizer with simpler settings
-            self.tokenizer = AutoTokenizer.from_pretrained(
-                self.model_name,
-                token=self.hf_token
-            )
+            self.tokenizer = self.backend.load_tokenizer(self.model_name, self.hf_token)
+            
+            # Load the weights once through the configured backend and hand them to the pipeline
+            model = self.backend.load_model(self.model_name, self.hf_token)
             
             # Initialize pipeline with basic settings
             self.pipe = pipeline(
                 "text-generation",
-                model=self.model_name,
+                model=model,
                 tokenizer=self.tokenizer,
-                token=self.hf_token,
                 device="cpu"
             )
             
-            logger.info("LLM service initialized successfully")
+            # Keeps prompts within budget by sliding old turns into a summary
+            self.prompt_builder = PromptBuilder(
+                self.tokenizer,
+                max_prompt_tokens=settings.LLM_PROMPT_MAX_TOKENS,
+                max_summary_tokens=settings.LLM_SUMMARY_MAX_TOKENS
+            )
+            
+            # Optionally move generation into forked worker processes sharing these weights.
+            # Fork before this process runs any generation, or starts the executor's threads.
+            self.worker_pool = None
+            if settings.LLM_WORKER_PROCESSES > 0:
+                self.worker_pool = InferenceWorkerPool(
+                    model,
+                    self.tokenizer,
+                    processes=settings.LLM_WORKER_PROCESSES,
+                    threads_per_worker=settings.LLM_WORKER_THREADS or None,
+                    request_timeout=settings.LLM_WORKER_TIMEOUT_SECONDS,
+                    stream_timeout=self.STREAM_POLL_SECONDS
+                )
+            
+            # Model calls run here so request threads and the event loop are never blocked by torch
+            self._executor = InferenceExecutor(
+                max_workers=settings.LLM_EXECUTOR_WORKERS,
+                max_queue_size=settings.LLM_EXECUTOR_QUEUE_SIZE,
+                retry_after=settings.LLM_RETRY_AFTER_SECONDS,
+                max_pending_per_user=settings.LLM_MAX_PENDING_PER_USER
+            )
+            
+            # Optionally let a small draft model propose tokens for this one to verify
+            self.speculative = None
+            if settings.LLM_DRAFT_MODEL:
+                if self.worker_pool is not None:
+                    logger.warning("Speculative decoding isn't supported in worker processes, leaving it disabled")
+                else:
+                    self.speculative = self._load_draft_model(settings.LLM_DRAFT_MODEL)
+            
+            # Optionally gather concurrent requests into shared generate() calls
+            self.scheduler = None
+            if settings.LLM_BATCHING_ENABLED and self.speculative is not None:
+                logger.warning("Batching can't be combined with speculative decoding, leaving it disabled")
+            elif settings.LLM_BATCHING_ENABLED and self.worker_pool is None:
+                self.scheduler = BatchScheduler(
+                    self.pipe.model,
+                    self.tokenizer,
+                    max_batch_size=settings.LLM_BATCH_MAX_SIZE,
+                    max_wait_ms=settings.LLM_BATCH_MAX_WAIT_MS
+                )
+                logger.info(
+                    f"Batching enabled (max size {settings.LLM_BATCH_MAX_SIZE}, "
+                    f"max wait {settings.LLM_BATCH_MAX_WAIT_MS}ms)"
+                )
+            
+            # Replies are only reusable when decoding is deterministic
+            self.response_cache = None
+            if settings.LLM_RESPONSE_CACHE_ENABLED:
+                if settings.LLM_DETERMINISTIC:
+                    self.response_cache = ResponseCache(self.model_name)
+                else:
+                    logger.warning("Response cache needs LLM_DETERMINISTIC, leaving it disabled")
+            
+            # Concurrent identical requests only get the same reply anyway under greedy decoding
+            self.single_flight = None
+            if settings.LLM_DETERMINISTIC or settings.LLM_SINGLE_FLIGHT_ENABLED:
+                self.single_flight = SingleFlight(self.model_name)
+            
+            self._register_metrics()
+            
+            LLMService._load_seconds = time.monotonic() - started_at
+            LLMService._load_error = None
+            LLMService._state = self.READY
+            logger.info(
+                f"LLM service initialized successfully in {LLMService._load_seconds:.1f}s "
+                f"(resident memory {resident_memory_mb():.0f}MB)"
+            )
             self._initialized = True
             
         except Exception as e:
+            LLMService._state = self.FAILED
+            LLMService._load_error = str(e)
             logger.error(f"Error initializing LLM service: {str(e)}")
             raise
 
-    async def get_response(self, message, conversation_history):
+    async def get_response(self, message, conversation_history, conversation_id=None, summary='', user_id=None):
         try:
             logger.info(f"Generating response for message: {message[:50]}...")
             
             # Format the prompt
-            formatted_history = self._format_conversation_history(conversation_history)
-            prompt = self._prepare_prompt(formatted_history, message)
+            prompt, prompt_length = self._timed_prompt(message, conversation_history, summary)
             
-            # Generate response synchronously (pipeline doesn't support async)
-            outputs = self.pipe(
+            generation_kwargs = self._generation_kwargs()
+            
+            if self.response_cache is not None:
+                cached = self.response_cache.get(prompt, generation_kwargs)
+                if cached is not None:
+                    logger.info(f"Serving cached response: {cached[:50]}...")
+                    metrics.generation_paths.inc(path='response_cache')
+                    return cached
+            
+            if self.single_flight is not None:
+                # Identical requests already being generated share that generation
+                key = self.single_flight.make_key(prompt, generation_kwargs)
+                return await self.single_flight.run(
+                    key, lambda: self._generate(prompt, prompt_length, generation_kwargs, conversation_id, user_id)
+                )
+            return await self._generate(prompt, prompt_length, generation_kwargs, conversation_id, user_id)
+            
+        except LLMOverloadedError:
+            raise
+        except Exception as e:
+            logger.error(f"Error in get_response: {str(e)}")
+            return self.FALLBACK_RESPONSE
+
+    async def _generate(self, prompt, prompt_length, generation_kwargs, conversation_id, user_id):
+        started_at = time.monotonic()
+        
+        if self._use_kv_cache(conversation_id):
+            metrics.generation_paths.inc(path='kv_cache')
+            future = self._executor.submit_for(
+                user_id,
+                self._run_timed, time.perf_counter(), prompt_length,
+                self._generate_with_kv_cache, prompt, conversation_id, generation_kwargs
+            )
+            response_text = await asyncio.wrap_future(future)
+        elif self.worker_pool is not None:
+            metrics.generation_paths.inc(path='worker_pool')
+            # Workers run out of process, but still count against the queue bound
+            with self._executor.admit(user_id):
+                future, _ = self.worker_pool.submit(prompt, user=user_id, **generation_kwargs)
+                self._executor.track(future, user_id)
+            completion = await asyncio.wrap_future(future)
+            response_text = prompt + completion
+        elif self.scheduler is not None:
+            metrics.generation_paths.inc(path='batch')
+            # The scheduler has its own thread, but still counts against the queue bound
+            with self._executor.admit(user_id):
+                future = self._executor.track(
+                    self.scheduler.submit(prompt, user=user_id, **generation_kwargs), user_id
+                )
+            completion = await asyncio.wrap_future(future)
+            response_text = prompt + completion
+        else:
+            metrics.generation_paths.inc(path='pipeline')
+            # The pipeline is synchronous, so run it on the inference executor
+            future = self._executor.submit_for(
+                user_id,
+                self._run_timed, time.perf_counter(), prompt_length,
+                self.pipe, prompt, num_return_sequences=1, **generation_kwargs
+            )
+            outputs = await asyncio.wrap_future(future)
+            response_text = outputs[0]['generated_text']
+        
+        completion = response_text[len(prompt):]
+        completion_tokens = len(self.tokenizer.encode(completion, add_special_tokens=False))
+        elapsed = time.monotonic() - started_at
+        metrics.stage_seconds.observe(elapsed, stage='generation')
+        metrics.completion_tokens.observe(completion_tokens)
+        logger.info(
+            f"Generated {completion_tokens} tokens in {elapsed:.2f}s "
+            f"({completion_tokens / elapsed if elapsed else 0:.1f} tokens/s)"
+        )
+        
+        response = self.extract_response(completion)
+        if self.response_cache is not None:
+            self.response_cache.set(prompt, generation_kwargs, response)
+        
+        logger.info(f"Generated response: {response[:50]}...")
+        return response
+
+    def stream_response(self, message, conversation_history, conversation_id=None, summary='', user_id=None):
+        """Start generating and return an iterator over chunks of text as they are produced.
+
+        The chunks are the raw continuation of the prompt; pass their
+        concatenation through ``extract_response`` to get the final reply.
+        Raises ``LLMOverloadedError`` right away if the inference queue is full,
+        or ``LLMUserLimitError`` if ``user_id`` has too many generations pending.
+        """
+        logger.info(f"Streaming response for message: {message[:50]}...")
+        
+        prompt, prompt_length = self._timed_prompt(message, conversation_history, summary)
+        generation_kwargs = self._generation_kwargs()
+        
+        if self.response_cache is not None:
+            cached = self.response_cache.get(prompt, generation_kwargs)
+            if cached is not None:
+                logger.info(f"Serving cached response: {cached[:50]}...")
+                metrics.generation_paths.inc(path='response_cache')
+                return iter([cached])
+        
+        if self.single_flight is not None:
+            key = self.single_flight.make_key(prompt, generation_kwargs)
+            return self.single_flight.stream(
+                key, lambda: self._start_stream(prompt, prompt_length, generation_kwargs, conversation_id, user_id)
+            )
+        return self._start_stream(prompt, prompt_length, generation_kwargs, conversation_id, user_id)
+
+    def _start_stream(self, prompt, prompt_length, generation_kwargs, conversation_id, user_id):
+        cancelled = threading.Event()
+        if self.worker_pool is not None:
+            metrics.generation_paths.inc(path='worker_pool')
+            # Worker generations run to completion even if the client goes away
+            with self._executor.admit(user_id):
+                generation, chunks = self.worker_pool.submit(prompt, stream=True, user=user_id, **generation_kwargs)
+                self._executor.track(generation, user_id)
+            return self._iter_stream(chunks, generation, cancelled, prompt, generation_kwargs)
+        
+        streamer = TextIteratorStreamer(
+            self.tokenizer,
+            skip_prompt=True,
+            skip_special_tokens=True,
+            timeout=self.STREAM_POLL_SECONDS
+        )
+        stopping_criteria = StoppingCriteriaList([_CancelledCriteria(cancelled)])
+        if self._use_kv_cache(conversation_id):
+            metrics.generation_paths.inc(path='kv_cache')
+            generation = self._executor.submit_for(
+                user_id,
+                self._run_timed,
+                time.perf_counter(),
+                prompt_length,
+                self._generate_with_kv_cache,
+                prompt,
+                conversation_id,
+                generation_kwargs,
+                streamer=streamer,
+                stopping_criteria=stopping_criteria
+            )
+        else:
+            metrics.generation_paths.inc(path='pipeline')
+            generation = self._executor.submit_for(
+                user_id,
+                self._run_timed,
+                time.perf_counter(),
+                prompt_length,
+                self.pipe,
                 prompt,
-                max_new_tokens=128,
                 num_return_sequences=1,
-                temperature=0.7,
-                do_sample=True,
-                pad_token_id=self.tokenizer.eos_token_id
+                streamer=streamer,
+                stopping_criteria=stopping_criteria,
+                **generation_kwargs
             )
+        return self._iter_stream(streamer, generation, cancelled, prompt, generation_kwargs)
+
+    def _iter_stream(self, streamer, generation, cancelled, prompt, generation_kwargs):
+        emitted = []
+        started_at = time.monotonic()
+        try:
+            chunks = iter(streamer)
+            while True:
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    break
+                except queue.Empty:
+                    # A failed generation never closes the streamer, so check on it
+                    if generation.done() and generation.exception() is not None:
+                        break
+                    continue
+                
+                if chunk:
+                    if not emitted:
+                        logger.info(f"First token after {time.monotonic() - started_at:.2f}s")
+                    emitted.append(chunk)
+                    yield chunk
             
-            # Extract response
-            response_text = outputs[0]['generated_text']
-            response_parts = response_text.split("Assistant:")
+            generation.result()
             
-            if len(response_parts) > 1:
-                response = response_parts[-1].strip()
-            else:
-                response = response_text.strip()
+            metrics.stage_seconds.observe(time.monotonic() - started_at, stage='generation')
+            metrics.completion_tokens.observe(
+                len(self.tokenizer.encode(''.join(emitted), add_special_tokens=False))
+            )
             
-            logger.info(f"Generated response: {response[:50]}...")
-            return response
+            if self.response_cache is not None:
+                self.response_cache.set(prompt, generation_kwargs, self.extract_response(''.join(emitted)))
             
         except Exception as e:
-            logger.error(f"Error in get_response: {str(e)}")
-            return "I apologize, but I'm having trouble generating a response right now. Please try again later."
+            logger.error(f"Error in stream_response: {str(e)}")
+            if not emitted:
+                yield self.FALLBACK_RESPONSE
+        finally:
+            # Also reached when the client disconnects and the generator is closed
+            cancelled.set()
+
+    def _timed_prompt(self, message, conversation_history, summary):
+        with metrics.stage('prompt_build'):
+            prompt = self._build_prompt(message, conversation_history, summary)
+        # Same work the generation path does first; timed here since the pipeline hides it
+        with metrics.stage('tokenization'):
+            prompt_length = len(self.tokenizer.encode(prompt))
+        metrics.prompt_tokens.observe(prompt_length)
+        return prompt, prompt_length
+
+    def _run_timed(self, submitted_at, prompt_length, generate, *args, **kwargs):
+        """Run ``generate`` on the executor, recording queue wait, prefill and decode times.
+
+        Attaches the draft model when speculative decoding is enabled.
+        """
+        timer = metrics.GenerationTimer()
+        metrics.stage_seconds.observe(timer.started_at - submitted_at, stage='queue_wait')
+        
+        kwargs['stopping_criteria'] = StoppingCriteriaList(list(kwargs.get('stopping_criteria') or []) + [timer])
+        try:
+            if self.speculative is not None:
+                return self.speculative.generate(prompt_length, generate, *args, **kwargs)
+            return generate(*args, **kwargs)
+        finally:
+            stages = timer.stages()
+            if stages is not None:
+                metrics.observe_generation(*stages)
+
+    def _load_draft_model(self, draft_model_name):
+        # Draft tokens are verified by id, so the vocabularies have to match exactly
+        draft_tokenizer = self.backend.load_tokenizer(draft_model_name, self.hf_token)
+        if draft_tokenizer.get_vocab() != self.tokenizer.get_vocab():
+            raise ImproperlyConfigured(
+                f"Draft model {draft_model_name} doesn't share the tokenizer of {self.model_name}"
+            )
+        
+        draft_model = self.backend.load_model(draft_model_name, self.hf_token)
+        logger.info(
+            f"Speculative decoding with draft model {draft_model_name} "
+            f"({settings.LLM_DRAFT_TOKENS} draft tokens per step to start)"
+        )
+        return SpeculativeDecoder(draft_model, settings.LLM_DRAFT_TOKENS)
+
+    def _register_metrics(self):
+        metrics.CallbackMetric(
+            'llm_queue_depth',
+            'Generations admitted to the inference queue, waiting or running',
+            lambda: self._executor.pending
+        )
+        
+        def cache_lookups():
+            caches = {'history': history_cache, 'kv': kv_cache, 'auth_token': token_cache}
+            if self.response_cache is not None:
+                caches['response'] = self.response_cache
+            if settings.VOICE_AUDIO_CACHE_ENABLED:
+                caches['speech_audio'] = audio_cache
+            lookups = {}
+            for name, cache in caches.items():
+                lookups[(name, 'hit')] = cache.hits
+                lookups[(name, 'miss')] = cache.misses
+            return lookups
+        
+        metrics.CallbackMetric(
+            'chat_cache_lookups_total',
+            'Cache lookups by cache and result',
+            cache_lookups,
+            type='counter',
+            labelnames=['cache', 'result']
+        )
+        
+        if self.worker_pool is not None:
+            metrics.CallbackMetric(
+                'llm_worker_restarts_total',
+                'Inference workers restarted after crashing or timing out',
+                lambda: self.worker_pool.restarts,
+                type='counter'
+            )
+
+    def _use_kv_cache(self, conversation_id):
+        # Cached key/values live in this process, so they can't serve worker processes.
+        # Assisted generation doesn't reproduce greedy output from a reused cache, so
+        # speculative decoding takes precedence.
+        return (
+            settings.LLM_KV_CACHE_ENABLED
+            and conversation_id is not None
+            and self.worker_pool is None
+            and self.speculative is None
+            and self.backend.supports_kv_cache
+        )
+
+    def _generate_with_kv_cache(self, prompt, conversation_id, generation_kwargs, **extra_kwargs):
+        """Generate with the conversation's cached key/values so only new prompt tokens are prefilled."""
+        inputs = self.tokenizer(prompt, return_tensors='pt')
+        prompt_length = inputs['input_ids'].shape[1]
+        past_key_values, reused = kv_cache.take(conversation_id, inputs['input_ids'])
+        
+        with torch.inference_mode():
+            output = self.pipe.model.generate(
+                **inputs,
+                past_key_values=past_key_values,
+                return_dict_in_generate=True,
+                **generation_kwargs,
+                **extra_kwargs
+            )
+        
+        # The cache covers the prompt and all generated tokens but the last one
+        cache = output.past_key_values
+        kv_cache.put(conversation_id, output.sequences[:, :cache.get_seq_length()], cache)
+        logger.info(
+            f"Reused {reused}/{prompt_length} prompt tokens from KV cache "
+            f"({kv_cache.total_bytes / 1024 / 1024:.1f}MB cached)"
+        )
+        
+        completion = self.tokenizer.decode(output.sequences[0, prompt_length:], skip_special_tokens=True)
+        return prompt + completion
+
+    def _generation_kwargs(self):
+        if settings.LLM_DETERMINISTIC:
+            return {
+                'max_new_tokens': 128,
+                'do_sample': False,
+                'pad_token_id': self.tokenizer.eos_token_id,
+            }
+        return {
+            'max_new_tokens': 128,
+            'temperature': 0.7,
+            'do_sample': True,
+            'pad_token_id': self.tokenizer.eos_token_id,
+        }
+
+    def extract_response(self, completion):
+        # The model may carry on with turns of its own; those aren't part of the reply
+        return extract_reply(completion)
+
+    def fold_history(self, conversation, conversation_history, message):
+        """Fold turns that no longer fit the prompt budget into ``conversation.summary``.
+
+        ``conversation_history`` must hold the turns newer than
+        ``conversation.summary_last_message_id``, each with its ``id``.
+        Returns the turns that are still sent verbatim.
+        """
+        with metrics.stage('history_fold'):
+            older, recent = self.prompt_builder.split_history(
+                conversation_history, message, conversation.summary
+            )
+            if older:
+                conversation.summary = self.prompt_builder.fold(conversation.summary, older)
+                conversation.summary_last_message_id = older[-1]['id']
+                conversation.save(update_fields=['summary', 'summary_last_message_id'])
+                logger.info(f"Folded {len(older)} turns of conversation {conversation.pk} into its summary")
+        return recent
+
+    def _build_prompt(self, message, conversation_history, summary=''):
+        # Callers are expected to fold_history first; this only guards the budget
+        history = self.prompt_builder.fit_history(conversation_history, message, summary)
+        if len(history) < len(conversation_history):
+            logger.warning(f"Dropped {len(conversation_history) - len(history)} turns over the prompt budget")
+        formatted_history = self._format_conversation_history(history)
+        if summary:
+            formatted_history = "\n".join(
+                part for part in (self.prompt_builder.format_summary(summary), formatted_history) if part
+            )
+        return self._prepare_prompt(formatted_history, message)
 
     def _format_conversation_history(self, history):
         try:
-            formatted = []
-            for msg in history:
-                role = "User" if msg['role'] == 'user' else "Assistant"
-                formatted.append(f"{role}: {msg['content']}")
+            formatted = [self.prompt_builder.format_turn(msg) for msg in history]
             return "\n".join(formatted)
         except Exception as e:
             logger.error(f"Error formatting conversation history: {str(e)}")
@@ -0,0 +1,203 @@
+import bisect
+import contextlib
+import logging
+import threading
+import time
+
+from transformers import StoppingCriteria
+
+logger = logging.getLogger(__name__)
+
+# Seconds, from sub-millisecond DB work up to slow generations on a busy CPU
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (8, 16, 32, 64, 128, 256, 512, 1024, 2048)
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, (), value) for key, value in self._values.items()]
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts with a trailing +Inf bucket, then sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    samples.append((f'{self.name}_bucket', key, (('le', _format_value(bound)),), cumulative))
+                samples.append((f'{self.name}_sum', key, (), total))
+                samples.append((f'{self.name}_count', key, (), cumulative))
+        return samples
+
+
+class CallbackMetric(_Metric):
+    """Counter or gauge whose values are read from ``function`` at scrape time.
+
+    ``function`` returns a number, or a dict mapping label value tuples to
+    numbers. Lets components that already keep their own counters (caches,
+    queues) be exported without instrumenting their hot paths twice.
+    """
+
+    def __init__(self, name, documentation, function, type='gauge', labelnames=(), registry=None):
+        self.type = type
+        self.function = function
+        super().__init__(name, documentation, labelnames, registry)
+
+    def samples(self):
+        values = self.function()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [(self.name, key, (), value) for key, value in values.items()]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        # Re-registering a name replaces it, e.g. when the LLM service reloads
+        with self._lock:
+            self._metrics[metric.name] = metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                logger.error(f"Error collecting metric {metric.name}: {str(e)}")
+                continue
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, key, extra, value in samples:
+                lines.append(f'{name}{_format_labels(metric.labelnames, key, extra)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+stage_seconds = Histogram(
+    'chat_stage_seconds',
+    'Time spent in each stage of handling a chat message',
+    ['stage']
+)
+prompt_tokens = Histogram('llm_prompt_tokens', 'Prompt length in tokens per generation', buckets=TOKEN_BUCKETS)
+completion_tokens = Histogram(
+    'llm_completion_tokens', 'Generated tokens per generation', buckets=TOKEN_BUCKETS
+)
+generation_paths = Counter('llm_generations_total', 'Generations by the path that served them', ['path'])
+
+
+def stage(name):
+    """Context manager timing one stage of a request into ``chat_stage_seconds``."""
+    return stage_seconds.time(stage=name)
+
+
+def observe_generation(prefill, decode):
+    """Record one generation's prefill and decode times, as measured by a ``GenerationTimer``."""
+    stage_seconds.observe(prefill, stage='prefill')
+    stage_seconds.observe(decode, stage='decode')
+
+
+class GenerationTimer(StoppingCriteria):
+    """Notes when the first token is out, splitting generation time into prefill and decode.
+
+    Never stops generation; create it right before calling ``generate``.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.first_token_at = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        return False
+
+    def stages(self):
+        """``(prefill, decode)`` seconds so far, or None if no token was generated."""
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started_at, time.perf_counter() - self.first_token_at
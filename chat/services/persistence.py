@@ -0,0 +1,359 @@
+import atexit
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter, deque
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from ..models import Conversation, Message, WriteBehindCheckpoint
+from . import metrics
+from .history import history_cache
+
+logger = logging.getLogger(__name__)
+
+# SQLite allows one writer at a time. Queueing this process's writers on a lock
+# hands the database over in order, instead of leaving them to SQLite's busy
+# handler, which sleeps and retries and so gives long tail latencies.
+_sqlite_write_lock = threading.Lock()
+
+flushed_turns = metrics.Counter('chat_write_behind_flushed_turns_total', 'Turns the write-behind queue wrote to the database')
+flush_failures = metrics.Counter('chat_write_behind_flush_failures_total', 'Write-behind batches that failed and will be retried')
+flush_batch_turns = metrics.Histogram(
+    'chat_write_behind_batch_turns', 'Turns written per write-behind batch', buckets=(1, 2, 5, 10, 20, 50, 100, 200)
+)
+
+
+def write_lock():
+    """Context manager serializing this process's database writers (on SQLite; a no-op elsewhere)."""
+    return _sqlite_write_lock if connection.vendor == 'sqlite' else contextlib.nullcontext()
+
+
+def _insert_messages(messages):
+    """Insert ``messages`` inside the caller's transaction.
+
+    Returns True when the caller has to add them to the history cache itself.
+    """
+    if connection.features.can_return_rows_from_bulk_insert:
+        Message.objects.bulk_create(messages)
+        return True
+    # Without ids back from a bulk insert the history cache couldn't track them
+    for message in messages:
+        message.save()
+    return False
+
+
+def touch_conversation(conversation):
+    # A single UPDATE instead of fetching and re-saving the whole row
+    return Conversation.objects.filter(pk=conversation.pk).update(updated_at=timezone.now())
+
+
+def _turn_messages(conversation_id, user_content, ai_content, **fields):
+    messages = [Message(conversation_id=conversation_id, content=user_content, role='user', **fields)]
+    if ai_content is not None:
+        messages.append(Message(conversation_id=conversation_id, content=ai_content, role='assistant', **fields))
+    return messages
+
+
+def save_turn(conversation, user_content, ai_content):
+    """Persist a user message and its reply, and bump the conversation, in one transaction.
+
+    Both messages go in a single INSERT, so a turn takes the database write
+    lock once instead of three times. ``ai_content`` is None for a message
+    that got no reply. Returns ``(user_message, ai_message)``; ``ai_message``
+    is None without a reply.
+    """
+    messages = _turn_messages(conversation.pk, user_content, ai_content)
+
+    with metrics.stage('persistence'), write_lock():
+        with transaction.atomic():
+            append_to_history = _insert_messages(messages)
+            touch_conversation(conversation)
+
+    if append_to_history:
+        # bulk_create skips post_save, so keep the history cache current here
+        for message in messages:
+            history_cache.append(message)
+    return messages[0], messages[1] if len(messages) > 1 else None
+
+
+def persist_turn(conversation, user_content, ai_content):
+    """Save a turn through the write-behind queue when it's enabled, otherwise right away."""
+    if settings.CHAT_WRITE_BEHIND_ENABLED:
+        return get_write_behind().enqueue(conversation.pk, user_content, ai_content)
+    return save_turn(conversation, user_content, ai_content)
+
+
+def persist_unanswered(conversation, user_content):
+    """Save a user message whose reply failed or was abandoned, so it isn't lost along with the reply."""
+    try:
+        persist_turn(conversation, user_content, None)
+    except Exception as e:
+        logger.error(f"Error saving unanswered message of conversation {conversation.pk}: {str(e)}")
+
+
+def wait_for_pending(conversation_id):
+    """Block until queued turns of ``conversation_id`` are in the database, so readers see their own writes."""
+    if settings.CHAT_WRITE_BEHIND_ENABLED:
+        get_write_behind().wait_for(conversation_id)
+
+
+class _Entry:
+    def __init__(self, seq, conversation_id, user_content, ai_content):
+        self.seq = seq
+        self.conversation_id = conversation_id
+        self.user_content = user_content
+        self.ai_content = ai_content
+
+    def to_json(self):
+        return json.dumps({
+            'seq': self.seq,
+            'conversation_id': self.conversation_id,
+            'user': self.user_content,
+            'assistant': self.ai_content,
+        })
+
+
+class WriteBehindQueue:
+    """Acknowledges chat turns right away and writes them to the database in batches from a thread.
+
+    Every turn is appended to a local journal and fsynced before ``enqueue``
+    returns, so an acknowledged turn survives a crash. The flusher inserts the
+    queued messages and bumps ``Conversation.updated_at`` every
+    ``flush_interval`` seconds, or as soon as ``batch_size`` turns are waiting,
+    and records the last journal entry written in the same transaction. On
+    start, entries past that checkpoint are replayed, so each turn is written
+    exactly once. The journal is truncated whenever the queue drains.
+    """
+
+    def __init__(self, journal_path, flush_interval=0.2, batch_size=100, retry_seconds=1.0):
+        self.journal_path = str(journal_path)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.retry_seconds = retry_seconds
+
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        # Serializes batches between the flusher and flush()/close()
+        self._write_batch_lock = threading.Lock()
+        self._pending = deque()
+        self._pending_by_conversation = Counter()
+        self._flush_requested = False
+        self._closed = False
+
+        self._journal = open(self.journal_path, 'a+', encoding='utf-8')
+        try:
+            # Two processes sharing a journal would each replay the other's turns
+            fcntl.flock(self._journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._journal.close()
+            raise RuntimeError(f"Write-behind journal {self.journal_path} is in use by another process")
+
+        self.journal_id, entries = self._read_journal()
+        self._seq = self._replay(entries)
+
+        self._flusher = threading.Thread(target=self._run, name='write-behind-flusher', daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def enqueue(self, conversation_id, user_content, ai_content):
+        """Journal a turn and queue it; returns unsaved ``(user_message, ai_message)`` to respond with."""
+        with metrics.stage('persistence'), self._lock:
+            if self._closed:
+                raise RuntimeError("Write-behind queue is closed")
+            self._seq += 1
+            entry = _Entry(self._seq, conversation_id, user_content, ai_content)
+            self._journal.write(entry.to_json() + '\n')
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._add(entry)
+
+        # Ids are assigned when the flusher inserts them
+        messages = _turn_messages(conversation_id, user_content, ai_content, timestamp=timezone.now())
+        return messages[0], messages[1] if len(messages) > 1 else None
+
+    def wait_for(self, conversation_id, timeout=30):
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while self._pending_by_conversation[conversation_id] and not self._closed:
+                self._flush_requested = True
+                self._changed.notify_all()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"Timed out waiting for queued turns of conversation {conversation_id}")
+                    return
+                self._changed.wait(remaining)
+
+    def flush(self):
+        """Write everything queued so far; returns False if a batch failed."""
+        while True:
+            with self._lock:
+                if not self._pending:
+                    return True
+            if not self._write_next_batch():
+                return False
+
+    def close(self):
+        """Stop the flusher and write what's left; whatever fails stays in the journal for the next start."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._changed.notify_all()
+        self._flusher.join()
+        if self.flush():
+            logger.info("Write-behind queue flushed")
+        else:
+            logger.error(f"Write-behind queue closed with {len(self._pending)} turns left in {self.journal_path}")
+        self._journal.close()
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'last_seq': self._seq,
+            }
+
+    def _add(self, entry):
+        self._pending.append(entry)
+        self._pending_by_conversation[entry.conversation_id] += 1
+        if len(self._pending) >= self.batch_size:
+            self._flush_requested = True
+            self._changed.notify_all()
+
+    def _read_journal(self):
+        self._journal.seek(0)
+        lines = self._journal.read().splitlines()
+        journal_id = None
+        entries = []
+        for number, line in enumerate(lines, start=1):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A crash mid-append leaves a partial last line, for a turn that was never acknowledged
+                if number != len(lines):
+                    logger.error(f"Skipping corrupt line {number} of write-behind journal {self.journal_path}")
+                continue
+            if 'journal' in record:
+                journal_id = record['journal']
+            else:
+                entries.append(_Entry(record['seq'], record['conversation_id'], record['user'], record['assistant']))
+
+        if journal_id is None:
+            journal_id = uuid.uuid4().hex
+            self._truncate_journal(journal_id)
+        return journal_id, entries
+
+    def _truncate_journal(self, journal_id):
+        self._journal.seek(0)
+        self._journal.truncate()
+        self._journal.write(json.dumps({'journal': journal_id}) + '\n')
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def _replay(self, entries):
+        checkpoint = WriteBehindCheckpoint.objects.filter(journal_id=self.journal_id).first()
+        last_seq = checkpoint.last_seq if checkpoint else 0
+        replayed = [entry for entry in entries if entry.seq > last_seq]
+        with self._lock:
+            for entry in replayed:
+                self._add(entry)
+        if replayed:
+            logger.warning(f"Replaying {len(replayed)} turns from write-behind journal {self.journal_path}")
+        # Keep numbering past anything in the journal, written or not
+        return max([last_seq] + [entry.seq for entry in entries])
+
+    def _run(self):
+        try:
+            while True:
+                with self._lock:
+                    if not self._flush_requested and not self._closed:
+                        self._changed.wait(self.flush_interval)
+                    self._flush_requested = False
+                    if self._closed:
+                        return
+                    if not self._pending:
+                        continue
+                if not self._write_next_batch():
+                    time.sleep(self.retry_seconds)
+        finally:
+            connection.close()
+
+    def _write_next_batch(self):
+        with self._write_batch_lock:
+            with self._lock:
+                batch = [self._pending[index] for index in range(min(self.batch_size, len(self._pending)))]
+            if not batch:
+                return True
+
+            conversation_ids = {entry.conversation_id for entry in batch}
+            try:
+                with metrics.stage('write_behind_flush'), write_lock(), transaction.atomic():
+                    existing = set(
+                        Conversation.objects.filter(pk__in=conversation_ids).values_list('pk', flat=True)
+                    )
+                    messages = []
+                    for entry in batch:
+                        if entry.conversation_id not in existing:
+                            # Deleted while the turn was queued; there's nothing to attach it to
+                            logger.warning(f"Dropping queued turn for deleted conversation {entry.conversation_id}")
+                            continue
+                        messages += _turn_messages(entry.conversation_id, entry.user_content, entry.ai_content)
+                    append_to_history = _insert_messages(messages)
+                    Conversation.objects.filter(pk__in=existing).update(updated_at=timezone.now())
+                    WriteBehindCheckpoint.objects.update_or_create(
+                        journal_id=self.journal_id, defaults={'last_seq': batch[-1].seq}
+                    )
+            except Exception as e:
+                flush_failures.inc()
+                logger.error(f"Error writing {len(batch)} queued turns: {str(e)}")
+                return False
+
+            if append_to_history:
+                for message in messages:
+                    history_cache.append(message)
+
+            with self._lock:
+                for entry in batch:
+                    self._pending.popleft()
+                    self._pending_by_conversation[entry.conversation_id] -= 1
+                    if not self._pending_by_conversation[entry.conversation_id]:
+                        del self._pending_by_conversation[entry.conversation_id]
+                if not self._pending:
+                    # Everything journaled is in the database now
+                    self._truncate_journal(self.journal_id)
+                self._changed.notify_all()
+
+            flushed_turns.inc(len(batch))
+            flush_batch_turns.observe(len(batch))
+            return True
+
+
+_write_behind = None
+_write_behind_lock = threading.Lock()
+
+
+def get_write_behind():
+    """The process-wide write-behind queue, started (replaying its journal) on first use."""
+    global _write_behind
+    with _write_behind_lock:
+        if _write_behind is None:
+            _write_behind = WriteBehindQueue(
+                settings.CHAT_WRITE_BEHIND_JOURNAL,
+                flush_interval=settings.CHAT_WRITE_BEHIND_FLUSH_MS / 1000,
+                batch_size=settings.CHAT_WRITE_BEHIND_BATCH_SIZE
+            )
+            queue = _write_behind
+            metrics.CallbackMetric(
+                'chat_write_behind_pending_turns',
+                'Turns acknowledged but not yet written to the database',
+                lambda: queue.get_stats()['pending']
+            )
+        return _write_behind
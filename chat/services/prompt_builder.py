@@ -0,0 +1,140 @@
+import functools
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s')
+
+# A line opening another turn; the model has stopped replying and is writing the conversation on
+ROLE_MARKER = re.compile(r'\n[ \t]*(?:User|Assistant):')
+_ROLE_NAMES = ('User:', 'Assistant:')
+
+
+def extract_reply(completion):
+    """The reply in a generated ``completion``: everything before the first role marker."""
+    return ROLE_MARKER.split(completion, maxsplit=1)[0].strip()
+
+
+class ReplyExtractor:
+    """Extracts the reply from a streamed completion as it arrives, matching ``extract_reply``.
+
+    Text is passed on as soon as it can't be the start of a role marker;
+    everything from the first marker on is dropped.
+    """
+
+    def __init__(self):
+        self._text = ''
+        self._sent = 0
+        self.ended = False
+
+    def feed(self, chunk):
+        """Add ``chunk``; returns the reply text it settled, possibly none."""
+        if self.ended:
+            return ''
+        self._text += chunk
+        match = ROLE_MARKER.search(self._text, self._sent)
+        if match:
+            self.ended = True
+            return self._take(match.start())
+        # Hold back a last line that may still become a role marker
+        line_start = self._text.rfind('\n', self._sent)
+        if line_start != -1:
+            line = self._text[line_start + 1:].lstrip(' \t')
+            if any(name.startswith(line) for name in _ROLE_NAMES):
+                return self._take(line_start)
+        return self._take(len(self._text))
+
+    def flush(self):
+        """The rest of the reply, once the completion has ended."""
+        if self.ended:
+            return ''
+        self.ended = True
+        return self._take(len(self._text))
+
+    def _take(self, end):
+        text = self._text[self._sent:end]
+        self._sent = end
+        return text
+
+
+class PromptBuilder:
+    """Keeps prompts within a token budget using a sliding window over the history.
+
+    Turns that slide out of the window are folded into a rolling summary that
+    stays in the prompt. Token counts are memoized per formatted turn, so an
+    unchanged transcript isn't re-tokenized on every request.
+    """
+
+    SUMMARY_HEADER = "Summary of earlier conversation:"
+    SUMMARY_TURN_CHARS = 200
+
+    def __init__(self, tokenizer, max_prompt_tokens, max_summary_tokens, cache_size=4096):
+        self.tokenizer = tokenizer
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_summary_tokens = max_summary_tokens
+        self.count_tokens = functools.lru_cache(maxsize=cache_size)(self._count_tokens)
+
+    def _count_tokens(self, text):
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    @staticmethod
+    def format_turn(message):
+        role = "User" if message['role'] == 'user' else "Assistant"
+        return f"{role}: {message['content']}"
+
+    def format_summary(self, summary):
+        return f"{self.SUMMARY_HEADER}\n{summary}" if summary else ""
+
+    def fit_history(self, history, new_message, summary=''):
+        """Return the most recent turns of ``history`` that fit in the prompt budget."""
+        return history[self._window_start(history, self._history_budget(new_message, summary)):]
+
+    def split_history(self, history, new_message, summary=''):
+        """Split ``history`` into ``(older, recent)`` turns.
+
+        ``older`` is empty while everything fits. Once the budget is exceeded,
+        the window shrinks to half of it, so the summary (and the cached
+        prompt prefix) only changes every few turns instead of every turn.
+        """
+        budget = self._history_budget(new_message, summary)
+        if self._window_start(history, budget) == 0:
+            return [], history
+
+        start = self._window_start(history, budget // 2)
+        return history[:start], history[start:]
+
+    def fold(self, summary, turns):
+        """Fold ``turns`` into ``summary``, keeping the newest lines that fit the summary budget."""
+        lines = summary.splitlines() if summary else []
+        for turn in turns:
+            content = _SENTENCE_END.split(turn['content'].strip(), maxsplit=1)[0]
+            if len(content) > self.SUMMARY_TURN_CHARS:
+                content = content[:self.SUMMARY_TURN_CHARS].rstrip() + '...'
+            if content:
+                lines.append(self.format_turn({'role': turn['role'], 'content': content}))
+
+        kept = []
+        used = 0
+        for line in reversed(lines):
+            # +1 for the newline joining lines; a line too long to fit is skipped, not truncated
+            cost = self.count_tokens(line) + 1
+            if used + cost <= self.max_summary_tokens:
+                kept.append(line)
+                used += cost
+        return "\n".join(reversed(kept))
+
+    def _history_budget(self, new_message, summary):
+        used = self.count_tokens(f"User: {new_message}\nAssistant:")
+        if summary:
+            used += self.count_tokens(self.format_summary(summary)) + 1
+        return self.max_prompt_tokens - used
+
+    def _window_start(self, history, budget):
+        used = 0
+        for index in range(len(history) - 1, -1, -1):
+            # +1 for the newline joining turns
+            used += self.count_tokens(self.format_turn(history[index])) + 1
+            if used > budget:
+                return index + 1
+        return 0
@@ -0,0 +1,57 @@
+import hashlib
+import json
+import logging
+import threading
+
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """Caches generated replies keyed on the exact prompt, model and generation parameters.
+
+    Only meaningful for deterministic (greedy) decoding, where the same prompt
+    always yields the same reply. Storage, TTL and size bounds come from the
+    Django cache configured under ``cache_alias``.
+    """
+
+    KEY_PREFIX = 'llm-response'
+
+    def __init__(self, model_name, cache_alias='llm_responses'):
+        self.model_name = model_name
+        self.cache = caches[cache_alias]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, prompt, generation_kwargs):
+        # Any change to the prompt, even whitespace or case, can change what the model generates
+        payload = json.dumps({
+            'prompt': prompt,
+            'model': self.model_name,
+            'params': generation_kwargs,
+        }, sort_keys=True)
+        return f"{self.KEY_PREFIX}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+    def get(self, prompt, generation_kwargs):
+        response = self.cache.get(self.make_key(prompt, generation_kwargs))
+        with self._lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return response
+
+    def set(self, prompt, generation_kwargs, response):
+        self.cache.set(self.make_key(prompt, generation_kwargs), response)
+
+    def get_stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / lookups if lookups else 0.0,
+        }
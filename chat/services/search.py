@@ -0,0 +1,148 @@
+import datetime
+import html
+import logging
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Text search configuration of the Postgres index; must match migration 0006
+POSTGRES_CONFIG = 'english'
+
+# Private-use characters mark matches in snippets, so the text can be escaped before they become <mark> tags
+_MATCH_START = '\ue000'
+_MATCH_END = '\ue001'
+SNIPPET_WORDS = 16
+
+_TERM = re.compile(r'\w+', re.UNICODE)
+
+
+def fts5_query(text):
+    """Turn free text into an FTS5 query matching messages containing every word.
+
+    Words are quoted, so FTS5 operators and column filters typed by users are
+    searched for literally instead of being interpreted.
+    """
+    terms = _TERM.findall(text)
+    return ' '.join(f'"{term}"' for term in terms)
+
+
+def _render_snippet(snippet):
+    return html.escape(snippet or '').replace(_MATCH_START, '<mark>').replace(_MATCH_END, '</mark>')
+
+
+def _sqlite_search(user_id, text, limit, offset):
+    query = fts5_query(text)
+    if not query:
+        return []
+    sql = f"""
+        SELECT m.id, m.conversation_id, c.title, m.role, m.timestamp,
+               snippet(chat_message_fts, 0, %s, %s, '…', {SNIPPET_WORDS}),
+               bm25(chat_message_fts) AS rank
+        FROM chat_message_fts
+        JOIN chat_message m ON m.id = chat_message_fts.rowid
+        JOIN chat_conversation c ON c.id = m.conversation_id
+        WHERE chat_message_fts MATCH %s AND c.user_id = %s
+        ORDER BY rank
+        LIMIT %s OFFSET %s
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [_MATCH_START, _MATCH_END, query, user_id, limit, offset])
+        rows = cursor.fetchall()
+    # bm25 is lower for better matches; flip it so higher rank is better on every backend
+    return [(*row[:4], _sqlite_datetime(row[4]), row[5], -row[6]) for row in rows]
+
+
+def _sqlite_datetime(value):
+    # Raw SQLite cursors return naive datetimes; the ORM would make them aware
+    if settings.USE_TZ and timezone.is_naive(value):
+        value = timezone.make_aware(value, datetime.timezone.utc)
+    return value
+
+
+def _postgres_search(user_id, text, limit, offset):
+    # Headlines are expensive, so they're only made for the page of ranked matches
+    sql = f"""
+        SELECT page.id, page.conversation_id, page.title, page.role, page.timestamp,
+               ts_headline(%s, page.content, page.query, %s), page.rank
+        FROM (
+            SELECT m.id, m.conversation_id, c.title, m.role, m.timestamp, m.content, query,
+                   ts_rank(to_tsvector(%s, m.content), query) AS rank
+            FROM chat_message m
+            JOIN chat_conversation c ON c.id = m.conversation_id,
+                 websearch_to_tsquery(%s, %s) query
+            WHERE to_tsvector(%s, m.content) @@ query AND c.user_id = %s
+            ORDER BY rank DESC
+            LIMIT %s OFFSET %s
+        ) page
+        ORDER BY page.rank DESC
+    """
+    options = f'StartSel={_MATCH_START}, StopSel={_MATCH_END}, MaxWords={SNIPPET_WORDS}, MinWords=6'
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [
+            POSTGRES_CONFIG, options, POSTGRES_CONFIG, POSTGRES_CONFIG, text, POSTGRES_CONFIG, user_id, limit, offset
+        ])
+        return cursor.fetchall()
+
+
+def _scan_search(user_id, text, limit, offset):
+    from ..models import Message
+
+    # No full-text index on this database; a slow LIKE scan, but correct
+    messages = Message.objects.filter(conversation__user_id=user_id, content__icontains=text)
+    rows = messages.order_by('-timestamp').values_list(
+        'id', 'conversation_id', 'conversation__title', 'role', 'timestamp', 'content'
+    )[offset:offset + limit]
+    return [(*row[:5], row[5][:200], 0.0) for row in rows]
+
+
+def search_messages(user_id, text, limit=20, offset=0):
+    """Messages of ``user_id``'s conversations matching ``text``, best match first.
+
+    Returns dicts with ``id``, ``conversation_id``, ``conversation_title``,
+    ``role``, ``timestamp``, ``snippet`` (HTML-escaped, matches wrapped in
+    ``<mark>``) and ``rank`` (higher is better).
+    """
+    text = text.strip()
+    if not text:
+        return []
+    if connection.vendor == 'sqlite':
+        rows = _sqlite_search(user_id, text, limit, offset)
+    elif connection.vendor == 'postgresql':
+        rows = _postgres_search(user_id, text, limit, offset)
+    else:
+        rows = _scan_search(user_id, text, limit, offset)
+    return [
+        {
+            'id': id,
+            'conversation_id': conversation_id,
+            'conversation_title': title,
+            'role': role,
+            'timestamp': timestamp,
+            'snippet': _render_snippet(snippet),
+            'rank': rank,
+        }
+        for id, conversation_id, title, role, timestamp, snippet, rank in rows
+    ]
+
+
+def matching_message_ids(text):
+    """SQL selecting the ids of all messages matching ``text``, for ``pk__in`` filters.
+
+    None if the database has no full-text index or ``text`` has nothing to search for.
+    """
+    if connection.vendor == 'sqlite':
+        query = fts5_query(text)
+        if not query:
+            return None
+        return RawSQL('SELECT rowid FROM chat_message_fts WHERE chat_message_fts MATCH %s', [query])
+    if connection.vendor == 'postgresql':
+        return RawSQL(
+            'SELECT id FROM chat_message WHERE to_tsvector(%s, content) @@ websearch_to_tsquery(%s, %s)',
+            [POSTGRES_CONFIG, POSTGRES_CONFIG, text]
+        )
+    return None
@@ -0,0 +1,174 @@
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+from concurrent.futures import Future
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+coalesced_generations = metrics.Counter(
+    'llm_coalesced_generations_total',
+    'Requests served by joining an identical generation already in flight',
+    ['mode']
+)
+
+
+class _SharedStream:
+    """Fans one chunk iterator out to every request that joined it.
+
+    There's no pump thread: whichever subscriber runs out of buffered chunks
+    pulls the next one from ``source`` for everybody. The source is closed,
+    cancelling the generation, only once the last subscriber has gone.
+    """
+
+    def __init__(self, flight, key, source):
+        self.flight = flight
+        self.key = key
+        self.source = source
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.closed = False
+        self.subscribers = 0
+        self._pull_lock = threading.Lock()
+
+    def iterate(self):
+        index = 0
+        try:
+            while True:
+                if index < len(self.chunks):
+                    index += 1
+                    yield self.chunks[index - 1]
+                    continue
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                with self._pull_lock:
+                    if index < len(self.chunks) or self.done:
+                        continue
+                    try:
+                        self.chunks.append(next(self.source))
+                    except StopIteration:
+                        # The source reports its own errors as chunks, so this is the only way out
+                        self.done = True
+                        self.flight._forget(self.key, self)
+        finally:
+            if self.flight._unsubscribe(self):
+                self.source.close()
+
+
+class SingleFlight:
+    """Lets concurrent identical generation requests share one generation.
+
+    Requests with the same prompt and generation parameters that
+    arrive while a generation is in flight wait for it and get its reply,
+    instead of queueing a generation of their own. Only the in-flight call
+    is shared; finished replies are the response cache's job.
+    """
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._streams = {}
+        self.generations = 0
+        self.coalesced = 0
+
+    def make_key(self, prompt, generation_kwargs):
+        payload = json.dumps({
+            'prompt': prompt,
+            'model': self.model_name,
+            'params': generation_kwargs,
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    async def run(self, key, generate):
+        """Await ``generate()``, or the call already running under ``key``, and return its result."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.generations += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            coalesced_generations.inc(mode='response')
+            logger.info("Joined an identical generation already in flight")
+            return await asyncio.wrap_future(future)
+
+        try:
+            result = await generate()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def stream(self, key, start):
+        """Return an iterator over the chunks of the stream under ``key``, calling ``start()`` if there's none."""
+        with self._lock:
+            shared = self._streams.get(key)
+            leader = shared is None
+            if leader:
+                shared = self._streams[key] = _SharedStream(self, key, None)
+                # Joiners wait on this until there's a source to pull from
+                shared._pull_lock.acquire()
+                self.generations += 1
+            else:
+                self.coalesced += 1
+            shared.subscribers += 1
+
+        if not leader:
+            coalesced_generations.inc(mode='stream')
+            logger.info("Joined an identical stream already in flight")
+            return shared.iterate()
+
+        try:
+            shared.source = start()
+        except BaseException as e:
+            # Anyone who joined meanwhile fails the same way
+            shared.error = e
+            shared.done = True
+            with self._lock:
+                shared.subscribers -= 1
+                self._forget_locked(key, shared)
+            raise
+        finally:
+            shared._pull_lock.release()
+        return shared.iterate()
+
+    def get_stats(self):
+        with self._lock:
+            generations, coalesced = self.generations, self.coalesced
+        return {
+            'generations': generations,
+            'coalesced': coalesced,
+        }
+
+    def _forget(self, key, shared):
+        with self._lock:
+            self._forget_locked(key, shared)
+
+    def _forget_locked(self, key, shared):
+        if self._streams.get(key) is shared:
+            del self._streams[key]
+
+    def _unsubscribe(self, shared):
+        """Drop a subscriber; returns True if it was the last one of an unfinished stream."""
+        with self._lock:
+            shared.subscribers -= 1
+            if shared.subscribers or shared.closed:
+                return False
+            shared.closed = True
+            self._forget_locked(shared.key, shared)
+            return not shared.done
@@ -0,0 +1,91 @@
+import logging
+import threading
+
+from transformers import StoppingCriteria, StoppingCriteriaList
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+proposed_tokens = metrics.Counter('llm_speculative_proposed_tokens_total', 'Tokens proposed by the draft model')
+accepted_tokens = metrics.Counter(
+    'llm_speculative_accepted_tokens_total', 'Draft tokens the main model accepted'
+)
+acceptance_rate = metrics.Histogram(
+    'llm_speculative_acceptance_rate',
+    'Share of proposed draft tokens accepted, per generation',
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+)
+
+
+class _VerificationCounter(StoppingCriteria):
+    """Counts verification steps; each one appends the accepted draft tokens plus one from the main model."""
+
+    def __init__(self):
+        self.steps = 0
+        self.length = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        self.steps += 1
+        self.length = input_ids.shape[1]
+        return False
+
+
+class SpeculativeDecoder:
+    """Assisted generation: ``draft_model`` proposes tokens that the main model verifies in one forward pass.
+
+    Under greedy decoding the output is identical to the main model's own.
+    Draft and main model must share a tokenizer. Assisted generation works on
+    one sequence at a time, so it doesn't combine with batching.
+    """
+
+    def __init__(self, draft_model, num_draft_tokens):
+        self.draft_model = draft_model
+        # Starting proposal length; transformers adapts it to how many tokens get accepted
+        self.draft_model.generation_config.num_assistant_tokens = num_draft_tokens
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.proposed = 0
+        self.accepted = 0
+        # Every draft forward pass proposes one token; counted per thread as generations run concurrently
+        self.draft_model.register_forward_hook(self._count_proposal)
+
+    def _count_proposal(self, module, args, output):
+        if getattr(self._local, 'proposed', None) is not None:
+            self._local.proposed += 1
+
+    def generate(self, prompt_length, generate, *args, **kwargs):
+        """Call ``generate`` with the draft model attached and record how many of its tokens were accepted.
+
+        ``prompt_length`` is the prompt's length in tokens, to tell generated
+        tokens apart from the prompt.
+        """
+        counter = _VerificationCounter()
+        kwargs['stopping_criteria'] = StoppingCriteriaList(list(kwargs.get('stopping_criteria') or []) + [counter])
+        self._local.proposed = 0
+        try:
+            return generate(*args, assistant_model=self.draft_model, **kwargs)
+        finally:
+            proposed = self._local.proposed
+            self._local.proposed = None
+            if counter.steps and proposed:
+                accepted = max(0, counter.length - prompt_length - counter.steps)
+                self._record(proposed, accepted)
+
+    def _record(self, proposed, accepted):
+        with self._lock:
+            self.proposed += proposed
+            self.accepted += accepted
+        proposed_tokens.inc(proposed)
+        accepted_tokens.inc(accepted)
+        acceptance_rate.observe(accepted / proposed)
+        logger.info(f"Draft model proposed {proposed} tokens, {accepted} accepted ({accepted / proposed:.0%})")
+
+    def get_stats(self):
+        with self._lock:
+            proposed, accepted = self.proposed, self.accepted
+        return {
+            'proposed': proposed,
+            'accepted': accepted,
+            'acceptance_rate': accepted / proposed if proposed else 0.0,
+        }
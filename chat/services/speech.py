@@ -0,0 +1,329 @@
+import array
+import base64
+import io
+import itertools
+import json
+import logging
+import math
+import re
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+import wave
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from . import metrics
+from .audio_cache import audio_cache
+
+logger = logging.getLogger(__name__)
+
+synthesized_segments = metrics.Counter(
+    'chat_speech_segments_total', 'Sentences synthesized to speech, by provider', ['provider']
+)
+synthesis_failures = metrics.Counter(
+    'chat_speech_failures_total', 'Sentences whose synthesis failed and were left unspoken', ['provider']
+)
+
+# Oculus-style viseme set the avatar's blend shapes are named after; 'sil' is a closed mouth
+VISEMES = ('sil', 'PP', 'FF', 'TH', 'DD', 'kk', 'CH', 'SS', 'nn', 'RR', 'aa', 'E', 'I', 'O', 'U')
+_DIGRAPH_VISEMES = {'th': 'TH', 'ch': 'CH', 'sh': 'CH', 'ph': 'FF', 'ng': 'nn', 'qu': 'kk'}
+_LETTER_VISEMES = {
+    'a': 'aa', 'e': 'E', 'i': 'I', 'o': 'O', 'u': 'U', 'y': 'I', 'w': 'U',
+    'b': 'PP', 'm': 'PP', 'p': 'PP', 'f': 'FF', 'v': 'FF',
+    'd': 'DD', 't': 'DD', 'l': 'nn', 'n': 'nn',
+    'c': 'kk', 'g': 'kk', 'k': 'kk', 'q': 'kk', 'x': 'kk',
+    'j': 'CH', 's': 'SS', 'z': 'SS', 'r': 'RR',
+}
+
+
+def visemes_for_characters(characters, start_times_ms):
+    """Viseme timeline for text whose ``characters`` start speaking at ``start_times_ms``.
+
+    Spelling is only an approximation of pronunciation, but it's close enough
+    for a mouth to follow. Returns ``{'time_ms', 'viseme'}`` dicts, with a new
+    entry only where the viseme changes.
+    """
+    timeline = []
+    index = 0
+    while index < len(characters):
+        pair = ''.join(characters[index:index + 2]).lower()
+        if pair in _DIGRAPH_VISEMES:
+            viseme, step = _DIGRAPH_VISEMES[pair], 2
+        else:
+            char = characters[index].lower()
+            # 'h' is breath; the mouth keeps the previous shape
+            viseme = None if char == 'h' else _LETTER_VISEMES.get(char, 'sil' if not char.isalpha() else 'aa')
+            step = 1
+        if viseme is not None and (not timeline or timeline[-1]['viseme'] != viseme):
+            timeline.append({'time_ms': int(start_times_ms[index]), 'viseme': viseme})
+        index += step
+    return timeline
+
+
+class SentenceChunker:
+    """Splits streamed text into sentences as soon as each one is complete.
+
+    Sentences shorter than ``min_chars`` are held back and joined to the
+    next, so abbreviations and interjections don't become separate clips.
+    """
+
+    BOUNDARY = re.compile(r'[.!?…]+["\')\]]*\s+|\n+')
+
+    def __init__(self, min_chars=20):
+        self.min_chars = min_chars
+        self._buffer = ''
+
+    def feed(self, text):
+        """Add ``text``; returns the sentences it completed."""
+        self._buffer += text
+        sentences = []
+        start = 0
+        for match in self.BOUNDARY.finditer(self._buffer):
+            if len(self._buffer[start:match.end()].strip()) >= self.min_chars:
+                sentences.append(self._buffer[start:match.end()].strip())
+                start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self):
+        """The rest of the text, once the stream has ended."""
+        rest, self._buffer = self._buffer.strip(), ''
+        return [rest] if rest else []
+
+
+class SpeechProvider:
+    """Turns a sentence into audio and the viseme timeline to lip-sync it.
+
+    ``synthesize`` returns a dict with ``audio`` (bytes), ``media_type``,
+    ``duration_ms`` and ``visemes`` (see ``visemes_for_characters``).
+    Providers must be safe to call from several threads at once.
+    """
+
+    name = None
+
+    def synthesize(self, text, voice_id):
+        raise NotImplementedError
+
+    def cache_params(self):
+        """Everything besides the text and voice that changes the audio; part of the audio cache key."""
+        return {}
+
+
+class LocalSpeechProvider(SpeechProvider):
+    """Offline stand-in voice: a hum per vowel and a hiss per consonant, as 16kHz WAV.
+
+    It sounds nothing like speech, but it's deterministic, needs no network or
+    API key, and produces audio with a matching viseme timeline, so tests and
+    frontend development can exercise the whole pipeline.
+    """
+
+    name = 'local'
+    SAMPLE_RATE = 16000
+    VOWEL_MS = 90
+    CONSONANT_MS = 60
+    SPACE_MS = 40
+    PAUSE_MS = 200
+
+    def synthesize(self, text, voice_id):
+        # The voice only shifts the pitch, so different voices are told apart
+        pitch = 110 + sum(voice_id.encode('utf-8')) % 80
+        samples = array.array('h')
+        start_times = []
+        noise = 1
+        for char in text:
+            start_times.append(len(samples) * 1000 / self.SAMPLE_RATE)
+            lower = char.lower()
+            if lower in 'aeiouy':
+                length = self.VOWEL_MS * self.SAMPLE_RATE // 1000
+                frequency = pitch * (2 + 'aeiouy'.index(lower) / 2)
+                samples.extend(
+                    int(8000 * math.sin(math.pi * n / length) * math.sin(2 * math.pi * frequency * n / self.SAMPLE_RATE))
+                    for n in range(length)
+                )
+            elif char.isalpha():
+                length = self.CONSONANT_MS * self.SAMPLE_RATE // 1000
+                for n in range(length):
+                    noise = (noise * 1103515245 + 12345) & 0x7fffffff
+                    samples.append((noise >> 16) % 4000 - 2000)
+            else:
+                pause = self.PAUSE_MS if char in '.,;:!?…' else self.SPACE_MS
+                samples.extend([0] * (pause * self.SAMPLE_RATE // 1000))
+
+        audio = io.BytesIO()
+        with wave.open(audio, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(self.SAMPLE_RATE)
+            wav.writeframes(samples.tobytes())
+        return {
+            'audio': audio.getvalue(),
+            'media_type': 'audio/wav',
+            'duration_ms': len(samples) * 1000 // self.SAMPLE_RATE,
+            'visemes': visemes_for_characters(text, start_times),
+        }
+
+    def cache_params(self):
+        return {
+            'sample_rate': self.SAMPLE_RATE,
+            'durations_ms': [self.VOWEL_MS, self.CONSONANT_MS, self.SPACE_MS, self.PAUSE_MS],
+        }
+
+
+class ElevenLabsProvider(SpeechProvider):
+    """ElevenLabs text-to-speech, with the character timings it returns turned into visemes."""
+
+    name = 'elevenlabs'
+    URL = 'https://api.elevenlabs.io/v1/text-to-speech/{voice_id}/with-timestamps?output_format=mp3_44100_128'
+    TIMEOUT_SECONDS = 30
+
+    def __init__(self):
+        if not settings.ELEVENLABS_API_KEY:
+            raise ImproperlyConfigured("The 'elevenlabs' voice provider requires ELEVENLABS_API_KEY")
+        self.api_key = settings.ELEVENLABS_API_KEY
+        self.model_id = settings.ELEVENLABS_MODEL_ID
+
+    def synthesize(self, text, voice_id):
+        request = urllib.request.Request(
+            self.URL.format(voice_id=urllib.parse.quote(voice_id, safe='')),
+            data=json.dumps({'text': text, 'model_id': self.model_id}).encode('utf-8'),
+            headers={'xi-api-key': self.api_key, 'Content-Type': 'application/json', 'Accept': 'application/json'},
+            method='POST'
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.TIMEOUT_SECONDS) as response:
+                result = json.load(response)
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(f"ElevenLabs returned {e.code}: {e.read()[:200].decode('utf-8', 'replace')}") from e
+
+        alignment = result.get('alignment') or {}
+        characters = alignment.get('characters') or []
+        start_times = [seconds * 1000 for seconds in alignment.get('character_start_times_seconds') or []]
+        end_times = alignment.get('character_end_times_seconds') or [0]
+        return {
+            'audio': base64.b64decode(result['audio_base64']),
+            'media_type': 'audio/mpeg',
+            'duration_ms': int(end_times[-1] * 1000),
+            'visemes': visemes_for_characters(characters, start_times),
+        }
+
+    def cache_params(self):
+        return {'model_id': self.model_id, 'url': self.URL}
+
+
+PROVIDERS = {
+    provider.name: provider
+    for provider in (LocalSpeechProvider, ElevenLabsProvider)
+}
+
+
+def get_provider(name):
+    try:
+        provider_class = PROVIDERS[name]
+    except KeyError:
+        raise ImproperlyConfigured(
+            f"Unknown VOICE_PROVIDER '{name}', expected one of: {', '.join(PROVIDERS)}"
+        )
+    return provider_class()
+
+
+class SpeechSynthesizer:
+    """Speaks a reply sentence by sentence while it's still being generated.
+
+    Each sentence is synthesized on a pool of ``max_workers`` threads as soon
+    as the text stream completes it, so the first sentence can be playing
+    while later ones are still being generated or synthesized. Segments are
+    handed out in sentence order.
+    """
+
+    def __init__(self, provider, voice_id, max_workers=3, cache=None):
+        self.provider = provider
+        self.voice_id = voice_id
+        self.cache = cache
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='speech')
+
+    def stream(self, chunks):
+        """Pass ``chunks`` of text through, interleaving the speech for them.
+
+        Yields ``('text', chunk)`` for every chunk, ``('end', None)`` when the
+        text has ended, and ``('speech', segment)`` for each sentence once it's
+        synthesized; the last segments usually come after ``end``. A segment has the sentence's
+        ``index`` and ``text``, its ``start_ms`` in the reply, and the
+        provider's ``audio``, ``media_type``, ``duration_ms`` and ``visemes``;
+        with a ``cache``, ``audio`` is replaced by the ``audio_key`` of the
+        cached file. Sentences that fail to synthesize are skipped.
+        """
+        chunker = SentenceChunker()
+        pending = deque()
+        index = start_ms = 0
+        try:
+            # None marks the end of the text
+            for chunk in itertools.chain(chunks, [None]):
+                if chunk is None:
+                    yield 'end', None
+                    sentences = chunker.flush()
+                else:
+                    yield 'text', chunk
+                    sentences = chunker.feed(chunk)
+                pending.extend((sentence, self._pool.submit(self._synthesize, sentence)) for sentence in sentences)
+
+                # Hand out finished segments in order; once the text has ended, wait for the rest
+                while pending and (chunk is None or pending[0][1].done()):
+                    sentence, future = pending.popleft()
+                    speech = self._result(future)
+                    if speech is None:
+                        continue
+                    yield 'speech', {'index': index, 'text': sentence, 'start_ms': start_ms, **speech}
+                    index += 1
+                    start_ms += speech['duration_ms']
+        finally:
+            # The client went away; don't synthesize what nobody will hear
+            for _, future in pending:
+                future.cancel()
+
+    def speak(self, text):
+        """Synthesize ``text`` in one piece, through the cache if there is one."""
+        return self._synthesize(text)
+
+    def _synthesize(self, sentence):
+        if self.cache is None:
+            return self._synthesize_uncached(sentence)
+        # Repeated phrases cost neither synthesis time nor a provider call
+        key = self.cache.make_key(sentence, self.voice_id, self.provider.name, self.provider.cache_params())
+        return self.cache.get_or_create(key, lambda: self._synthesize_uncached(sentence))
+
+    def _synthesize_uncached(self, sentence):
+        with metrics.stage('speech_synthesis'):
+            return self.provider.synthesize(sentence, self.voice_id)
+
+    def _result(self, future):
+        try:
+            speech = future.result()
+        except Exception as e:
+            synthesis_failures.inc(provider=self.provider.name)
+            logger.error(f"Error synthesizing speech: {str(e)}")
+            return None
+        synthesized_segments.inc(provider=self.provider.name)
+        return speech
+
+
+_synthesizer = None
+_synthesizer_lock = threading.Lock()
+
+
+def get_synthesizer():
+    """The process-wide synthesizer for ``VOICE_PROVIDER`` and ``DEFAULT_VOICE_ID``."""
+    global _synthesizer
+    with _synthesizer_lock:
+        if _synthesizer is None:
+            _synthesizer = SpeechSynthesizer(
+                get_provider(settings.VOICE_PROVIDER),
+                settings.DEFAULT_VOICE_ID,
+                max_workers=settings.VOICE_SYNTHESIS_CONCURRENCY,
+                cache=audio_cache if settings.VOICE_AUDIO_CACHE_ENABLED else None
+            )
+    return _synthesizer
@@ -0,0 +1,86 @@
+import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class TokenAuthCache:
+    """Maps API token keys to their ``(user, token)`` for ``ttl`` seconds, LRU-bounded to ``max_entries``.
+
+    Deleting a token or saving or deleting its user drops the entry through
+    signals, so revocation takes effect at once in this process. Other
+    processes, and changes that skip signals (``QuerySet.update``), catch up
+    within ``ttl``.
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so a lookup that raced with one isn't cached
+        self._mutations = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_entries > 0
+
+    def get(self, key):
+        """Return ``(user, token)`` for ``key``, or None on a miss.
+
+        The user is a copy, so nothing a request sets on it leaks into others.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                user, token, _ = entry
+                return copy.copy(user), token
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def mutations(self):
+        with self._lock:
+            return self._mutations
+
+    def put(self, key, user, token, mutations):
+        """Cache a lookup, unless something was invalidated since ``mutations`` was read before it."""
+        with self._lock:
+            if mutations != self._mutations:
+                return
+            self._entries[key] = (copy.copy(user), token, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._mutations += 1
+            self._entries.pop(key, None)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            self._mutations += 1
+            for key in [key for key, (user, _, _) in self._entries.items() if user.pk == user_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._mutations += 1
+            self._entries.clear()
+
+
+token_cache = TokenAuthCache(
+    ttl=settings.AUTH_TOKEN_CACHE_TTL_SECONDS,
+    max_entries=settings.AUTH_TOKEN_CACHE_SIZE
+)
@@ -0,0 +1,461 @@
+import atexit
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import reduction
+from multiprocessing.connection import Connection, wait
+
+from . import metrics
+from .inference_executor import FairQueue
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPoolError(Exception):
+    """Raised for requests lost to a crashed or timed-out worker."""
+
+
+class _ChunkIterator:
+    """Iterates streamed chunks with the same contract as ``TextIteratorStreamer``.
+
+    ``next`` raises ``queue.Empty`` after ``timeout`` seconds without a chunk
+    and ``StopIteration`` once the request is finished.
+    """
+
+    _END = object()
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._queue = queue.Queue()
+
+    def put(self, chunk):
+        self._queue.put(chunk)
+
+    def end(self):
+        self._queue.put(self._END)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        chunk = self._queue.get(timeout=self.timeout)
+        if chunk is self._END:
+            raise StopIteration
+        return chunk
+
+
+class _Task:
+    def __init__(self, request_id, prompt, generation_kwargs, chunks):
+        self.request_id = request_id
+        self.prompt = prompt
+        self.generation_kwargs = generation_kwargs
+        self.chunks = chunks
+        self.future = Future()
+        self.submitted_at = time.monotonic()
+
+    def finish(self, result=None, error=None):
+        if self.chunks is not None:
+            self.chunks.end()
+        if self.future.done():
+            return
+        if error is not None:
+            self.future.set_exception(error)
+        else:
+            self.future.set_result(result)
+
+
+class _Worker:
+    def __init__(self, index, process, task_conn, result_conn):
+        self.index = index
+        self.process = process
+        self.task_conn = task_conn
+        self.result_conn = result_conn
+        self.task = None
+        self.started_at = None
+
+
+def _worker_main(model, tokenizer, num_threads, task_conn, result_conn):
+    # Runs in the forked child: the model's weights are the parent's pages, shared copy-on-write
+    import torch
+    from transformers import StoppingCriteriaList, TextStreamer
+
+    torch.set_num_threads(num_threads)
+
+    class _PipeStreamer(TextStreamer):
+        def __init__(self, request_id):
+            super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True)
+            self.request_id = request_id
+
+        def on_finalized_text(self, text, stream_end=False):
+            if text:
+                result_conn.send(('chunk', self.request_id, text))
+
+    while True:
+        try:
+            message = task_conn.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+
+        request_id, prompt, generation_kwargs, stream = message
+        try:
+            inputs = tokenizer(prompt, return_tensors='pt')
+            streamer = _PipeStreamer(request_id) if stream else None
+            timer = metrics.GenerationTimer()
+            with torch.inference_mode():
+                output_ids = model.generate(
+                    **inputs, streamer=streamer, stopping_criteria=StoppingCriteriaList([timer]), **generation_kwargs
+                )
+            completion = tokenizer.decode(output_ids[0, inputs['input_ids'].shape[1]:], skip_special_tokens=True)
+            stages = timer.stages()
+            if stages is not None:
+                # The child's metrics never reach /metrics, so the parent records them
+                result_conn.send(('stages', request_id, stages))
+            result_conn.send(('done', request_id, completion))
+        except Exception as e:
+            result_conn.send(('error', request_id, str(e)))
+
+
+def _zygote_main(model, tokenizer, num_threads, control_conn):
+    # Single-threaded for its whole life, so forking here never copies a lock some other thread held
+    while True:
+        try:
+            message = control_conn.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+
+        if message == 'reap':
+            exits = {}
+            while True:
+                try:
+                    pid, status = os.waitpid(-1, os.WNOHANG)
+                except ChildProcessError:
+                    break
+                if pid == 0:
+                    break
+                exits[pid] = os.waitstatus_to_exitcode(status)
+            control_conn.send(exits)
+            continue
+
+        task_recv, task_send = multiprocessing.Pipe(duplex=False)
+        result_recv, result_send = multiprocessing.Pipe(duplex=False)
+        pid = os.fork()
+        if pid == 0:
+            control_conn.close()
+            task_send.close()
+            result_recv.close()
+            exitcode = 0
+            try:
+                _worker_main(model, tokenizer, num_threads, task_recv, result_send)
+            except BaseException:
+                logger.exception("Inference worker failed")
+                exitcode = 1
+            finally:
+                os._exit(exitcode)
+
+        task_recv.close()
+        result_send.close()
+        control_conn.send(pid)
+        reduction.send_handle(control_conn, task_send.fileno(), os.getppid())
+        reduction.send_handle(control_conn, result_recv.fileno(), os.getppid())
+        task_send.close()
+        result_recv.close()
+
+
+class _ForkedProcess:
+    """The parts of ``multiprocessing.Process`` the pool uses, for a worker the zygote forked.
+
+    Only the zygote can wait for its children, so ``exitcode`` is filled in
+    by ``_Zygote.reap``.
+    """
+
+    def __init__(self, pid, zygote):
+        self.pid = pid
+        self.zygote = zygote
+        self.exitcode = None
+
+    def is_alive(self):
+        return self.exitcode is None
+
+    def kill(self):
+        if self.exitcode is None:
+            os.kill(self.pid, signal.SIGKILL)
+
+    def join(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.exitcode is None and (deadline is None or time.monotonic() < deadline):
+            try:
+                self.zygote.reap()
+            except OSError:
+                # The zygote has been stopped, and its children with it
+                return
+            if self.exitcode is None:
+                time.sleep(0.01)
+
+
+class _Zygote:
+    """A process forked once, before the pool starts any threads, that forks the workers.
+
+    Forking a multi-threaded parent can leave a child holding a lock that no
+    thread will ever release. The zygote runs no threads and no generation,
+    so workers forked from it later, e.g. to replace a crashed one, are
+    safe, and still share the weights copy-on-write.
+    """
+
+    def __init__(self, context, model, tokenizer, num_threads):
+        self._conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_zygote_main,
+            args=(model, tokenizer, num_threads, child_conn),
+            name='llm-zygote',
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self._lock = threading.Lock()
+        self._children = {}
+
+    def fork(self):
+        """Fork a worker; returns ``(process, task_conn, result_conn)``."""
+        with self._lock:
+            self._conn.send('fork')
+            pid = self._conn.recv()
+            task_conn = Connection(reduction.recv_handle(self._conn), readable=False)
+            result_conn = Connection(reduction.recv_handle(self._conn), writable=False)
+            process = self._children[pid] = _ForkedProcess(pid, self)
+        return process, task_conn, result_conn
+
+    def reap(self):
+        """Record the exit codes of workers that have exited since the last call."""
+        with self._lock:
+            self._conn.send('reap')
+            for pid, exitcode in self._conn.recv().items():
+                process = self._children.pop(pid, None)
+                if process is not None:
+                    process.exitcode = exitcode
+
+    def stop(self):
+        with self._lock:
+            try:
+                self._conn.send(None)
+            except OSError:
+                pass
+            self._conn.close()
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+
+
+class InferenceWorkerPool:
+    """Runs generation in forked worker processes that share the parent's loaded weights.
+
+    Each worker is pinned to ``threads_per_worker`` torch threads and handles
+    one request at a time; queued requests are handed out round-robin across
+    users. Dead workers, and workers stuck on a request for longer than
+    ``request_timeout`` seconds, are killed and re-forked from a zygote process.
+    Create the pool before the process starts threads of its own, since the
+    zygote is forked from it. Requires the ``fork`` start method, so it's only
+    available on POSIX.
+    """
+
+    HEALTH_CHECK_SECONDS = 0.5
+
+    def __init__(self, model, tokenizer, processes, threads_per_worker=None, request_timeout=120,
+                 stream_timeout=0.5):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.processes = max(1, int(processes))
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // self.processes)
+        self.request_timeout = request_timeout
+        self.stream_timeout = stream_timeout
+
+        # Forked workers would otherwise each spin up tokenizer threads of their own
+        os.environ.setdefault('TOKENIZERS_PARALLELISM', 'false')
+        self._context = multiprocessing.get_context('fork')
+        self._request_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._pending = FairQueue()
+        self._idle = queue.Queue()
+        self._closed = False
+        self.restarts = 0
+        self.completed = 0
+
+        self._zygote = _Zygote(self._context, model, tokenizer, self.threads_per_worker)
+        self._workers = [self._start_worker(index) for index in range(self.processes)]
+        for worker in self._workers:
+            self._idle.put(worker.index)
+
+        self._dispatcher = threading.Thread(target=self._dispatch, name='llm-pool-dispatcher', daemon=True)
+        self._collector = threading.Thread(target=self._collect, name='llm-pool-collector', daemon=True)
+        self._dispatcher.start()
+        self._collector.start()
+        # Stop cleanly at interpreter exit instead of "restarting" workers as they are reaped
+        atexit.register(self.shutdown)
+
+        logger.info(
+            f"Started {self.processes} inference workers with {self.threads_per_worker} torch threads each"
+        )
+
+    def submit(self, prompt, stream=False, user=None, **generation_kwargs):
+        """Queue a prompt for ``user``; returns ``(future, chunks)`` where ``chunks`` is None unless streaming.
+
+        The future resolves to the generated continuation, without the prompt.
+        """
+        if self._closed:
+            raise RuntimeError("Inference worker pool has been shut down")
+        chunks = _ChunkIterator(self.stream_timeout) if stream else None
+        task = _Task(next(self._request_ids), prompt, generation_kwargs, chunks)
+        self._pending.put(task, user)
+        return task.future, chunks
+
+    def get_stats(self):
+        with self._lock:
+            busy = sum(1 for worker in self._workers if worker.task is not None)
+            alive = sum(1 for worker in self._workers if worker.process.is_alive())
+        return {
+            'workers': self.processes,
+            'alive': alive,
+            'busy': busy,
+            'queued': self._pending.qsize(),
+            'completed': self.completed,
+            'restarts': self.restarts,
+        }
+
+    def shutdown(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._pending.close()
+        with self._lock:
+            for worker in self._workers:
+                try:
+                    worker.task_conn.send(None)
+                except OSError:
+                    pass
+            for worker in self._workers:
+                worker.process.join(timeout=5)
+                if worker.process.is_alive():
+                    worker.process.kill()
+        self._zygote.stop()
+
+    def _start_worker(self, index):
+        process, task_conn, result_conn = self._zygote.fork()
+        return _Worker(index, process, task_conn, result_conn)
+
+    def _dispatch(self):
+        while True:
+            # Wait for a free worker first, so the request taken is the one whose turn it is by then
+            index = self._idle.get()
+            task = self._pending.get()
+            while task is not None and task.future.cancelled():
+                task = self._pending.get()
+            if task is None:
+                return
+
+            with self._lock:
+                worker = self._workers[index]
+                worker.task = task
+                worker.started_at = time.monotonic()
+                metrics.stage_seconds.observe(worker.started_at - task.submitted_at, stage='queue_wait')
+                try:
+                    worker.task_conn.send((task.request_id, task.prompt, task.generation_kwargs, task.chunks is not None))
+                except OSError:
+                    # The worker died while idle; the health check restarts it and fails the task
+                    pass
+
+    def _collect(self):
+        while not self._closed:
+            with self._lock:
+                # A worker that couldn't be restarted has its pipes closed until the next attempt
+                workers = {worker.result_conn: worker for worker in self._workers if not worker.result_conn.closed}
+
+            for conn in wait(list(workers), timeout=self.HEALTH_CHECK_SECONDS):
+                try:
+                    kind, request_id, payload = conn.recv()
+                except (EOFError, OSError):
+                    # The worker is gone; the health check below restarts it
+                    continue
+                self._handle_message(workers[conn], kind, request_id, payload)
+
+            self._check_health()
+
+    def _handle_message(self, worker, kind, request_id, payload):
+        with self._lock:
+            task = worker.task
+            if task is None or task.request_id != request_id:
+                return
+            if kind == 'chunk':
+                if task.chunks is not None:
+                    task.chunks.put(payload)
+                return
+            if kind == 'stages':
+                metrics.observe_generation(*payload)
+                return
+            worker.task = None
+            self.completed += 1
+
+        if kind == 'done':
+            task.finish(result=payload)
+        else:
+            task.finish(error=WorkerPoolError(payload))
+        self._idle.put(worker.index)
+
+    def _check_health(self):
+        try:
+            self._zygote.reap()
+        except OSError:
+            # The zygote is gone, which only happens on shutdown
+            return
+
+        now = time.monotonic()
+        for index in range(self.processes):
+            with self._lock:
+                if self._closed:
+                    return
+                worker = self._workers[index]
+                if worker.process.is_alive():
+                    if worker.task is None or now - worker.started_at < self.request_timeout:
+                        continue
+                    reason = f"timed out after {self.request_timeout}s"
+                    worker.process.kill()
+                else:
+                    reason = f"exited with code {worker.process.exitcode}"
+
+            # Not under the lock: forking and reaping wait on the zygote, and dispatch shouldn't
+            worker.process.join(timeout=5)
+            try:
+                replacement = self._start_worker(index)
+            except Exception as e:
+                logger.error(f"Inference worker {index} {reason}, and restarting it failed: {str(e)}")
+                replacement = None
+
+            with self._lock:
+                # Includes anything dispatched to the dead worker while the replacement was forked
+                task = worker.task
+                worker.task = None
+                worker.task_conn.close()
+                worker.result_conn.close()
+                if self._closed:
+                    if replacement is not None:
+                        replacement.task_conn.close()
+                        replacement.result_conn.close()
+                    return
+                if replacement is not None:
+                    self._workers[index] = replacement
+                    self.restarts += 1
+
+            if replacement is not None:
+                logger.error(f"Inference worker {index} {reason}, restarted it")
+            if task is not None:
+                task.finish(error=WorkerPoolError(f"Inference worker {reason}"))
+                # An idle worker was never taken out of the idle queue
+                self._idle.put(index)
@@ -0,0 +1,31 @@
+from .services.history import history_cache
+from .services.kv_cache import kv_cache
+from .services.token_cache import token_cache
+
+
+def message_saved(sender, instance, created=False, **kwargs):
+    if created:
+        history_cache.append(instance)
+    else:
+        # Appending a message only extends the cached prefix; edits rewrite it
+        history_cache.invalidate(instance.conversation_id)
+        kv_cache.invalidate(instance.conversation_id)
+
+
+def message_deleted(sender, instance, **kwargs):
+    history_cache.invalidate(instance.conversation_id)
+    kv_cache.invalidate(instance.conversation_id)
+
+
+def conversation_deleted(sender, instance, **kwargs):
+    history_cache.invalidate(instance.pk)
+    kv_cache.invalidate(instance.pk)
+
+
+def token_changed(sender, instance, **kwargs):
+    token_cache.invalidate(instance.key)
+
+
+def user_changed(sender, instance, **kwargs):
+    # Covers deactivation, and anything else a cached user would get wrong
+    token_cache.invalidate_user(instance.pk)
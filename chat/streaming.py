@@ -0,0 +1,137 @@
+import base64
+import itertools
+import logging
+
+from django.conf import settings
+from django.urls import reverse
+
+from .serializers import MessageSerializer
+from .services import metrics
+from .services.history import history_cache
+from .services.inference_executor import LLMOverloadedError
+from .services.llm_service import LLMService
+from .services.persistence import persist_turn, persist_unanswered
+from .services.prompt_builder import ReplyExtractor
+from .services.speech import get_synthesizer
+
+logger = logging.getLogger(__name__)
+
+
+def unsummarized_history(conversation):
+    """The messages of ``conversation`` not folded into its summary yet, oldest first.
+
+    Usually the cached window. When the whole window is unsummarized, older
+    messages may have fallen out of it, so they're all read from the database
+    for ``fold_history`` to fold.
+    """
+    summarized_id = conversation.summary_last_message_id
+    with metrics.stage('history_load'):
+        history = history_cache.get(conversation)
+        if len(history) >= history_cache.window and (summarized_id is None or history[0]['id'] > summarized_id):
+            messages = conversation.messages.order_by('timestamp', 'id')
+            if summarized_id is not None:
+                messages = messages.filter(pk__gt=summarized_id)
+            return list(messages.values('id', 'content', 'role'))
+    if summarized_id is not None:
+        history = [msg for msg in history if msg['id'] > summarized_id]
+    return history
+
+
+def speech_payload(segment, build_absolute_uri):
+    payload = {key: value for key, value in segment.items() if key not in ('audio', 'audio_key')}
+    if 'audio_key' in segment:
+        # Cached audio is fetched from disk by URL instead of being inlined
+        payload['audio_url'] = build_absolute_uri(reverse('speech_audio', args=[segment['audio_key']]))
+    else:
+        payload['audio'] = base64.b64encode(segment['audio']).decode('ascii')
+    return payload
+
+
+def start_reply(conversation, message_content, user_id):
+    """Start generating the reply to ``message_content``; returns the LLM service and its chunk stream.
+
+    Raises LLMOverloadedError when the reply can't be queued; the user's
+    message is saved without a reply then.
+    """
+    history = unsummarized_history(conversation)
+
+    llm_service = LLMService()
+    history = llm_service.fold_history(conversation, history, message_content)
+    try:
+        chunk_stream = llm_service.stream_response(
+            message_content, history,
+            conversation_id=conversation.id, summary=conversation.summary,
+            user_id=user_id
+        )
+    except LLMOverloadedError:
+        persist_unanswered(conversation, message_content)
+        raise
+    return llm_service, chunk_stream
+
+
+def reply_text(chunk_stream):
+    """The reply's text out of ``chunk_stream``, ending at the first role marker like ``extract_response``.
+
+    Generation is cancelled once a marker shows the model has moved on to
+    another turn.
+    """
+    extractor = ReplyExtractor()
+    try:
+        for chunk in chunk_stream:
+            text = extractor.feed(chunk)
+            if text:
+                yield text
+            if extractor.ended:
+                return
+        text = extractor.flush()
+        if text:
+            yield text
+    finally:
+        if hasattr(chunk_stream, 'close'):
+            chunk_stream.close()
+
+
+def reply_events(llm_service, conversation, message_content, chunk_stream, speak, build_absolute_uri):
+    """Yield the ``(event, data)`` pairs of a streamed reply, saving the turn once it's generated.
+
+    Events are ``token`` per generated chunk of the reply, ``speech`` per
+    synthesized sentence when ``speak`` is set, ``done`` with the saved turn,
+    and ``error`` if generation fails. Tokens, speech and the saved reply are
+    all the same text. Speech of the last sentences may follow ``done``.
+    """
+    chunks = []
+    saved = False
+    try:
+        text_stream = reply_text(chunk_stream)
+        if speak:
+            events = get_synthesizer().stream(text_stream)
+        else:
+            events = itertools.chain((('text', chunk) for chunk in text_stream), [('end', None)])
+        for kind, payload in events:
+            if kind == 'text':
+                chunks.append(payload)
+                yield 'token', {'token': payload}
+            elif kind == 'speech':
+                yield 'speech', speech_payload(payload, build_absolute_uri)
+            else:
+                # The turn is saved without waiting for the last sentences to be spoken
+                saved = True
+                ai_response = llm_service.extract_response(''.join(chunks))
+                user_message, ai_message = persist_turn(conversation, message_content, ai_response)
+
+                yield 'done', {
+                    'message': ai_response,
+                    'user_message': MessageSerializer(user_message).data,
+                    'ai_message': MessageSerializer(ai_message).data
+                }
+
+    except Exception as e:
+        logger.error(f"Error streaming LLM response: {str(e)}")
+        yield 'error', {
+            'error': 'Failed to generate AI response',
+            'detail': str(e) if settings.DEBUG else 'Internal server error'
+        }
+    finally:
+        if not saved:
+            # Generation failed, or the client went away before the reply was complete
+            persist_unanswered(conversation, message_content)
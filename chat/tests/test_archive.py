@@ -0,0 +1,89 @@
+import datetime
+import gzip
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils import timezone
+
+from chat.models import Conversation, Message
+from chat.services.archive import ConversationArchive, archive_conversations, export_lines, rehydrate
+
+from .utils import ChatAPITestCase
+
+
+class ArchiveTests(ChatAPITestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.archive_dir = directory.name
+        self.archive = ConversationArchive(self.archive_dir, segment_bytes=1024 * 1024)
+        self.messages = [
+            Message.objects.create(conversation=self.conversation, content=f'message {index}', role='user')
+            for index in range(3)
+        ]
+        self.conversation.refresh_from_db()
+
+    def message_rows(self):
+        return list(Message.objects.filter(conversation=self.conversation).values_list('id', 'content', 'timestamp'))
+
+    def test_archived_messages_come_back_unchanged(self):
+        before = self.message_rows()
+        self.assertEqual(archive_conversations([self.conversation], self.archive), 1)
+        self.assertFalse(Message.objects.filter(conversation=self.conversation).exists())
+
+        conversation = Conversation.objects.get(pk=self.conversation.pk)
+        self.assertIsNotNone(conversation.archived_at)
+        self.assertTrue(rehydrate(conversation, self.archive))
+        self.assertEqual(self.message_rows(), before)
+        self.assertIsNone(Conversation.objects.get(pk=self.conversation.pk).archived_at)
+        self.assertFalse(rehydrate(conversation, self.archive))
+
+    def test_segments_are_plain_jsonl_gz(self):
+        other = Conversation.objects.create(user=self.user, title='Other')
+        Message.objects.create(conversation=other, content='hello')
+        archive_conversations([self.conversation, Conversation.objects.get(pk=other.pk)], self.archive)
+
+        [segment] = [name for name in os.listdir(self.archive_dir) if name.endswith('.jsonl.gz')]
+        with gzip.open(os.path.join(self.archive_dir, segment), 'rt') as lines:
+            records = [json.loads(line) for line in lines]
+        self.assertEqual([record['id'] for record in records], [self.conversation.pk, other.pk])
+        self.assertEqual([m['content'] for m in records[0]['messages']], ['message 0', 'message 1', 'message 2'])
+
+    def test_conversation_changed_since_it_was_read_is_left_alone(self):
+        stale = Conversation.objects.get(pk=self.conversation.pk)
+        Message.objects.create(conversation=self.conversation, content='new turn')
+        Conversation.objects.filter(pk=self.conversation.pk).update(updated_at=timezone.now())
+        self.assertEqual(archive_conversations([stale], self.archive), 0)
+        self.assertEqual(len(self.message_rows()), 4)
+
+    def test_export_reads_archived_conversations_without_rehydrating(self):
+        archive_conversations([self.conversation], self.archive)
+        [line] = list(export_lines(self.user.pk, self.archive))
+        record = json.loads(line)
+        self.assertEqual([m['content'] for m in record['messages']], ['message 0', 'message 1', 'message 2'])
+        self.assertIsNotNone(Conversation.objects.get(pk=self.conversation.pk).archived_at)
+
+    def test_opening_an_archived_conversation_rehydrates_it(self):
+        with override_settings(CHAT_ARCHIVE_DIR=self.archive_dir):
+            archive_conversations([self.conversation])
+            listed = self.client.get('/chat/conversations/').data['results'][0]
+            self.assertTrue(listed['archived'])
+            response = self.client.get(f'/chat/conversations/{self.conversation.pk}/messages/')
+        self.assertEqual([m['content'] for m in response.data['results']], ['message 0', 'message 1', 'message 2'])
+        self.assertIsNone(Conversation.objects.get(pk=self.conversation.pk).archived_at)
+
+    def test_command_archives_only_idle_conversations(self):
+        busy = Conversation.objects.create(user=self.user, title='Busy')
+        Message.objects.create(conversation=busy, content='hello')
+        Conversation.objects.filter(pk=self.conversation.pk).update(
+            updated_at=timezone.now() - datetime.timedelta(days=100)
+        )
+        with override_settings(CHAT_ARCHIVE_DIR=self.archive_dir, CHAT_ARCHIVE_IDLE_DAYS=90):
+            call_command('archive_conversations', stdout=StringIO())
+        self.assertIsNotNone(Conversation.objects.get(pk=self.conversation.pk).archived_at)
+        self.assertIsNone(Conversation.objects.get(pk=busy.pk).archived_at)
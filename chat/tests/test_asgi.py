@@ -0,0 +1,178 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.test import AsyncClient, TransactionTestCase, override_settings
+from rest_framework.authtoken.models import Token
+
+from chat.consumers import CLOSE_NOT_FOUND, CLOSE_TIMEOUT, CLOSE_UNAUTHORIZED
+from chat.models import Conversation, Message
+from citizens_llm_chat.asgi import application
+
+from .utils import STUB_LLM_SETTINGS, clear_process_caches, reset_llm_service
+
+
+class SocketClient:
+    """Drives the ASGI application through one WebSocket connection."""
+
+    def __init__(self, path):
+        self.incoming = asyncio.Queue()
+        self.outgoing = asyncio.Queue()
+        scope = {'type': 'websocket', 'path': path, 'headers': [(b'host', b'testserver')], 'scheme': 'ws'}
+        self.task = asyncio.create_task(application(scope, self.incoming.get, self.outgoing.put))
+
+    async def connect(self):
+        await self.incoming.put({'type': 'websocket.connect'})
+        return await self.receive()
+
+    async def send(self, frame):
+        await self.incoming.put({'type': 'websocket.receive', 'text': json.dumps(frame)})
+
+    async def receive(self, timeout=10):
+        message = await asyncio.wait_for(self.outgoing.get(), timeout)
+        return json.loads(message['text']) if message['type'] == 'websocket.send' else message
+
+    async def receive_until(self, kind):
+        """Frames up to and including the first of type ``kind``, leaving out pings."""
+        frames = []
+        while True:
+            frame = await self.receive()
+            if frame['type'] != 'ping':
+                frames.append(frame)
+            if frame['type'] == kind:
+                return frames
+
+    async def disconnect(self):
+        await self.incoming.put({'type': 'websocket.disconnect', 'code': 1000})
+        await asyncio.wait_for(self.task, 10)
+
+
+@override_settings(**STUB_LLM_SETTINGS, CHAT_RATE_LIMIT_PER_MINUTE=0)
+class SendMessageAsyncTests(TransactionTestCase):
+    def setUp(self):
+        clear_process_caches()
+        reset_llm_service()
+        self.addCleanup(reset_llm_service)
+        self.user = User.objects.create_user('alice')
+        self.token = Token.objects.create(user=self.user)
+        self.conversation = Conversation.objects.create(user=self.user)
+        self.url = f'/chat/conversations/{self.conversation.pk}/send_message_async/'
+
+    async def post(self, token):
+        headers = {'Authorization': f'Token {token.key}'} if token else {}
+        return await AsyncClient().post(
+            self.url, {'message': 'hello'}, content_type='application/json', headers=headers
+        )
+
+    async def test_reply_is_generated_and_saved(self):
+        response = await self.post(self.token)
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertTrue(body['message'])
+        messages = await sync_to_async(list)(
+            Message.objects.filter(conversation=self.conversation).order_by('timestamp').values_list('role', 'content')
+        )
+        self.assertEqual(messages, [('user', 'hello'), ('assistant', body['message'])])
+        self.assertEqual(body['ai_message']['content'], body['message'])
+
+    async def test_requests_without_a_token_are_refused(self):
+        response = await self.post(None)
+        self.assertEqual(response.status_code, 401)
+
+    async def test_other_users_conversations_are_not_found(self):
+        other = await User.objects.acreate(username='bob')
+        token = await Token.objects.acreate(user=other)
+        response = await self.post(token)
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(**STUB_LLM_SETTINGS, CHAT_RATE_LIMIT_PER_MINUTE=0)
+class ChatSocketTests(TransactionTestCase):
+    def setUp(self):
+        clear_process_caches()
+        reset_llm_service()
+        self.addCleanup(reset_llm_service)
+        self.user = User.objects.create_user('alice')
+        self.token = Token.objects.create(user=self.user)
+        self.conversation = Conversation.objects.create(user=self.user)
+        self.path = f'/ws/chat/conversations/{self.conversation.pk}/'
+
+    async def open(self, path=None, **auth):
+        client = SocketClient(path or self.path)
+        self.assertEqual((await client.connect())['type'], 'websocket.accept')
+        await client.send({'type': 'auth', 'token': self.token.key, **auth})
+        return client
+
+    async def test_unknown_paths_are_turned_down(self):
+        client = SocketClient('/ws/elsewhere/')
+        self.assertEqual(await client.connect(), {'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+        await client.task
+
+    async def test_bad_token_closes_the_socket(self):
+        client = SocketClient(self.path)
+        await client.connect()
+        await client.send({'type': 'auth', 'token': 'not-a-token'})
+        self.assertEqual((await client.receive())['code'], CLOSE_UNAUTHORIZED)
+        await client.task
+
+    async def test_other_users_conversations_are_not_found(self):
+        other = await User.objects.acreate(username='bob')
+        conversation = await Conversation.objects.acreate(user=other)
+        client = await self.open(f'/ws/chat/conversations/{conversation.pk}/')
+        self.assertEqual((await client.receive())['code'], CLOSE_NOT_FOUND)
+        await client.task
+
+    @override_settings(CHAT_WS_AUTH_TIMEOUT_SECONDS=0.2)
+    async def test_auth_must_come_quickly(self):
+        client = SocketClient(self.path)
+        await client.connect()
+        self.assertEqual((await client.receive())['code'], CLOSE_UNAUTHORIZED)
+        await client.task
+
+    async def test_reply_reaches_every_socket_of_the_conversation(self):
+        first = await self.open()
+        second = await self.open()
+        self.assertEqual((await first.receive())['type'], 'ready')
+        self.assertEqual((await second.receive())['type'], 'ready')
+
+        await first.send({'type': 'message', 'message': 'hello', 'id': 'c1'})
+        frames = await first.receive_until('done')
+        other_frames = await second.receive_until('done')
+        self.assertEqual(frames, other_frames)
+        self.assertEqual({frame['reply_to'] for frame in frames}, {'c1'})
+        self.assertEqual({frame['type'] for frame in frames[:-1]}, {'token'})
+        done = frames[-1]
+        self.assertEqual(''.join(frame['token'] for frame in frames[:-1]).strip(), done['message'])
+        saved = await Message.objects.aget(pk=done['ai_message']['id'])
+        self.assertEqual(saved.content, done['message'])
+
+        await first.disconnect()
+        await second.disconnect()
+
+    async def test_resume_sends_the_messages_missed_while_away(self):
+        client = await self.open()
+        await client.receive_until('ready')
+        await client.send({'type': 'message', 'message': 'hello', 'id': 'c1'})
+        last_seen = (await client.receive_until('done'))[-1]['ai_message']['id']
+        # The reply runs on, and is saved, after the socket goes away
+        await client.send({'type': 'message', 'message': 'again', 'id': 'c2'})
+        await client.receive_until('token')
+        await client.disconnect()
+
+        while await Message.objects.filter(conversation=self.conversation).acount() < 4:
+            await asyncio.sleep(0.05)
+        client = await self.open(resume_after=last_seen)
+        frames = await client.receive_until('ready')
+        missed = [frame['message'] for frame in frames[:-1]]
+        self.assertEqual([message['role'] for message in missed], ['user', 'assistant'])
+        self.assertEqual(missed[0]['content'], 'again')
+        self.assertEqual(frames[-1]['last_message_id'], missed[1]['id'])
+        await client.disconnect()
+
+    @override_settings(CHAT_WS_HEARTBEAT_SECONDS=0.1)
+    async def test_silent_sockets_are_closed(self):
+        client = await self.open()
+        frames = await client.receive_until('websocket.close')
+        self.assertEqual(frames[-1]['code'], CLOSE_TIMEOUT)
+        await client.disconnect()
@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from chat.services.audio_cache import AudioCache
+
+from .utils import ChatAPITestCase
+
+
+def speech(audio=b'RIFF' + bytes(range(60))):
+    return {'audio': audio, 'media_type': 'audio/wav', 'duration_ms': 100, 'visemes': [{'time_ms': 0, 'viseme': 'sil'}]}
+
+
+class AudioCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_concurrent_misses_synthesize_once(self):
+        cache = AudioCache(self.directory, max_bytes=1024 * 1024)
+        key = cache.make_key('Hello.', 'default', 'local', {})
+        calls = []
+
+        def synthesize():
+            calls.append(1)
+            time.sleep(0.1)
+            return speech()
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_create(key, synthesize)))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [results[0]] * 4)
+        self.assertEqual((cache.misses, cache.hits), (1, 3))
+
+    def test_entries_survive_a_restart(self):
+        key = AudioCache.make_key('Hello.', 'default', 'local', {})
+        AudioCache(self.directory, max_bytes=1024 * 1024).put(key, speech())
+        cache = AudioCache(self.directory, max_bytes=1024 * 1024)
+        self.assertEqual(cache.entry(key)['duration_ms'], 100)
+        self.assertEqual(cache.total_bytes(), len(speech()['audio']))
+
+    def test_least_recently_used_audio_is_evicted(self):
+        size = len(speech()['audio'])
+        cache = AudioCache(self.directory, max_bytes=2 * size)
+        keys = [cache.make_key(text, 'default', 'local', {}) for text in ('one', 'two', 'three')]
+        cache.put(keys[0], speech())
+        cache.put(keys[1], speech())
+        cache.entry(keys[0])
+        cache.put(keys[2], speech())
+
+        self.assertIsNotNone(cache.entry(keys[0]))
+        self.assertIsNone(cache.entry(keys[1]))
+        self.assertFalse(os.path.exists(cache.audio_path(keys[1])))
+        self.assertEqual(cache.total_bytes(), 2 * size)
+
+    def test_keys_differ_by_voice_and_provider_settings(self):
+        key = AudioCache.make_key('Hello.', 'default', 'elevenlabs', {'model_id': 'a'})
+        self.assertNotEqual(key, AudioCache.make_key('Hello.', 'other', 'elevenlabs', {'model_id': 'a'}))
+        self.assertNotEqual(key, AudioCache.make_key('Hello.', 'default', 'elevenlabs', {'model_id': 'b'}))
+
+
+class SpeechAudioTests(ChatAPITestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.cache = AudioCache(directory, max_bytes=1024 * 1024)
+        patcher = mock.patch('chat.views.audio_cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.audio = speech()['audio']
+        self.key = self.cache.make_key('Hello.', 'default', 'local', {})
+        self.cache.put(self.key, speech())
+        self.url = f'/chat/speech/{self.key}/'
+
+    def test_whole_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.audio)
+        self.assertEqual(response['Content-Type'], 'audio/wav')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['ETag'], f'"{self.key}"')
+
+    def test_byte_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=4-9')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.audio[4:10])
+        self.assertEqual(response['Content-Range'], f'bytes 4-9/{len(self.audio)}')
+        self.assertEqual(response['Content-Length'], '6')
+
+    def test_suffix_and_open_ended_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), self.audio[-5:])
+        response = self.client.get(self.url, HTTP_RANGE='bytes=60-')
+        self.assertEqual(b''.join(response.streaming_content), self.audio[60:])
+        self.assertEqual(response['Content-Range'], f'bytes 60-{len(self.audio) - 1}/{len(self.audio)}')
+
+    def test_range_past_the_end_is_not_satisfiable(self):
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.audio)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.audio)}')
+
+    def test_matching_etag_is_not_modified(self):
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=f'"{self.key}"')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], f'"{self.key}"')
+
+    def test_unknown_key_is_not_found(self):
+        response = self.client.get(f'/chat/speech/{"0" * 64}/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_audio_needs_authentication(self):
+        self.client.credentials()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
@@ -0,0 +1,43 @@
+import torch
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase
+
+from chat.services.backends import BACKENDS, DynamicInt8Backend, StubBackend, get_backend
+
+GREEDY = {'max_new_tokens': 16, 'do_sample': False}
+
+
+class StubInt8Backend(DynamicInt8Backend, StubBackend):
+    """int8 quantization applied to the stub model instead of a downloaded one."""
+
+
+def generate(backend, prompt):
+    tokenizer = backend.load_tokenizer(None)
+    model = backend.load_model(None)
+    inputs = tokenizer(prompt, return_tensors='pt')
+    output_ids = model.generate(**inputs, pad_token_id=tokenizer.eos_token_id, **GREEDY)
+    return tokenizer.decode(output_ids[0, inputs['input_ids'].shape[1]:], skip_special_tokens=True)
+
+
+class BackendTests(SimpleTestCase):
+    def test_backends_are_looked_up_by_name(self):
+        for name, backend in BACKENDS.items():
+            self.assertIsInstance(get_backend(name), backend)
+        with self.assertRaisesMessage(ImproperlyConfigured, "Unknown LLM_BACKEND 'missing'"):
+            get_backend('missing')
+
+    def test_stub_replies_are_printable_full_length_and_repeatable(self):
+        reply = generate(StubBackend(), 'User: hello\nAssistant:')
+        self.assertEqual(len(reply), GREEDY['max_new_tokens'])
+        self.assertTrue(reply.isascii() and reply.isprintable())
+        self.assertEqual(reply, generate(StubBackend(), 'User: hello\nAssistant:'))
+
+    def test_stub_tokenizer_round_trips_text(self):
+        tokenizer = StubBackend().load_tokenizer(None)
+        text = 'User: héllo wörld\nAssistant:'
+        self.assertEqual(tokenizer.decode(tokenizer.encode(text)), text)
+
+    def test_int8_backend_quantizes_linear_layers(self):
+        model = StubInt8Backend().load_model(None)
+        self.assertIsInstance(model.lm_head, torch.ao.nn.quantized.dynamic.Linear)
+        self.assertEqual(len(generate(StubInt8Backend(), 'User: hello\nAssistant:')), GREEDY['max_new_tokens'])
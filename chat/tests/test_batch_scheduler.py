@@ -0,0 +1,133 @@
+import threading
+from unittest import mock
+
+import torch
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase, override_settings
+
+from chat.services.batch_scheduler import BatchScheduler
+from chat.services.llm_service import LLMService
+
+from .utils import STUB_LLM_SETTINGS, reset_llm_service, stage_count, stub_model
+
+GREEDY = {'max_new_tokens': 8, 'do_sample': False}
+
+
+class BatchSchedulerTests(SimpleTestCase):
+    def setUp(self):
+        self.model, self.tokenizer = stub_model()
+        self.scheduler = BatchScheduler(self.model, self.tokenizer, max_batch_size=4, max_wait_ms=200)
+        self.addCleanup(self.scheduler.shutdown)
+
+    def test_concurrent_prompts_share_one_batch(self):
+        # Same length, so batching adds no padding and greedy output matches generating alone
+        prompts = ['User: abc\nAssistant:', 'User: xyz\nAssistant:', 'User: 123\nAssistant:']
+        futures = [self.scheduler.submit(prompt, **GREEDY) for prompt in prompts]
+        completions = [future.result(timeout=30) for future in futures]
+
+        for prompt, completion in zip(prompts, completions):
+            inputs = self.tokenizer(prompt, return_tensors='pt')
+            output_ids = self.model.generate(**inputs, pad_token_id=self.tokenizer.eos_token_id, **GREEDY)
+            expected = self.tokenizer.decode(output_ids[0, inputs['input_ids'].shape[1]:], skip_special_tokens=True)
+            self.assertEqual(completion, expected)
+        # Stats are recorded after the futures resolve; shutdown waits for that
+        self.scheduler.shutdown()
+        stats = self.scheduler.get_stats()
+        self.assertEqual(stats['batches'], 1)
+        self.assertEqual(stats['requests'], 3)
+
+    def test_queue_wait_prefill_and_decode_are_recorded_per_request(self):
+        before = {stage: stage_count(stage) for stage in ('queue_wait', 'prefill', 'decode')}
+        futures = [self.scheduler.submit(prompt, **GREEDY) for prompt in ('User: hi\nAssistant:', 'User: yo\nAssistant:')]
+        for future in futures:
+            future.result(timeout=30)
+        self.scheduler.shutdown()
+        self.assertEqual({stage: stage_count(stage) - count for stage, count in before.items()},
+                         {'queue_wait': 2, 'prefill': 2, 'decode': 2})
+
+    def test_users_are_served_round_robin(self):
+        scheduler = BatchScheduler(self.model, self.tokenizer, max_batch_size=1, max_wait_ms=0)
+        self.addCleanup(scheduler.shutdown)
+        release = threading.Event()
+        started = threading.Event()
+        order = []
+        generate = self.model.generate
+
+        def held_generate(**kwargs):
+            order.append(self.tokenizer.decode(kwargs['input_ids'][0], skip_special_tokens=True))
+            started.set()
+            # Holds the scheduler while the queue fills up
+            release.wait(timeout=30)
+            return generate(**kwargs)
+
+        with mock.patch.object(self.model, 'generate', held_generate):
+            futures = [scheduler.submit('blocker', user='blocker', **GREEDY)]
+            self.assertTrue(started.wait(timeout=30))
+            futures += [
+                scheduler.submit(f'{user}{index}', user=user, **GREEDY)
+                for user, index in (('a', 1), ('a', 2), ('a', 3), ('b', 1), ('b', 2))
+            ]
+            release.set()
+            for future in futures:
+                future.result(timeout=30)
+        self.assertEqual(order, ['blocker', 'a1', 'b1', 'a2', 'b2', 'a3'])
+
+    def test_padding_after_eos_is_not_counted_as_generated(self):
+        eos = self.tokenizer.eos_token_id
+        h, i, j, k = self.tokenizer.encode('hijk')
+        new_tokens = torch.tensor([[h, eos, eos, eos], [h, i, j, k]])
+
+        def generate(input_ids, attention_mask, **kwargs):
+            return torch.cat([input_ids, new_tokens], dim=1)
+
+        with mock.patch.object(self.model, 'generate', generate):
+            futures = [self.scheduler.submit(prompt, **GREEDY) for prompt in ('ab', 'cd')]
+            self.assertEqual([future.result(timeout=30) for future in futures], ['h', 'hijk'])
+        self.scheduler.shutdown()
+        self.assertEqual(self.scheduler.get_stats()['generated_tokens'], 5)
+
+    def test_shared_tokenizer_is_left_as_it_was(self):
+        self.assertEqual(self.tokenizer.padding_side, 'right')
+        self.assertIsNone(self.tokenizer.pad_token)
+        self.assertEqual(self.scheduler.tokenizer.padding_side, 'left')
+
+    def test_different_generation_parameters_are_not_batched_together(self):
+        first = self.scheduler.submit('User: hi\nAssistant:', **GREEDY)
+        second = self.scheduler.submit('User: hi\nAssistant:', max_new_tokens=4, do_sample=False)
+        self.assertEqual(len(first.result(timeout=30)), 8)
+        self.assertEqual(len(second.result(timeout=30)), 4)
+        self.scheduler.shutdown()
+        self.assertEqual(self.scheduler.get_stats()['batches'], 2)
+
+    def test_work_submitted_before_shutdown_finishes(self):
+        future = self.scheduler.submit('User: hi\nAssistant:', **GREEDY)
+        self.scheduler.shutdown()
+        self.assertEqual(len(future.result(timeout=1)), 8)
+
+    def test_submit_after_shutdown_raises(self):
+        self.scheduler.shutdown()
+        with self.assertRaisesMessage(RuntimeError, 'shut down'):
+            self.scheduler.submit('User: hi\nAssistant:', **GREEDY)
+
+
+@override_settings(**STUB_LLM_SETTINGS, LLM_BATCHING_ENABLED=True, LLM_BATCH_MAX_WAIT_MS=0)
+class BatchedLLMServiceTests(SimpleTestCase):
+    def setUp(self):
+        reset_llm_service()
+        self.addCleanup(reset_llm_service)
+        self.service = LLMService()
+
+    def test_replies_go_through_the_scheduler(self):
+        response = async_to_sync(self.service.get_response)('hello', [], user_id=1)
+        self.assertNotEqual(response, LLMService.FALLBACK_RESPONSE)
+        self.assertEqual(self.service._executor.pending, 0)
+        self.service.scheduler.shutdown()
+        self.assertEqual(self.service.scheduler.get_stats()['requests'], 1)
+
+    def test_failed_submit_gives_the_queue_slots_back(self):
+        self.service.scheduler.shutdown()
+        for _ in range(self.service._executor.max_pending_per_user + 1):
+            response = async_to_sync(self.service.get_response)('hello', [], user_id=1)
+            self.assertEqual(response, LLMService.FALLBACK_RESPONSE)
+        self.assertEqual(self.service._executor.pending, 0)
+        self.assertFalse(self.service._executor._pending_by_user)
@@ -0,0 +1,51 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase
+
+from chat.management.commands.bench_llm import Command
+
+
+def results(p95=100.0, tokens_per_second=50.0, queries=5.0):
+    return {
+        'latency_ms': {'p50': 80.0, 'p95': p95},
+        'ttft_ms': {'p50': None, 'p95': None},
+        'tokens_per_second': {'aggregate': tokens_per_second},
+        'db_queries_per_request': {'mean': queries},
+        'peak_rss_mb': 300.0,
+    }
+
+
+class BaselineComparisonTests(SimpleTestCase):
+    def setUp(self):
+        handle, self.baseline = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(handle, 'w') as baseline:
+            json.dump({'results': results()}, baseline)
+        self.addCleanup(os.remove, self.baseline)
+        self.command = Command(stdout=StringIO(), stderr=StringIO())
+
+    def test_changes_within_tolerance_pass(self):
+        self.command._compare(results(p95=109.0, tokens_per_second=46.0), self.baseline, tolerance=0.1)
+        self.assertIn('No regressions', self.command.stderr._out.getvalue())
+
+    def test_improvements_pass(self):
+        self.command._compare(results(p95=50.0, tokens_per_second=90.0, queries=3.0), self.baseline, tolerance=0.1)
+
+    def test_regressions_in_either_direction_fail(self):
+        with self.assertRaises(CommandError) as caught:
+            self.command._compare(results(p95=120.0, tokens_per_second=40.0), self.baseline, tolerance=0.1)
+        message = str(caught.exception)
+        self.assertIn('latency_ms.p95: 100.00 -> 120.00 (+20%)', message)
+        self.assertIn('tokens_per_second.aggregate: 50.00 -> 40.00 (-20%)', message)
+        self.assertNotIn('db_queries_per_request', message)
+
+    def test_metrics_missing_on_either_side_are_skipped(self):
+        current = results(p95=300.0)
+        del current['latency_ms']
+        self.command._compare(current, self.baseline, tolerance=0.1)
+        with open(self.baseline, 'w') as baseline:
+            json.dump({'results': {'peak_rss_mb': 300.0}}, baseline)
+        self.command._compare(results(p95=300.0), self.baseline, tolerance=0.1)
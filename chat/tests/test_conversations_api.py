@@ -0,0 +1,66 @@
+from chat.models import Conversation, Message
+
+from .utils import ChatAPITestCase
+
+
+class ConversationListTests(ChatAPITestCase):
+    def add_conversation(self, messages):
+        conversation = Conversation.objects.create(user=self.user, title=f'{messages} messages')
+        Message.objects.bulk_create(
+            Message(conversation=conversation, content=f'message {index}', role='user') for index in range(messages)
+        )
+        return conversation
+
+    def test_list_counts_and_previews_in_constant_queries(self):
+        for count in range(1, 6):
+            self.add_conversation(count)
+        # The token lookup, then one query for the whole page
+        with self.assertNumQueries(2):
+            response = self.client.get('/chat/conversations/?page_size=3')
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual([c['message_count'] for c in results], [5, 4, 3])
+        self.assertEqual(results[0]['last_message'], {'role': 'user', 'content': 'message 4'})
+
+        # The token is cached by now
+        with self.assertNumQueries(1):
+            response = self.client.get(response.data['next'])
+        self.assertEqual([c['message_count'] for c in response.data['results']], [2, 1, 0])
+        self.assertIsNone(response.data['next'])
+
+    def test_other_users_conversations_are_not_listed(self):
+        other = self.user.__class__.objects.create_user('bob')
+        Conversation.objects.create(user=other, title='Private')
+        response = self.client.get('/chat/conversations/')
+        self.assertEqual([c['id'] for c in response.data['results']], [self.conversation.pk])
+        response = self.client.get(f'/chat/conversations/{other.conversation_set.get().pk}/')
+        self.assertEqual(response.status_code, 404)
+
+
+class ConversationDetailTests(ChatAPITestCase):
+    def setUp(self):
+        super().setUp()
+        Message.objects.bulk_create(
+            Message(conversation=self.conversation, content=f'message {index}', role='user') for index in range(5)
+        )
+
+    def test_retrieve_includes_the_messages(self):
+        url = f'/chat/conversations/{self.conversation.pk}/'
+        self.client.get(url)
+        # The conversation, then its messages
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['title'], 'Test')
+        self.assertEqual([m['content'] for m in response.data['messages']], [f'message {index}' for index in range(5)])
+
+    def test_messages_are_paged_oldest_first(self):
+        url = f'/chat/conversations/{self.conversation.pk}/messages/?page_size=2'
+        contents = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 2)
+            contents += [message['content'] for message in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(contents, [f'message {index}' for index in range(5)])
@@ -0,0 +1,68 @@
+from asgiref.sync import async_to_sync
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from chat.middleware import CorsMiddleware
+
+ALLOWED = 'http://localhost:5500'
+
+
+def view(request):
+    return HttpResponse('ok')
+
+
+async def async_view(request):
+    return HttpResponse('ok')
+
+
+class CorsMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def preflight(self, origin=ALLOWED):
+        return self.factory.options('/chat/conversations/', HTTP_ORIGIN=origin, HTTP_ACCESS_CONTROL_REQUEST_METHOD='POST')
+
+    @override_settings(CORS_ALLOW_ALL_ORIGINS=True, CORS_ALLOW_CREDENTIALS=False)
+    def test_any_origin_gets_the_wildcard(self):
+        response = CorsMiddleware(view)(self.factory.get('/', HTTP_ORIGIN='https://example.com'))
+        self.assertEqual(response['Access-Control-Allow-Origin'], '*')
+        self.assertEqual(response['Vary'], 'Origin')
+        self.assertNotIn('Access-Control-Allow-Methods', response)
+
+    @override_settings(CORS_ALLOW_ALL_ORIGINS=False, CORS_ALLOWED_ORIGINS=[ALLOWED + '/'], CORS_ALLOW_CREDENTIALS=True)
+    def test_allowed_origins_are_echoed_with_credentials(self):
+        middleware = CorsMiddleware(view)
+        response = middleware(self.factory.get('/', HTTP_ORIGIN=ALLOWED))
+        self.assertEqual(response['Access-Control-Allow-Origin'], ALLOWED)
+        self.assertEqual(response['Access-Control-Allow-Credentials'], 'true')
+
+        response = middleware(self.factory.get('/', HTTP_ORIGIN='https://example.com'))
+        self.assertNotIn('Access-Control-Allow-Origin', response)
+        self.assertEqual(response['Vary'], 'Origin')
+
+    @override_settings(CORS_ALLOW_ALL_ORIGINS=False, CORS_ALLOWED_ORIGINS=[ALLOWED], CORS_PREFLIGHT_MAX_AGE=600)
+    def test_preflight_is_answered_without_reaching_the_view(self):
+        def unreachable(request):
+            raise AssertionError('preflight reached the view')
+
+        response = CorsMiddleware(unreachable)(self.preflight())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Access-Control-Allow-Origin'], ALLOWED)
+        self.assertIn('POST', response['Access-Control-Allow-Methods'])
+        self.assertIn('authorization', response['Access-Control-Allow-Headers'])
+        self.assertEqual(response['Access-Control-Max-Age'], '600')
+
+    @override_settings(CORS_ALLOW_ALL_ORIGINS=True, CORS_ALLOW_CREDENTIALS=False)
+    def test_async_stack_gets_the_same_headers(self):
+        middleware = CorsMiddleware(async_view)
+        response = async_to_sync(middleware)(self.factory.get('/', HTTP_ORIGIN=ALLOWED))
+        self.assertEqual(response['Access-Control-Allow-Origin'], '*')
+        response = async_to_sync(middleware)(self.preflight())
+        self.assertIn('Access-Control-Allow-Methods', response)
+
+    def test_preflight_through_the_full_stack(self):
+        response = self.client.options(
+            '/chat/conversations/', HTTP_ORIGIN=ALLOWED, HTTP_ACCESS_CONTROL_REQUEST_METHOD='POST'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Access-Control-Allow-Origin', response)
@@ -0,0 +1,114 @@
+from unittest import mock
+
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from chat.models import Message
+from chat.services.history import ConversationHistoryCache, history_cache
+from chat.services.llm_service import LLMService
+from chat.streaming import unsummarized_history
+
+from .utils import STUB_LLM_SETTINGS, ChatAPITestCase, reset_llm_service
+
+
+class ConversationHistoryCacheTests(ChatAPITestCase):
+    def add(self, content, role='user'):
+        return Message.objects.create(conversation=self.conversation, content=content, role=role)
+
+    def test_a_miss_loads_the_newest_window_and_later_messages_are_appended(self):
+        cache = ConversationHistoryCache(window=3, max_conversations=10)
+        for index in range(5):
+            self.add(f'message {index}')
+
+        with self.assertNumQueries(1):
+            self.assertEqual([m['content'] for m in cache.get(self.conversation)],
+                             ['message 2', 'message 3', 'message 4'])
+        cache.append(self.add('message 5'))
+        with self.assertNumQueries(0):
+            self.assertEqual([m['content'] for m in cache.get(self.conversation)],
+                             ['message 3', 'message 4', 'message 5'])
+
+    def test_messages_with_the_same_timestamp_keep_their_order(self):
+        now = timezone.now()
+        for index in range(4):
+            Message.objects.create(conversation=self.conversation, content=f'message {index}',
+                                   role='user' if index % 2 == 0 else 'assistant', timestamp=now)
+        cache = ConversationHistoryCache(window=3, max_conversations=10)
+        self.assertEqual([m['content'] for m in cache.get(self.conversation)],
+                         ['message 1', 'message 2', 'message 3'])
+
+    def test_edits_and_deletes_drop_the_cached_window(self):
+        message = self.add('original')
+        self.assertEqual(history_cache.get(self.conversation)[-1]['content'], 'original')
+
+        message.content = 'edited'
+        message.save()
+        self.assertEqual(history_cache.get(self.conversation)[-1]['content'], 'edited')
+
+        message.delete()
+        self.assertEqual(history_cache.get(self.conversation), [])
+
+    def test_least_recently_used_conversations_are_dropped(self):
+        cache = ConversationHistoryCache(window=3, max_conversations=1)
+        other = self.user.conversation_set.create(title='Other')
+        cache.get(self.conversation)
+        cache.get(other)
+        with self.assertNumQueries(1):
+            cache.get(self.conversation)
+
+
+@override_settings(**STUB_LLM_SETTINGS, LLM_PROMPT_MAX_TOKENS=200, LLM_SUMMARY_MAX_TOKENS=100)
+class UnsummarizedHistoryTests(ChatAPITestCase):
+    def setUp(self):
+        super().setUp()
+        reset_llm_service()
+        self.addCleanup(reset_llm_service)
+        patcher = mock.patch.object(history_cache, 'window', 4)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.messages = [
+            Message.objects.create(conversation=self.conversation, content=f'Message number {index}.',
+                                   role='user' if index % 2 == 0 else 'assistant')
+            for index in range(12)
+        ]
+
+    def test_turns_older_than_a_full_window_are_read_and_folded(self):
+        history = unsummarized_history(self.conversation)
+        self.assertEqual([m['id'] for m in history], [m.pk for m in self.messages])
+
+        recent = LLMService().fold_history(self.conversation, history, 'hi')
+        self.assertTrue(self.conversation.summary)
+        # Everything before the turns still sent is now in the summary
+        self.assertEqual(self.conversation.summary_last_message_id, history[len(history) - len(recent) - 1]['id'])
+
+    def test_a_window_reaching_back_to_the_summary_needs_no_extra_query(self):
+        self.conversation.summary_last_message_id = self.messages[8].pk
+        unsummarized_history(self.conversation)
+        with self.assertNumQueries(0):
+            history = unsummarized_history(self.conversation)
+        self.assertEqual([m['id'] for m in history], [m.pk for m in self.messages[9:]])
+
+
+@override_settings(**STUB_LLM_SETTINGS, CHAT_RATE_LIMIT_PER_MINUTE=0)
+class SendMessageQueryTests(ChatAPITestCase):
+    def setUp(self):
+        super().setUp()
+        reset_llm_service()
+        self.addCleanup(reset_llm_service)
+
+    def send(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                f'/chat/conversations/{self.conversation.pk}/send_message/', {'message': 'hi'}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in queries.captured_queries]
+
+    def test_queries_per_turn_dont_grow_with_the_conversation(self):
+        self.send()
+        turns = [self.send() for _ in range(3)]
+        self.assertEqual(len({len(queries) for queries in turns}), 1)
+        # The history comes from the cached window, not from reading the messages
+        self.assertFalse([sql for sql in turns[-1] if sql.startswith('SELECT') and 'chat_message' in sql])
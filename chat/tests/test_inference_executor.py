@@ -0,0 +1,83 @@
+import threading
+
+from django.test import SimpleTestCase
+
+from chat.services.inference_executor import InferenceExecutor, LLMOverloadedError, LLMUserLimitError
+
+
+class InferenceExecutorTests(SimpleTestCase):
+    def setUp(self):
+        self.executor = InferenceExecutor(max_workers=1, max_queue_size=1, retry_after=7)
+        self.release = threading.Event()
+        self.addCleanup(self.executor.shutdown)
+        self.addCleanup(self.release.set)
+
+    def blocked(self):
+        self.release.wait(timeout=30)
+        return 'done'
+
+    def test_work_beyond_the_queue_bound_is_refused(self):
+        running = self.executor.submit(self.blocked)
+        queued = self.executor.submit(self.blocked)
+        with self.assertRaises(LLMOverloadedError) as caught:
+            self.executor.submit(self.blocked)
+        self.assertEqual(caught.exception.retry_after, 7)
+        self.assertEqual(self.executor.pending, 2)
+
+        self.release.set()
+        self.assertEqual(running.result(timeout=30), 'done')
+        self.assertEqual(queued.result(timeout=30), 'done')
+
+    def test_finished_work_frees_its_slot(self):
+        self.release.set()
+        for _ in range(5):
+            self.assertEqual(self.executor.submit(self.blocked).result(timeout=30), 'done')
+        self.assertEqual(self.executor.pending, 0)
+
+    def test_failing_work_frees_its_slot(self):
+        future = self.executor.submit(lambda: 1 / 0)
+        with self.assertRaises(ZeroDivisionError):
+            future.result(timeout=30)
+        self.assertEqual(self.executor.pending, 0)
+
+    def test_submit_after_shutdown_raises(self):
+        self.executor.shutdown()
+        with self.assertRaisesMessage(RuntimeError, 'shut down'):
+            self.executor.submit(self.blocked)
+        self.assertEqual(self.executor.pending, 0)
+
+
+class FairInferenceExecutorTests(SimpleTestCase):
+    def setUp(self):
+        self.executor = InferenceExecutor(max_workers=1, max_queue_size=10, max_pending_per_user=3)
+        self.release = threading.Event()
+        self.addCleanup(self.executor.shutdown)
+        self.addCleanup(self.release.set)
+
+    def test_users_are_served_round_robin(self):
+        order = []
+        # Holds the only worker while the queues fill up
+        self.executor.submit_for('blocker', self.release.wait, 30)
+        futures = [
+            self.executor.submit_for(user, order.append, f'{user}{index}')
+            for user, index in (('a', 1), ('a', 2), ('a', 3), ('b', 1), ('c', 1), ('b', 2))
+        ]
+        self.release.set()
+        for future in futures:
+            future.result(timeout=30)
+        self.assertEqual(order, ['a1', 'b1', 'c1', 'a2', 'b2', 'a3'])
+
+    def test_user_over_their_limit_is_refused_without_affecting_others(self):
+        for _ in range(3):
+            self.executor.submit_for('a', self.release.wait, 30)
+        with self.assertRaises(LLMUserLimitError):
+            self.executor.submit_for('a', self.release.wait, 30)
+        self.executor.submit_for('b', self.release.wait, 30)
+        self.assertEqual(self.executor._pending_by_user, {'a': 3, 'b': 1})
+
+    def test_failed_admission_gives_the_slot_back(self):
+        with self.assertRaises(RuntimeError):
+            with self.executor.admit('a'):
+                raise RuntimeError('submit failed')
+        self.assertEqual(self.executor.pending, 0)
+        self.assertFalse(self.executor._pending_by_user)
@@ -0,0 +1,66 @@
+import torch
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase, override_settings
+
+from chat.services.kv_cache import ConversationKVCache, kv_cache
+from chat.services.llm_service import LLMService
+
+from .utils import STUB_LLM_SETTINGS, reset_llm_service, stub_model
+
+
+class ConversationKVCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.model, self.tokenizer = stub_model()
+
+    def computed_cache(self, text):
+        inputs = self.tokenizer(text, return_tensors='pt')
+        with torch.inference_mode():
+            output = self.model(**inputs, use_cache=True)
+        return inputs['input_ids'], output.past_key_values
+
+    def test_take_reuses_the_common_prefix(self):
+        cache = ConversationKVCache(max_bytes=10 * 1024 * 1024)
+        token_ids, past_key_values = self.computed_cache('User: hello\nAssistant: hi')
+        cache.put(1, token_ids, past_key_values)
+
+        prompt_ids = self.tokenizer('User: hello\nAssistant: howdy', return_tensors='pt')['input_ids']
+        reused_cache, reused = cache.take(1, prompt_ids)
+        self.assertEqual(reused, len('User: hello\nAssistant: h'))
+        self.assertEqual(reused_cache.get_seq_length(), reused)
+        # Taken entries are gone until they're put back
+        self.assertEqual(cache.take(1, prompt_ids), (None, 0))
+        self.assertEqual(cache.total_bytes, 0)
+
+    def test_entries_are_evicted_beyond_the_byte_budget(self):
+        token_ids, past_key_values = self.computed_cache('User: hello')
+        cache = ConversationKVCache(max_bytes=10 * 1024 * 1024)
+        cache.put(1, token_ids, past_key_values)
+        # Room for exactly one entry of this size
+        cache.max_bytes = cache.total_bytes
+        cache.put(2, *self.computed_cache('User: hello'))
+        self.assertEqual(cache.total_bytes, cache.max_bytes)
+        self.assertEqual(cache.take(1, token_ids), (None, 0))
+        self.assertEqual(cache.take(2, token_ids)[1], token_ids.shape[1] - 1)
+
+
+@override_settings(**STUB_LLM_SETTINGS, LLM_RESPONSE_CACHE_ENABLED=False)
+class KVCacheGenerationTests(SimpleTestCase):
+    def setUp(self):
+        kv_cache.clear()
+        self.addCleanup(kv_cache.clear)
+        reset_llm_service()
+        self.addCleanup(reset_llm_service)
+
+    def reply(self, message, history, conversation_id):
+        return async_to_sync(LLMService().get_response)(message, history, conversation_id=conversation_id)
+
+    def test_next_turn_reuses_the_cached_prompt_and_matches_uncached_output(self):
+        with override_settings(LLM_KV_CACHE_ENABLED=True):
+            first = self.reply('hello', [], conversation_id=1)
+            history = [{'role': 'user', 'content': 'hello'}, {'role': 'assistant', 'content': first}]
+            hits = kv_cache.hits
+            second = self.reply('and again', history, conversation_id=1)
+            self.assertEqual(kv_cache.hits, hits + 1)
+
+        self.assertEqual(first, self.reply('hello', [], conversation_id=None))
+        self.assertEqual(second, self.reply('and again', history, conversation_id=None))
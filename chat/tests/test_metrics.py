@@ -0,0 +1,69 @@
+from django.test import SimpleTestCase, override_settings
+
+from chat.services import metrics
+
+
+class MetricsRenderTests(SimpleTestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counters_and_gauges_render_with_escaped_labels(self):
+        counter = metrics.Counter('requests_total', 'Requests', ['path'], registry=self.registry)
+        counter.inc(path='/a')
+        counter.inc(2, path='say "hi"\n')
+        metrics.Gauge('depth', 'Queue depth', registry=self.registry).set(3)
+        self.assertEqual(self.registry.render(), '\n'.join([
+            '# HELP requests_total Requests',
+            '# TYPE requests_total counter',
+            'requests_total{path="/a"} 1',
+            'requests_total{path="say \\"hi\\"\\n"} 2',
+            '# HELP depth Queue depth',
+            '# TYPE depth gauge',
+            'depth 3',
+        ]) + '\n')
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram('latency_seconds', 'Latency', buckets=(0.1, 1), registry=self.registry)
+        for value in (0.05, 0.1, 0.5, 5):
+            histogram.observe(value)
+        lines = self.registry.render().splitlines()
+        self.assertEqual(lines[2:], [
+            'latency_seconds_bucket{le="0.1"} 2',
+            'latency_seconds_bucket{le="1"} 3',
+            'latency_seconds_bucket{le="+Inf"} 4',
+            'latency_seconds_sum 5.65',
+            'latency_seconds_count 4',
+        ])
+
+    def test_wrong_labels_are_refused(self):
+        counter = metrics.Counter('requests_total', 'Requests', ['path'], registry=self.registry)
+        with self.assertRaises(ValueError):
+            counter.inc(method='GET')
+
+    def test_failing_callback_is_left_out(self):
+        metrics.CallbackMetric('broken', 'Broken', lambda: 1 / 0, registry=self.registry)
+        metrics.CallbackMetric('sizes', 'Sizes', lambda: {('a',): 1}, labelnames=['cache'], registry=self.registry)
+        self.assertEqual(self.registry.render(), '# HELP sizes Sizes\n# TYPE sizes gauge\nsizes{cache="a"} 1\n')
+
+
+class MetricsEndpointTests(SimpleTestCase):
+    def test_endpoint_serves_the_text_format(self):
+        with metrics.stage('test_stage'):
+            pass
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn('chat_stage_seconds_count{stage="test_stage"} 1', response.content.decode())
+
+    def test_other_addresses_are_refused(self):
+        response = self.client.get('/metrics', REMOTE_ADDR='203.0.113.7')
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.0/8'], METRICS_TOKEN='s3cret')
+    def test_allowed_networks_and_the_token_are_let_in(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.1.2.3').status_code, 200)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        response = self.client.get('/metrics', REMOTE_ADDR='203.0.113.7', HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/metrics', REMOTE_ADDR='203.0.113.7', HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 403)
@@ -0,0 +1,38 @@
+from unittest import mock
+
+from django.db import DatabaseError
+
+from chat.models import Conversation
+from chat.services.history import history_cache
+from chat.services.persistence import save_turn
+
+from .utils import ChatAPITestCase
+
+
+class SaveTurnTests(ChatAPITestCase):
+    def test_turn_is_saved_with_one_insert_and_bumps_the_conversation(self):
+        updated_at = self.conversation.updated_at
+        history_cache.get(self.conversation)
+        # One INSERT for both messages and one UPDATE, inside a savepoint of the test's transaction
+        with self.assertNumQueries(4):
+            user_message, ai_message = save_turn(self.conversation, 'hello', 'hi there')
+
+        self.assertEqual(
+            list(self.conversation.messages.values_list('id', 'role', 'content')),
+            [(user_message.pk, 'user', 'hello'), (ai_message.pk, 'assistant', 'hi there')]
+        )
+        self.assertGreater(Conversation.objects.get(pk=self.conversation.pk).updated_at, updated_at)
+        with self.assertNumQueries(0):
+            self.assertEqual([m['id'] for m in history_cache.get(self.conversation)], [user_message.pk, ai_message.pk])
+
+    def test_failed_turn_saves_neither_message(self):
+        with mock.patch('chat.services.persistence.touch_conversation', side_effect=DatabaseError('disk full')):
+            with self.assertRaises(DatabaseError):
+                save_turn(self.conversation, 'hello', 'hi there')
+        self.assertFalse(self.conversation.messages.exists())
+        self.assertEqual(history_cache.get(self.conversation), [])
+
+    def test_a_message_without_a_reply_is_saved_alone(self):
+        user_message, ai_message = save_turn(self.conversation, 'hello', None)
+        self.assertIsNone(ai_message)
+        self.assertEqual(list(self.conversation.messages.values_list('id', 'role')), [(user_message.pk, 'user')])
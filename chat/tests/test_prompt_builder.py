@@ -0,0 +1,95 @@
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from chat.models import Conversation, Message
+from chat.services.llm_service import LLMService
+from chat.services.prompt_builder import PromptBuilder, ReplyExtractor, extract_reply
+
+from .utils import STUB_LLM_SETTINGS, reset_llm_service, stub_model
+
+
+def turns(count, content='x' * 20):
+    return [
+        {'id': index, 'role': 'user' if index % 2 else 'assistant', 'content': f'{content} {index}'}
+        for index in range(1, count + 1)
+    ]
+
+
+class PromptBuilderTests(SimpleTestCase):
+    def setUp(self):
+        _, tokenizer = stub_model()
+        self.builder = PromptBuilder(tokenizer, max_prompt_tokens=200, max_summary_tokens=50)
+
+    def test_history_that_fits_is_not_split(self):
+        history = turns(3)
+        self.assertEqual(self.builder.split_history(history, 'hi'), ([], history))
+
+    def test_overflowing_history_keeps_a_window_of_half_the_budget(self):
+        history = turns(20)
+        older, recent = self.builder.split_history(history, 'hi')
+        self.assertEqual(older + recent, history)
+        self.assertTrue(older)
+        self.assertEqual(self.builder.fit_history(recent, 'hi'), recent)
+        budget = self.builder._history_budget('hi', '')
+        self.assertLessEqual(sum(self.builder.count_tokens(self.builder.format_turn(t)) + 1 for t in recent), budget // 2)
+
+    def test_fold_keeps_the_first_sentence_of_the_newest_turns(self):
+        summary = self.builder.fold('', [
+            {'role': 'user', 'content': 'First question. With detail.'},
+            {'role': 'assistant', 'content': 'An answer! More words.'},
+        ])
+        self.assertEqual(summary, 'User: First question.\nAssistant: An answer!')
+
+        summary = self.builder.fold(summary, [{'role': 'user', 'content': 'Something else entirely.'}])
+        self.assertEqual(summary, 'User: Something else entirely.')
+        self.assertLessEqual(self.builder.count_tokens(summary), 50)
+
+
+class ExtractReplyTests(SimpleTestCase):
+    def test_reply_ends_at_the_first_role_marker(self):
+        self.assertEqual(extract_reply(' Hi there.\nUser: and you?\nAssistant: fine'), 'Hi there.')
+        self.assertEqual(extract_reply(' The User: field is required.'), 'The User: field is required.')
+
+    def test_streamed_reply_matches_the_whole_completion(self):
+        completion = ' First line.\nSecond line.\n  Assistant: more\nUser: hi'
+        for size in (1, 2, 5, len(completion)):
+            extractor = ReplyExtractor()
+            parts = [extractor.feed(completion[i:i + size]) for i in range(0, len(completion), size)]
+            parts.append(extractor.flush())
+            self.assertEqual(''.join(parts).strip(), extract_reply(completion))
+
+    def test_a_possible_marker_is_held_back_until_settled(self):
+        extractor = ReplyExtractor()
+        self.assertEqual(extractor.feed('Hi.\nUs'), 'Hi.')
+        self.assertEqual(extractor.feed('ually'), '\nUsually')
+        self.assertEqual(extractor.feed('\nAssist'), '')
+        self.assertEqual(extractor.feed('ant: next turn'), '')
+        self.assertTrue(extractor.ended)
+        self.assertEqual(extractor.feed(' ignored'), '')
+        self.assertEqual(extractor.flush(), '')
+
+
+@override_settings(**STUB_LLM_SETTINGS, LLM_PROMPT_MAX_TOKENS=200, LLM_SUMMARY_MAX_TOKENS=100)
+class FoldHistoryTests(TestCase):
+    def setUp(self):
+        reset_llm_service()
+        self.addCleanup(reset_llm_service)
+        user = User.objects.create_user('alice')
+        self.conversation = Conversation.objects.create(user=user)
+        for index in range(20):
+            Message.objects.create(
+                conversation=self.conversation, role='user' if index % 2 == 0 else 'assistant',
+                content=f'Message number {index}. Padding that only the transcript keeps.'
+            )
+
+    def test_folded_turns_move_into_the_saved_summary(self):
+        history = list(self.conversation.messages.values('id', 'content', 'role'))
+        recent = LLMService().fold_history(self.conversation, history, 'hi')
+
+        self.conversation.refresh_from_db()
+        folded = history[:len(history) - len(recent)]
+        self.assertTrue(folded)
+        self.assertEqual(recent, history[len(folded):])
+        self.assertEqual(self.conversation.summary_last_message_id, folded[-1]['id'])
+        self.assertIn(f"Message number {len(folded) - 1}.", self.conversation.summary)
+        self.assertNotIn('Padding', self.conversation.summary)
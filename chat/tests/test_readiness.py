@@ -0,0 +1,33 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, override_settings
+
+from chat.services.llm_service import LLMService
+
+from .utils import STUB_LLM_SETTINGS, reset_llm_service
+
+
+@override_settings(**STUB_LLM_SETTINGS)
+class ReadinessTests(SimpleTestCase):
+    def setUp(self):
+        reset_llm_service()
+        self.addCleanup(reset_llm_service)
+
+    def test_not_ready_until_the_model_is_loaded(self):
+        response = self.client.get('/chat/ready/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['status'], LLMService.NOT_LOADED)
+
+        LLMService.preload(background=True).join(timeout=60)
+        response = self.client.get('/chat/ready/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], LLMService.READY)
+        self.assertIsNotNone(response.json()['load_seconds'])
+
+    @override_settings(LLM_BACKEND='missing')
+    def test_failed_load_is_reported_without_its_error(self):
+        with self.assertRaises(ImproperlyConfigured):
+            LLMService()
+        response = self.client.get('/chat/ready/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['status'], LLMService.FAILED)
+        self.assertNotIn('error', response.json())
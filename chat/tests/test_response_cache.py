@@ -0,0 +1,45 @@
+from asgiref.sync import async_to_sync
+from django.core.cache import caches
+from django.test import SimpleTestCase, override_settings
+
+from chat.services.llm_service import LLMService
+from chat.services.response_cache import ResponseCache
+from chat.services.single_flight import SingleFlight
+
+from .utils import STUB_LLM_SETTINGS, reset_llm_service
+
+GREEDY = {'max_new_tokens': 8, 'do_sample': False}
+
+
+class ResponseCacheKeyTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = ResponseCache('model')
+
+    def test_keys_are_the_exact_prompt(self):
+        flight = SingleFlight('model')
+        for make_key in (self.cache.make_key, flight.make_key):
+            self.assertEqual(make_key('User: hello', GREEDY), make_key('User: hello', GREEDY))
+            self.assertNotEqual(make_key('User: Hello', GREEDY), make_key('User: hello', GREEDY))
+            self.assertNotEqual(make_key('User: a  b', GREEDY), make_key('User: a b', GREEDY))
+
+    def test_model_and_parameters_are_part_of_the_key(self):
+        key = self.cache.make_key('User: hello', GREEDY)
+        self.assertNotEqual(key, ResponseCache('other-model').make_key('User: hello', GREEDY))
+        self.assertNotEqual(key, self.cache.make_key('User: hello', {**GREEDY, 'max_new_tokens': 9}))
+
+
+@override_settings(**STUB_LLM_SETTINGS, LLM_RESPONSE_CACHE_ENABLED=True)
+class CachedReplyTests(SimpleTestCase):
+    def setUp(self):
+        caches['llm_responses'].clear()
+        self.addCleanup(caches['llm_responses'].clear)
+        reset_llm_service()
+        self.addCleanup(reset_llm_service)
+        self.service = LLMService()
+
+    def test_repeated_prompt_is_served_from_the_cache(self):
+        first = async_to_sync(self.service.get_response)('hello', [])
+        second = async_to_sync(self.service.get_response)('hello', [])
+        self.assertEqual(first, second)
+        self.assertEqual(self.service.response_cache.get_stats()['hits'], 1)
+        self.assertEqual(list(self.service.stream_response('hello', [])), [first])
@@ -0,0 +1,66 @@
+from django.contrib.auth.models import User
+
+from chat.models import Conversation, Message
+from chat.services.search import fts5_query, search_messages
+
+from .utils import ChatAPITestCase
+
+
+class MessageSearchTests(ChatAPITestCase):
+    def add(self, content, conversation=None):
+        return Message.objects.create(conversation=conversation or self.conversation, content=content)
+
+    def found(self, text, user=None):
+        return [result['id'] for result in search_messages((user or self.user).pk, text)]
+
+    def test_index_follows_inserts_updates_and_deletes(self):
+        message = self.add('Zebras have stripes')
+        self.assertEqual(self.found('zebras'), [message.pk])
+
+        message.content = 'Leopards have spots'
+        message.save()
+        self.assertEqual(self.found('zebras'), [])
+        self.assertEqual(self.found('spots'), [message.pk])
+
+        message.delete()
+        self.assertEqual(self.found('spots'), [])
+
+    def test_every_word_has_to_match_and_diacritics_are_ignored(self):
+        both = self.add('The café serves crème brûlée')
+        self.add('The cafe is closed')
+        self.assertEqual(self.found('cafe creme'), [both.pk])
+
+    def test_only_the_users_own_messages_are_searched(self):
+        other = User.objects.create_user('bob')
+        self.add('secret plans', Conversation.objects.create(user=other))
+        self.assertEqual(self.found('secret'), [])
+        self.assertEqual(len(self.found('secret', user=other)), 1)
+
+    def test_query_syntax_is_searched_literally(self):
+        self.assertEqual(fts5_query('content:zebra OR "stripes'), '"content" "zebra" "OR" "stripes"')
+        self.assertEqual(self.found('NEAR(( "*'), [])
+
+    def test_snippets_are_escaped_with_marked_matches(self):
+        self.add('<b>Zebras</b> have stripes')
+        snippet = search_messages(self.user.pk, 'zebras')[0]['snippet']
+        self.assertEqual(snippet, '&lt;b&gt;<mark>Zebras</mark>&lt;/b&gt; have stripes')
+
+
+class SearchEndpointTests(ChatAPITestCase):
+    def test_results_are_paged(self):
+        for index in range(3):
+            Message.objects.create(conversation=self.conversation, content=f'zebra number {index}')
+        response = self.client.get('/chat/conversations/search/', {'q': 'zebra', 'page_size': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(response.data['results'][0]['conversation_title'], 'Test')
+        self.assertIsNotNone(response.data['next'])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next'])
+        self.assertIsNotNone(response.data['previous'])
+
+    def test_empty_query_is_refused(self):
+        response = self.client.get('/chat/conversations/search/', {'q': '  '})
+        self.assertEqual(response.status_code, 400)
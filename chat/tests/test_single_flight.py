@@ -0,0 +1,90 @@
+import asyncio
+
+from django.test import SimpleTestCase
+
+from chat.services.single_flight import SingleFlight
+
+
+class SingleFlightRunTests(SimpleTestCase):
+    def setUp(self):
+        self.flight = SingleFlight('model')
+        self.calls = 0
+
+    def run_concurrently(self, keys, result=None, error=None):
+        async def main():
+            started = asyncio.Event()
+            release = asyncio.Event()
+
+            async def generate():
+                self.calls += 1
+                started.set()
+                await release.wait()
+                if error is not None:
+                    raise error
+                return result
+
+            leader = asyncio.ensure_future(self.flight.run(keys[0], generate))
+            await started.wait()
+            others = [asyncio.ensure_future(self.flight.run(key, generate)) for key in keys[1:]]
+            await asyncio.sleep(0)
+            release.set()
+            return await asyncio.gather(leader, *others, return_exceptions=True)
+
+        return asyncio.run(main())
+
+    def test_identical_requests_share_one_generation(self):
+        self.assertEqual(self.run_concurrently(['k', 'k', 'k'], result='reply'), ['reply'] * 3)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.flight.get_stats(), {'generations': 1, 'coalesced': 2})
+
+    def test_only_the_call_in_flight_is_shared(self):
+        self.run_concurrently(['k'], result='reply')
+        self.run_concurrently(['k'], result='reply')
+        self.assertEqual(self.calls, 2)
+
+    def test_different_keys_generate_separately(self):
+        self.run_concurrently(['a', 'b'], result='reply')
+        self.assertEqual(self.calls, 2)
+
+    def test_joiners_get_the_leaders_error(self):
+        error = RuntimeError('generation failed')
+        self.assertEqual(self.run_concurrently(['k', 'k'], error=error), [error, error])
+
+
+class SingleFlightStreamTests(SimpleTestCase):
+    def setUp(self):
+        self.flight = SingleFlight('model')
+        self.closed = False
+
+    def source(self):
+        try:
+            yield from ['Hel', 'lo', '!']
+        finally:
+            self.closed = True
+
+    def test_subscribers_share_one_source(self):
+        starts = []
+        first = self.flight.stream('k', lambda: starts.append(1) or self.source())
+        self.assertEqual(next(first), 'Hel')
+        second = self.flight.stream('k', lambda: starts.append(2) or self.source())
+        self.assertEqual(list(second), ['Hel', 'lo', '!'])
+        self.assertEqual(list(first), ['lo', '!'])
+        self.assertEqual(starts, [1])
+
+    def test_source_is_closed_only_when_the_last_subscriber_leaves(self):
+        first = self.flight.stream('k', self.source)
+        second = self.flight.stream('k', self.source)
+        next(first)
+        first.close()
+        self.assertFalse(self.closed)
+        next(second)
+        second.close()
+        self.assertTrue(self.closed)
+
+    def test_failed_start_is_not_shared_afterwards(self):
+        def broken():
+            raise RuntimeError('queue full')
+
+        with self.assertRaises(RuntimeError):
+            self.flight.stream('k', broken)
+        self.assertEqual(list(self.flight.stream('k', self.source)), ['Hel', 'lo', '!'])
@@ -0,0 +1,58 @@
+import torch
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase, override_settings
+
+from chat.services.llm_service import LLMService
+from chat.services.speculative import SpeculativeDecoder
+
+from .utils import STUB_LLM_SETTINGS, reset_llm_service, stub_model
+
+GREEDY = {'max_new_tokens': 24, 'do_sample': False}
+
+
+class SpeculativeDecoderTests(SimpleTestCase):
+    def setUp(self):
+        self.model, self.tokenizer = stub_model()
+        self.inputs = self.tokenizer('User: hello\nAssistant:', return_tensors='pt')
+        self.prompt_length = self.inputs['input_ids'].shape[1]
+        self.expected = self.model.generate(**self.inputs, pad_token_id=self.tokenizer.eos_token_id, **GREEDY)
+
+    def speculate(self, draft_model):
+        decoder = SpeculativeDecoder(draft_model, num_draft_tokens=4)
+        output = decoder.generate(
+            self.prompt_length, self.model.generate, **self.inputs, pad_token_id=self.tokenizer.eos_token_id, **GREEDY
+        )
+        return output, decoder.get_stats()
+
+    def test_identical_draft_has_every_token_accepted(self):
+        draft_model, _ = stub_model()
+        output, stats = self.speculate(draft_model)
+        self.assertTrue(torch.equal(output, self.expected))
+        self.assertGreater(stats['proposed'], 0)
+        self.assertEqual(stats['accepted'], min(stats['proposed'], GREEDY['max_new_tokens'] - 1))
+
+    def test_disagreeing_draft_still_gives_the_main_models_output(self):
+        draft_model, _ = stub_model()
+        with torch.no_grad(), torch.random.fork_rng():
+            torch.manual_seed(1)
+            for parameter in draft_model.parameters():
+                parameter.add_(torch.randn_like(parameter) * 0.5)
+        output, stats = self.speculate(draft_model)
+        self.assertTrue(torch.equal(output, self.expected))
+        self.assertLess(stats['accepted'], stats['proposed'])
+
+
+@override_settings(**STUB_LLM_SETTINGS, LLM_RESPONSE_CACHE_ENABLED=False, LLM_KV_CACHE_ENABLED=False)
+class SpeculativeServiceTests(SimpleTestCase):
+    def setUp(self):
+        reset_llm_service()
+        self.addCleanup(reset_llm_service)
+
+    def test_replies_match_generation_without_a_draft_model(self):
+        expected = async_to_sync(LLMService().get_response)('hello', [])
+        reset_llm_service()
+        with override_settings(LLM_DRAFT_MODEL='stub-draft'):
+            service = LLMService()
+            self.assertIsNotNone(service.speculative)
+            self.assertEqual(async_to_sync(service.get_response)('hello', []), expected)
+        self.assertGreater(service.speculative.get_stats()['proposed'], 0)
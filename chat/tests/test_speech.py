@@ -0,0 +1,75 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from chat.models import Message
+from chat.services.llm_service import LLMService
+from chat.services.speech import LocalSpeechProvider, SentenceChunker, SpeechSynthesizer, visemes_for_characters
+from chat.streaming import reply_events
+
+from .utils import STUB_LLM_SETTINGS, ChatAPITestCase, reset_llm_service
+
+
+class SentenceChunkerTests(SimpleTestCase):
+    def test_sentences_are_cut_once_complete(self):
+        chunker = SentenceChunker(min_chars=10)
+        self.assertEqual(chunker.feed('The first sentence'), [])
+        self.assertEqual(chunker.feed(' ends here. The sec'), ['The first sentence ends here.'])
+        self.assertEqual(chunker.feed('ond one does not'), [])
+        self.assertEqual(chunker.flush(), ['The second one does not'])
+        self.assertEqual(chunker.flush(), [])
+
+    def test_short_sentences_join_the_next(self):
+        chunker = SentenceChunker(min_chars=10)
+        self.assertEqual(chunker.feed('Hi. Nice to meet you! '), ['Hi. Nice to meet you!'])
+
+
+class VisemeTests(SimpleTestCase):
+    def test_visemes_change_with_the_mouth_shape(self):
+        text = 'the map'
+        timeline = visemes_for_characters(text, [index * 10 for index in range(len(text))])
+        self.assertEqual(
+            [(entry['time_ms'], entry['viseme']) for entry in timeline],
+            [(0, 'TH'), (20, 'E'), (30, 'sil'), (40, 'PP'), (50, 'aa'), (60, 'PP')]
+        )
+
+
+@override_settings(**STUB_LLM_SETTINGS)
+class SpokenReplyTests(ChatAPITestCase):
+    def setUp(self):
+        super().setUp()
+        reset_llm_service()
+        self.addCleanup(reset_llm_service)
+        synthesizer = SpeechSynthesizer(LocalSpeechProvider(), 'default')
+        patcher = mock.patch('chat.streaming.get_synthesizer', return_value=synthesizer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def reply(self, chunks):
+        self.closed = False
+
+        def chunk_stream():
+            try:
+                yield from chunks
+            finally:
+                self.closed = True
+
+        return list(reply_events(LLMService(), self.conversation, 'hello', chunk_stream(), True, lambda path: path))
+
+    def test_speech_is_the_saved_reply(self):
+        events = self.reply([' Sure, I can help with that.', ' What do you need', ' to know?'])
+        done = next(data for name, data in events if name == 'done')
+        spoken = [data['text'] for name, data in events if name == 'speech']
+        self.assertEqual(spoken, ['Sure, I can help with that.', 'What do you need to know?'])
+        self.assertEqual(' '.join(spoken), done['message'])
+
+    def test_nothing_after_a_role_marker_is_streamed_spoken_or_saved(self):
+        chunks = [' Nice to meet you, Alice.', '\nUs', 'er: Tell me a joke.', '\nAssistant: Why did the']
+        events = self.reply(chunks)
+        self.assertTrue(self.closed)
+        streamed = ''.join(data['token'] for name, data in events if name == 'token')
+        spoken = [data['text'] for name, data in events if name == 'speech']
+        self.assertEqual(streamed, ' Nice to meet you, Alice.')
+        self.assertEqual(spoken, ['Nice to meet you, Alice.'])
+        reply = Message.objects.get(conversation=self.conversation, role='assistant')
+        self.assertEqual(reply.content, 'Nice to meet you, Alice.')
@@ -0,0 +1,78 @@
+import json
+
+from django.test import override_settings
+
+from chat.models import Message
+from chat.services.llm_service import LLMService
+
+from .utils import STUB_LLM_SETTINGS, ChatAPITestCase, reset_llm_service
+
+
+def parse_events(response):
+    body = b''.join(response.streaming_content).decode()
+    events = []
+    for frame in body.strip().split('\n\n'):
+        event, data = frame.split('\n', 1)
+        events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+    return events
+
+
+@override_settings(**STUB_LLM_SETTINGS, CHAT_RATE_LIMIT_PER_MINUTE=0)
+class SendMessageStreamTests(ChatAPITestCase):
+    def setUp(self):
+        super().setUp()
+        reset_llm_service()
+        self.addCleanup(reset_llm_service)
+        self.url = f'/chat/conversations/{self.conversation.pk}/send_message_stream/'
+
+    def test_tokens_stream_before_the_saved_turn(self):
+        response = self.client.post(self.url, {'message': 'hello'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        events = parse_events(response)
+        names = [name for name, _ in events]
+        self.assertEqual(names[-1], 'done')
+        self.assertTrue(names[:-1])
+        self.assertEqual(set(names[:-1]), {'token'})
+
+        done = events[-1][1]
+        streamed = ''.join(data['token'] for _, data in events[:-1])
+        self.assertEqual(done['message'], LLMService().extract_response(streamed))
+        messages = list(Message.objects.filter(conversation=self.conversation).order_by('timestamp'))
+        self.assertEqual([(m.role, m.content) for m in messages], [('user', 'hello'), ('assistant', done['message'])])
+        self.assertEqual(done['ai_message']['id'], messages[1].pk)
+
+    def test_a_disconnected_client_leaves_the_message_saved_without_a_reply(self):
+        response = self.client.post(self.url, {'message': 'hello'}, format='json')
+        next(iter(response.streaming_content))
+        response.close()
+        self.assertEqual(list(self.conversation.messages.values_list('role', 'content')), [('user', 'hello')])
+
+    def test_unauthenticated_requests_are_refused(self):
+        self.client.credentials()
+        response = self.client.post(self.url, {'message': 'hello'}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+
+@override_settings(**STUB_LLM_SETTINGS, CHAT_RATE_LIMIT_PER_MINUTE=0,
+                   LLM_EXECUTOR_WORKERS=1, LLM_EXECUTOR_QUEUE_SIZE=0, LLM_RETRY_AFTER_SECONDS=3)
+class OverloadedSendMessageTests(ChatAPITestCase):
+    def setUp(self):
+        super().setUp()
+        reset_llm_service()
+        self.addCleanup(reset_llm_service)
+        self.executor = LLMService()._executor
+
+    def test_full_inference_queue_answers_503_with_retry_after(self):
+        self.executor.acquire()
+        self.addCleanup(self.executor.release)
+        for action in ('send_message', 'send_message_stream'):
+            response = self.client.post(
+                f'/chat/conversations/{self.conversation.pk}/{action}/', {'message': 'hello'}, format='json'
+            )
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '3')
+        # The messages are kept, without replies
+        self.assertEqual(list(self.conversation.messages.values_list('role', 'content')),
+                         [('user', 'hello'), ('user', 'hello')])
@@ -0,0 +1,72 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from chat.throttling import TokenBucketLimiter
+
+from .utils import STUB_LLM_SETTINGS, ChatAPITestCase, reset_llm_service
+
+
+class TokenBucketLimiterTests(SimpleTestCase):
+    def test_burst_then_refill(self):
+        limiter = TokenBucketLimiter()
+        with mock.patch('chat.throttling.time.monotonic', return_value=100.0) as clock:
+            self.assertEqual([limiter.take('a', rate=0.5, burst=2) for _ in range(2)], [0, 0])
+            self.assertEqual(limiter.take('a', rate=0.5, burst=2), 2.0)
+            self.assertEqual(limiter.take('b', rate=0.5, burst=2), 0)
+            clock.return_value = 102.0
+            self.assertEqual(limiter.take('a', rate=0.5, burst=2), 0)
+
+    def test_evicted_keys_come_back_full(self):
+        limiter = TokenBucketLimiter(max_keys=1)
+        limiter.take('a', rate=0.01, burst=1)
+        limiter.take('b', rate=0.01, burst=1)
+        self.assertEqual(limiter.take('a', rate=0.01, burst=1), 0)
+
+
+@override_settings(**STUB_LLM_SETTINGS, CHAT_RATE_LIMIT_PER_MINUTE=6, CHAT_RATE_LIMIT_BURST=2)
+class MessageRateLimitTests(ChatAPITestCase):
+    def setUp(self):
+        super().setUp()
+        reset_llm_service()
+        self.addCleanup(reset_llm_service)
+
+    def test_messages_beyond_the_burst_get_429_with_retry_after(self):
+        url = f'/chat/conversations/{self.conversation.pk}/send_message/'
+        for _ in range(2):
+            self.assertEqual(self.client.post(url, {'message': 'hi'}, format='json').status_code, 200)
+        response = self.client.post(url, {'message': 'hi'}, format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn(response['Retry-After'], {'9', '10'})
+        self.assertEqual(self.conversation.messages.count(), 4)
+
+
+@override_settings(**STUB_LLM_SETTINGS, CHAT_RATE_LIMIT_PER_MINUTE=6, CHAT_RATE_LIMIT_BURST=2,
+                   VOICE_SYNTHESIS_ENABLED=True, VOICE_PROVIDER='local', VOICE_AUDIO_CACHE_ENABLED=False,
+                   VOICE_RATE_LIMIT_PER_MINUTE=6, VOICE_RATE_LIMIT_BURST=2)
+class SpeechRateLimitTests(ChatAPITestCase):
+    def setUp(self):
+        super().setUp()
+        reset_llm_service()
+        self.addCleanup(reset_llm_service)
+        patcher = mock.patch('chat.services.speech._synthesizer', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_speech_has_its_own_limit(self):
+        for _ in range(2):
+            self.assertEqual(self.client.post('/chat/speech/', {'text': 'Hello.'}, format='json').status_code, 200)
+        response = self.client.post('/chat/speech/', {'text': 'Hello.'}, format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn(response['Retry-After'], {'9', '10'})
+
+        url = f'/chat/conversations/{self.conversation.pk}/send_message/'
+        for _ in range(2):
+            self.assertEqual(self.client.post(url, {'message': 'hi'}, format='json').status_code, 200)
+
+    def test_messages_dont_use_up_the_speech_limit(self):
+        url = f'/chat/conversations/{self.conversation.pk}/send_message/'
+        for _ in range(2):
+            self.client.post(url, {'message': 'hi'}, format='json')
+        self.assertEqual(self.client.post(url, {'message': 'hi'}, format='json').status_code, 429)
+        self.assertEqual(self.client.post('/chat/speech/', {'text': 'Hello.'}, format='json').status_code, 200)
@@ -0,0 +1,47 @@
+from django.contrib.auth.models import User
+from rest_framework.authtoken.models import Token
+
+from chat.services.token_cache import token_cache
+
+from .utils import ChatAPITestCase
+
+
+class CachedTokenAuthenticationTests(ChatAPITestCase):
+    def get_conversations(self):
+        return self.client.get('/chat/conversations/')
+
+    def test_repeat_requests_skip_the_token_query(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(self.get_conversations().status_code, 200)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_conversations().status_code, 200)
+
+    def test_deleted_token_is_refused_at_once(self):
+        self.get_conversations()
+        self.token.delete()
+        self.assertEqual(self.get_conversations().status_code, 401)
+
+    def test_deactivated_user_is_refused_at_once(self):
+        self.get_conversations()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get_conversations().status_code, 401)
+
+    def test_unknown_tokens_are_not_cached(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token unknown')
+        for _ in range(2):
+            with self.assertNumQueries(1):
+                self.assertEqual(self.get_conversations().status_code, 401)
+
+    def test_each_token_authenticates_its_own_user(self):
+        self.get_conversations()
+        other = Token.objects.create(user=User.objects.create_user('bob'))
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {other.key}')
+        self.assertEqual(self.get_conversations().data['results'], [])
+
+    def test_disabled_cache_queries_every_time(self):
+        self.addCleanup(setattr, token_cache, 'ttl', token_cache.ttl)
+        token_cache.ttl = 0
+        for _ in range(2):
+            with self.assertNumQueries(2):
+                self.get_conversations()
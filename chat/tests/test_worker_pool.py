@@ -0,0 +1,120 @@
+import os
+import signal
+import sys
+import time
+import unittest
+
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase, override_settings
+
+from chat.services.llm_service import LLMService
+from chat.services.worker_pool import InferenceWorkerPool, WorkerPoolError
+
+from .utils import STUB_LLM_SETTINGS, reset_llm_service, stage_count, stub_model
+
+GREEDY = {'max_new_tokens': 8, 'do_sample': False}
+
+
+def parent_pid(pid):
+    with open(f'/proc/{pid}/stat') as stat:
+        # The command name is parenthesized and may contain spaces
+        return int(stat.read().rsplit(')', 1)[1].split()[1])
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'needs fork and /proc')
+class InferenceWorkerPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.model, self.tokenizer = stub_model()
+        self.pool = InferenceWorkerPool(self.model, self.tokenizer, processes=1, threads_per_worker=1,
+                                        request_timeout=1)
+        self.addCleanup(self.pool.shutdown)
+
+    def generate(self, prompt, **kwargs):
+        future, _ = self.pool.submit(prompt, **GREEDY, **kwargs)
+        return future.result(timeout=30)
+
+    def wait_for_restart(self, restarts=1):
+        deadline = time.monotonic() + 30
+        while self.pool.restarts < restarts and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(self.pool.restarts, restarts)
+
+    def test_workers_match_in_process_generation(self):
+        inputs = self.tokenizer('User: hi\nAssistant:', return_tensors='pt')
+        output_ids = self.model.generate(**inputs, pad_token_id=self.tokenizer.pad_token_id, **GREEDY)
+        expected = self.tokenizer.decode(output_ids[0, inputs['input_ids'].shape[1]:], skip_special_tokens=True)
+        self.assertEqual(self.generate('User: hi\nAssistant:'), expected)
+
+        future, chunks = self.pool.submit('User: hi\nAssistant:', stream=True, **GREEDY)
+        self.assertEqual(''.join(chunks), expected)
+        self.assertEqual(future.result(timeout=30), expected)
+
+    def test_queue_wait_prefill_and_decode_are_recorded_in_the_parent(self):
+        before = {stage: stage_count(stage) for stage in ('queue_wait', 'prefill', 'decode')}
+        self.generate('User: hi\nAssistant:')
+        self.assertEqual({stage: stage_count(stage) - count for stage, count in before.items()},
+                         {'queue_wait': 1, 'prefill': 1, 'decode': 1})
+
+    def test_users_are_served_round_robin(self):
+        worker = self.pool._workers[0]
+        # Holds the only worker while the queue fills up
+        os.kill(worker.process.pid, signal.SIGSTOP)
+        self.addCleanup(os.kill, worker.process.pid, signal.SIGCONT)
+        order = []
+        futures = []
+        for user, number in (('blocker', 0), ('a', 1), ('a', 2), ('a', 3), ('b', 1), ('b', 2)):
+            future, _ = self.pool.submit(f'{user}{number}', user=user, **GREEDY)
+            future.add_done_callback(lambda _, name=f'{user}{number}': order.append(name))
+            futures.append(future)
+            while worker.task is None:
+                time.sleep(0.001)
+        os.kill(worker.process.pid, signal.SIGCONT)
+        for future in futures:
+            future.result(timeout=30)
+        self.assertEqual(order, ['blocker0', 'a1', 'b1', 'a2', 'b2', 'a3'])
+
+    def test_killed_worker_is_forked_again_from_the_zygote(self):
+        zygote_pid = self.pool._zygote.process.pid
+        worker_pid = self.pool._workers[0].process.pid
+        self.assertEqual(parent_pid(worker_pid), zygote_pid)
+
+        os.kill(worker_pid, signal.SIGKILL)
+        self.wait_for_restart()
+        replacement_pid = self.pool._workers[0].process.pid
+        self.assertNotEqual(replacement_pid, worker_pid)
+        self.assertEqual(parent_pid(replacement_pid), zygote_pid)
+        self.assertEqual(len(self.generate('User: hi\nAssistant:')), 8)
+
+    def test_stuck_request_fails_and_its_worker_is_replaced(self):
+        os.kill(self.pool._workers[0].process.pid, signal.SIGSTOP)
+        future, _ = self.pool.submit('User: hi\nAssistant:', **GREEDY)
+        with self.assertRaisesMessage(WorkerPoolError, 'timed out'):
+            future.result(timeout=30)
+        self.wait_for_restart()
+        self.assertEqual(len(self.generate('User: hi\nAssistant:')), 8)
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'needs fork')
+@override_settings(**STUB_LLM_SETTINGS, LLM_WORKER_PROCESSES=1, LLM_WORKER_THREADS=1)
+class WorkerPoolLLMServiceTests(SimpleTestCase):
+    def setUp(self):
+        reset_llm_service()
+        self.addCleanup(reset_llm_service)
+        self.service = LLMService()
+
+    def test_replies_come_from_the_workers_and_free_their_slots(self):
+        response = async_to_sync(self.service.get_response)('hello', [], user_id=1)
+        self.assertNotEqual(response, LLMService.FALLBACK_RESPONSE)
+        self.assertTrue(''.join(self.service.stream_response('hello again', [], user_id=1)))
+        self.assertEqual(self.service.worker_pool.get_stats()['completed'], 2)
+        self.assertEqual(self.service._executor.pending, 0)
+
+    def test_failed_submit_gives_the_queue_slots_back(self):
+        self.service.worker_pool.shutdown()
+        for _ in range(self.service._executor.max_pending_per_user + 1):
+            response = async_to_sync(self.service.get_response)('hello', [], user_id=1)
+            self.assertEqual(response, LLMService.FALLBACK_RESPONSE)
+            with self.assertRaisesMessage(RuntimeError, 'shut down'):
+                self.service.stream_response('hello', [], user_id=1)
+        self.assertEqual(self.service._executor.pending, 0)
+        self.assertFalse(self.service._executor._pending_by_user)
@@ -0,0 +1,110 @@
+import os
+import tempfile
+
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase
+
+from chat.models import Conversation, Message, WriteBehindCheckpoint
+from chat.services.persistence import WriteBehindQueue
+
+from .utils import clear_process_caches
+
+
+class WriteBehindQueueTests(TransactionTestCase):
+    def setUp(self):
+        clear_process_caches()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.journal_path = os.path.join(directory.name, 'write_behind.journal')
+        user = User.objects.create_user('alice')
+        self.conversation = Conversation.objects.create(user=user)
+
+    def start(self):
+        # The flusher only runs when the test asks it to
+        queue = WriteBehindQueue(self.journal_path, flush_interval=3600)
+        self.addCleanup(queue.close)
+        return queue
+
+    def crash(self, queue):
+        """Stop ``queue`` the way a killed process would: without writing what's still queued."""
+        with queue._lock:
+            queue._closed = True
+            queue._changed.notify_all()
+        queue._flusher.join()
+        queue._journal.close()
+
+    def saved_turns(self):
+        return list(Message.objects.filter(conversation=self.conversation).values_list('role', 'content'))
+
+    def test_queued_turns_are_written_on_flush(self):
+        queue = self.start()
+        user_message, ai_message = queue.enqueue(self.conversation.pk, 'hello', 'hi')
+        self.assertIsNone(user_message.pk)
+        self.assertEqual(self.saved_turns(), [])
+
+        self.assertTrue(queue.flush())
+        self.assertEqual(self.saved_turns(), [('user', 'hello'), ('assistant', 'hi')])
+        self.assertEqual(queue.get_stats()['pending'], 0)
+
+    def test_unwritten_turns_are_replayed_after_a_crash(self):
+        queue = self.start()
+        queue.enqueue(self.conversation.pk, 'first', 'one')
+        queue.enqueue(self.conversation.pk, 'second', 'two')
+        self.crash(queue)
+        self.assertEqual(self.saved_turns(), [])
+
+        queue = self.start()
+        self.assertEqual(queue.get_stats(), {'pending': 2, 'last_seq': 2})
+        self.assertTrue(queue.flush())
+        self.assertEqual(
+            self.saved_turns(), [('user', 'first'), ('assistant', 'one'), ('user', 'second'), ('assistant', 'two')]
+        )
+
+    def test_turns_written_before_a_crash_are_not_replayed(self):
+        queue = self.start()
+        queue.enqueue(self.conversation.pk, 'first', 'one')
+        queue.enqueue(self.conversation.pk, 'second', 'two')
+        # Write just the first turn, as if the crash came between two batches
+        queue.batch_size = 1
+        self.assertTrue(queue._write_next_batch())
+        self.crash(queue)
+        self.assertEqual(WriteBehindCheckpoint.objects.get().last_seq, 1)
+
+        queue = self.start()
+        self.assertEqual(queue.get_stats(), {'pending': 1, 'last_seq': 2})
+        self.assertTrue(queue.flush())
+        self.assertEqual(
+            self.saved_turns(), [('user', 'first'), ('assistant', 'one'), ('user', 'second'), ('assistant', 'two')]
+        )
+
+    def test_messages_without_replies_are_queued_and_replayed(self):
+        queue = self.start()
+        user_message, ai_message = queue.enqueue(self.conversation.pk, 'unanswered', None)
+        self.assertIsNone(ai_message)
+        self.crash(queue)
+
+        queue = self.start()
+        self.assertTrue(queue.flush())
+        self.assertEqual(self.saved_turns(), [('user', 'unanswered')])
+
+    def test_partial_last_line_is_skipped(self):
+        queue = self.start()
+        queue.enqueue(self.conversation.pk, 'first', 'one')
+        self.crash(queue)
+        with open(self.journal_path, 'a') as journal:
+            journal.write('{"seq": 2, "conversation_id"')
+
+        queue = self.start()
+        self.assertEqual(queue.get_stats(), {'pending': 1, 'last_seq': 1})
+
+    def test_a_journal_can_only_be_open_once(self):
+        self.start()
+        with self.assertRaisesMessage(RuntimeError, 'in use by another process'):
+            WriteBehindQueue(self.journal_path)
+
+    def test_turns_of_deleted_conversations_are_dropped(self):
+        queue = self.start()
+        queue.enqueue(self.conversation.pk, 'hello', 'hi')
+        self.conversation.delete()
+        self.assertTrue(queue.flush())
+        self.assertFalse(Message.objects.exists())
@@ -0,0 +1,63 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from chat.models import Conversation
+from chat.services import metrics
+from chat.services.backends import StubBackend
+from chat.services.history import history_cache
+from chat.services.kv_cache import kv_cache
+from chat.services.llm_service import LLMService
+from chat.services.token_cache import token_cache
+from chat.throttling import limiter
+
+# The stub backend downloads nothing, and greedy decoding makes its replies repeatable
+STUB_LLM_SETTINGS = {'LLM_BACKEND': 'stub', 'LLM_DETERMINISTIC': True}
+
+
+def stub_model():
+    """The stub backend's model and tokenizer."""
+    backend = StubBackend()
+    return backend.load_model(None), backend.load_tokenizer(None)
+
+
+def reset_llm_service():
+    """Stop and forget the loaded LLMService, so the next one loads with the current settings."""
+    service = LLMService._instance
+    if service is not None and service._initialized:
+        service._executor.shutdown(wait=False)
+        if service.scheduler is not None:
+            service.scheduler.shutdown(wait=False)
+        if service.worker_pool is not None:
+            service.worker_pool.shutdown()
+    LLMService._instance = None
+    LLMService._state = LLMService.NOT_LOADED
+
+
+def clear_process_caches():
+    """Empty the in-process caches; the test database reuses ids, so entries would leak between tests."""
+    history_cache.clear()
+    kv_cache.clear()
+    token_cache.clear()
+    with limiter._lock:
+        limiter._buckets.clear()
+
+
+def stage_count(name):
+    """How many times ``name`` has been recorded into ``chat_stage_seconds``."""
+    with metrics.stage_seconds._lock:
+        state = metrics.stage_seconds._values.get((name,))
+    return sum(state[0]) if state else 0
+
+
+class ChatAPITestCase(TestCase):
+    """A user with a token-authenticated client and one conversation."""
+
+    def setUp(self):
+        clear_process_caches()
+        self.user = User.objects.create_user('alice', password='secret')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.conversation = Conversation.objects.create(user=self.user, title='Test')
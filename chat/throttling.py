@@ -0,0 +1,97 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+from .services import metrics
+
+throttled_requests = metrics.Counter('chat_throttled_requests_total', 'Messages refused by the per-user rate limit')
+throttled_speech_requests = metrics.Counter(
+    'chat_throttled_speech_requests_total', 'Speech requests refused by the per-user speech rate limit'
+)
+
+
+class TokenBucketLimiter:
+    """In-memory token buckets: each key holds up to ``burst`` tokens, refilled at ``rate`` per second.
+
+    Buckets of keys not seen for a while are dropped beyond ``max_keys``;
+    a dropped bucket comes back full, so eviction only ever errs towards
+    allowing a request.
+    """
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        """Take a token for ``key``; returns 0 if allowed, otherwise seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+limiter = TokenBucketLimiter()
+
+
+def _check_rate(key, per_minute, burst, counter):
+    if per_minute <= 0:
+        return 0
+    wait = limiter.take(key, per_minute / 60, max(1, burst))
+    if wait:
+        counter.inc()
+    return wait
+
+
+def check_message_rate(key):
+    """Count a chat message against ``key``'s rate limit; returns 0 or the seconds to wait before retrying."""
+    return _check_rate(
+        key, settings.CHAT_RATE_LIMIT_PER_MINUTE, settings.CHAT_RATE_LIMIT_BURST, throttled_requests
+    )
+
+
+def check_speech_rate(key):
+    """Count a speech request against ``key``'s speech rate limit, kept apart from its message limit."""
+    return _check_rate(
+        f'speech:{key}', settings.VOICE_RATE_LIMIT_PER_MINUTE, settings.VOICE_RATE_LIMIT_BURST,
+        throttled_speech_requests
+    )
+
+
+class UserMessageRateThrottle(BaseThrottle):
+    """Token-bucket limit on chat messages per user; DRF answers 429 with Retry-After when it's hit."""
+
+    def allow_request(self, request, view):
+        if request.user and request.user.is_authenticated:
+            key = f'user:{request.user.pk}'
+        else:
+            key = f'ip:{self.get_ident(request)}'
+        self._wait = self.check_rate(key)
+        return not self._wait
+
+    def check_rate(self, key):
+        return check_message_rate(key)
+
+    def wait(self):
+        # Retry-After is whole seconds; rounding down would invite a retry that fails again
+        return math.ceil(self._wait)
+
+
+class SpeechRateThrottle(UserMessageRateThrottle):
+    """Token-bucket limit on speech synthesis requests per user, with its own rate."""
+
+    def check_rate(self, key):
+        return check_speech_rate(key)
@@ -1,23 +1,188 @@
 from rest_framework import viewsets, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, authentication_classes, permission_classes, throttle_classes
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import AllowAny
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.authtoken.models import Token
-from django.shortcuts import get_object_or_404
-from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.exceptions import AuthenticationFailed
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse, JsonResponse
 from .models import Conversation, Message
-from .serializers import ConversationSerializer, MessageSerializer
+from .serializers import ConversationSerializer, ConversationListSerializer, MessageSerializer, MessageSearchResultSerializer
+from .pagination import ConversationCursorPagination, MessageCursorPagination, SearchPagination
+from .renderers import EventStreamRenderer, NDJSONRenderer
+from .authentication import CachingTokenAuthentication
 from .services.llm_service import LLMService
+from .services.inference_executor import LLMOverloadedError, LLMUserLimitError
+from .throttling import SpeechRateThrottle, UserMessageRateThrottle, check_message_rate
+from .services import metrics
+from .services.persistence import persist_turn, persist_unanswered, wait_for_pending
+from .services.search import search_messages
+from .services.archive import export_lines, rehydrate
+from .services.audio_cache import audio_cache
+from .services.speech import get_synthesizer
+from .streaming import reply_events, speech_payload, start_reply, unsummarized_history
+import hmac
+import ipaddress
+import json
 import logging
+import math
+import os
+import re
 from django.conf import settings
+from django.db.models import Count, IntegerField, OuterRef, Subquery, prefetch_related_objects
+from django.db.models.functions import Coalesce, Substr
 from asgiref.sync import sync_to_async, async_to_sync
-import asyncio
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 
 logger = logging.getLogger(__name__)
 
+# Longest text synthesize_speech accepts; it's meant for short fixed phrases
+SPEECH_MAX_CHARS = 1000
+
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _overloaded_response(error, response_class=Response):
+    if isinstance(error, LLMUserLimitError):
+        # The server has room; this user should wait for their own replies first
+        response = response_class({
+            'error': 'Too many messages in progress',
+            'detail': 'Please wait for your earlier messages to be answered'
+        }, status=status.HTTP_429_TOO_MANY_REQUESTS)
+    else:
+        response = response_class({
+            'error': 'Server is busy generating other responses',
+            'detail': 'Please retry shortly'
+        }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    response['Retry-After'] = str(error.retry_after)
+    return response
+
+@api_view(['GET'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def llm_ready(request):
+    """Readiness probe: 200 once the model is loaded, 503 while it is loading or failed to load."""
+    llm_status = LLMService.status()
+    if not settings.DEBUG:
+        llm_status.pop('error')
+    ready = llm_status['status'] == LLMService.READY
+    return Response(llm_status, status=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE)
+
+def _metrics_allowed(request):
+    token = settings.METRICS_TOKEN
+    if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(allowed, strict=False) for allowed in settings.METRICS_ALLOWED_IPS)
+
+def metrics_view(request):
+    """Stage timings, token counts, queue depth and cache hits in the Prometheus text format.
+
+    Only served to METRICS_ALLOWED_IPS, or with the METRICS_TOKEN bearer token.
+    """
+    if not _metrics_allowed(request):
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(metrics.REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+class _FileRange:
+    """Reads at most ``length`` bytes of ``file`` from where it's positioned.
+
+    Keeps ``fileno()``, so WSGI servers that send files with sendfile() still
+    can; they send Content-Length bytes from the file's current offset.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+_BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+def _ranged_file_response(request, path, content_type, etag):
+    """FileResponse for ``path`` that honours single-range Range requests and If-None-Match."""
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        file = open(path, 'rb')
+        size = os.fstat(file.fileno()).st_size
+        match = _BYTE_RANGE.match(request.headers.get('Range', ''))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                # bytes=-N is the last N bytes
+                start, end = max(0, size - int(match.group(2))), size - 1
+            if start > end:
+                file.close()
+                response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+                response['Content-Range'] = f'bytes */{size}'
+                return response
+            file.seek(start)
+            response = FileResponse(_FileRange(file, end - start + 1), content_type=content_type,
+                                    status=status.HTTP_206_PARTIAL_CONTENT)
+            response['Content-Length'] = str(end - start + 1)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        else:
+            # Anything else, including multiple ranges, gets the whole file
+            response = FileResponse(file, content_type=content_type)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    # The URL names the content, so it never changes
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
+@api_view(['GET'])
+def speech_audio(request, key):
+    """Audio of a synthesized sentence from the speech cache, with range requests for seeking."""
+    entry = audio_cache.entry(key)
+    if entry is None:
+        return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        return _ranged_file_response(request, audio_cache.audio_path(key), entry['media_type'], f'"{key}"')
+    except FileNotFoundError:
+        # Evicted since the lookup
+        return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+@api_view(['POST'])
+@throttle_classes([SpeechRateThrottle])
+def synthesize_speech(request):
+    """Speak a fixed text, such as a greeting; returns its audio URL, duration and viseme timeline."""
+    text = str(request.data.get('text', '')).strip()
+    if not settings.VOICE_SYNTHESIS_ENABLED:
+        return Response({'detail': 'Voice synthesis is disabled.'}, status=status.HTTP_404_NOT_FOUND)
+    if not text or len(text) > SPEECH_MAX_CHARS:
+        return Response({
+            'error': 'Invalid text',
+            'detail': f"Pass between 1 and {SPEECH_MAX_CHARS} characters to speak as 'text'"
+        }, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        segment = {'text': text, **get_synthesizer().speak(text)}
+    except Exception as e:
+        logger.error(f"Error synthesizing speech: {str(e)}")
+        return Response({
+            'error': 'Failed to synthesize speech',
+            'detail': str(e) if settings.DEBUG else 'Internal server error'
+        }, status=status.HTTP_502_BAD_GATEWAY)
+    return Response(speech_payload(segment, request.build_absolute_uri))
+
 @method_decorator(csrf_exempt, name='dispatch')
 class CustomAuthToken(ObtainAuthToken):
     def post(self, request, *args, **kwargs):
@@ -42,59 +207,245 @@ class CustomAuthToken(ObtainAuthToken):
 
 class ChatViewSet(viewsets.ModelViewSet):
     serializer_class = ConversationSerializer
+    pagination_class = ConversationCursorPagination
+    
+    LAST_MESSAGE_PREVIEW_LENGTH = 100
     
     def get_queryset(self):
-        return Conversation.objects.filter(user=self.request.user)
+        queryset = Conversation.objects.filter(user=self.request.user)
+        if self.action == 'list':
+            # One query per page: counts and previews are correlated subqueries on the message index
+            messages = Message.objects.filter(conversation=OuterRef('pk'))
+            latest = messages.order_by('-timestamp', '-id')
+            queryset = queryset.annotate(
+                message_count=Coalesce(
+                    Subquery(
+                        messages.order_by().values('conversation').annotate(count=Count('id')).values('count'),
+                        output_field=IntegerField()
+                    ),
+                    0
+                ),
+                last_message_role=Subquery(latest.values('role')[:1]),
+                last_message_preview=Substr(
+                    Subquery(latest.values('content')[:1]), 1, self.LAST_MESSAGE_PREVIEW_LENGTH
+                ),
+            )
+        return queryset
+    
+    def get_object(self):
+        conversation = super().get_object()
+        # Turns still in the write-behind queue must be visible to their own conversation
+        wait_for_pending(conversation.pk)
+        if conversation.archived_at is not None and self.action != 'destroy':
+            rehydrate(conversation)
+        if self.action == 'retrieve':
+            # Only now, so queued turns and rehydrated messages are included
+            prefetch_related_objects([conversation], 'messages')
+        return conversation
+    
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return ConversationListSerializer
+        return super().get_serializer_class()
+    
+    def perform_authentication(self, request):
+        with metrics.stage('auth'):
+            super().perform_authentication(request)
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
-    @action(detail=True, methods=['post'])
+    @action(detail=True, methods=['get'])
+    def messages(self, request, pk=None):
+        conversation = self.get_object()
+        paginator = MessageCursorPagination()
+        page = paginator.paginate_queryset(conversation.messages.all(), request, view=self)
+        return paginator.get_paginated_response(MessageSerializer(page, many=True).data)
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({
+                'error': 'Search query is required',
+                'detail': "Pass the text to search for as the 'q' parameter"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        paginator = SearchPagination()
+        with metrics.stage('search'):
+            results = paginator.paginate_results(
+                lambda limit, offset: search_messages(request.user.pk, query, limit=limit, offset=offset),
+                request
+            )
+        return paginator.get_paginated_response(MessageSearchResultSerializer(results, many=True).data)
+
+    @action(detail=False, methods=['get'], renderer_classes=[JSONRenderer, NDJSONRenderer])
+    def export(self, request):
+        # Written out as it's read, so an export of any size needs no more memory than a few conversations
+        response = StreamingHttpResponse(export_lines(request.user.pk), content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="conversations.jsonl"'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @action(detail=True, methods=['post'], throttle_classes=[UserMessageRateThrottle])
     def send_message(self, request, pk=None):
         try:
-            conversation = get_object_or_404(Conversation, pk=pk)
+            conversation = self.get_object()
             message_content = request.data.get('message', '')
             
-            # Create user message
-            user_message = Message.objects.create(
-                conversation=conversation,
-                content=message_content,
-                role='user'
-            )
+            history = unsummarized_history(conversation)
 
             # Initialize LLM service
             llm_service = LLMService()
             
-            # Get conversation history
-            history = list(conversation.messages.order_by('created_at').values('content', 'role'))
+            # Fold turns over the prompt budget into the summary
+            history = llm_service.fold_history(conversation, history, message_content)
             
             # Use async_to_sync to properly handle the async LLM response
             try:
-                ai_response = async_to_sync(llm_service.get_response)(message_content, history)
-                
-                # Create AI message
-                ai_message = Message.objects.create(
-                    conversation=conversation,
-                    content=ai_response,
-                    role='assistant'
+                ai_response = async_to_sync(llm_service.get_response)(
+                    message_content, history,
+                    conversation_id=conversation.id, summary=conversation.summary,
+                    user_id=request.user.pk
                 )
-
-                return Response({
-                    'message': ai_response,
-                    'user_message': MessageSerializer(user_message).data,
-                    'ai_message': MessageSerializer(ai_message).data
-                }, status=status.HTTP_200_OK)
-                
+            except LLMOverloadedError as e:
+                persist_unanswered(conversation, message_content)
+                return _overloaded_response(e)
             except Exception as e:
                 logger.error(f"Error getting LLM response: {str(e)}")
+                persist_unanswered(conversation, message_content)
                 return Response({
                     'error': 'Failed to generate AI response',
                     'detail': str(e) if settings.DEBUG else 'Internal server error'
                 }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            
+            # Save both messages in one transaction, or queue them when write-behind is on
+            user_message, ai_message = persist_turn(conversation, message_content, ai_response)
+
+            return Response({
+                'message': ai_response,
+                'user_message': MessageSerializer(user_message).data,
+                'ai_message': MessageSerializer(ai_message).data
+            }, status=status.HTTP_200_OK)
 
         except Exception as e:
             logger.error(f"Error in send_message: {str(e)}")
             return Response({
                 'error': 'Failed to process message',
                 'detail': str(e) if settings.DEBUG else 'Internal server error'
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @action(detail=True, methods=['post'], renderer_classes=[JSONRenderer, EventStreamRenderer],
+            throttle_classes=[UserMessageRateThrottle])
+    def send_message_stream(self, request, pk=None):
+        """Same as send_message, but streams the reply as Server-Sent Events.
+
+        Emits a ``token`` event per generated chunk, then a ``done`` event
+        carrying the same payload send_message returns once the assistant
+        message has been saved. With ``"voice": true`` in the body and voice
+        synthesis enabled, ``speech`` events carry the audio and viseme
+        timeline of each sentence as soon as it's synthesized.
+        """
+        try:
+            conversation = self.get_object()
+            message_content = request.data.get('message', '')
+            speak = settings.VOICE_SYNTHESIS_ENABLED and bool(request.data.get('voice'))
+            
+            llm_service, chunk_stream = start_reply(conversation, message_content, request.user.pk)
+            
+        except LLMOverloadedError as e:
+            return _overloaded_response(e)
+        except Exception as e:
+            logger.error(f"Error in send_message_stream: {str(e)}")
+            return Response({
+                'error': 'Failed to process message',
+                'detail': str(e) if settings.DEBUG else 'Internal server error'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        def event_stream():
+            events = reply_events(
+                llm_service, conversation, message_content, chunk_stream, speak, request.build_absolute_uri
+            )
+            try:
+                for event, data in events:
+                    yield _sse_event(event, data)
+            finally:
+                # Reached early when the client disconnects; stops generation and saves the user's message
+                events.close()
+        
+        response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stop reverse proxies from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+@csrf_exempt
+async def send_message_async(request, pk):
+    """Async-native send_message for ASGI deployments.
+
+    Generation is awaited on the inference executor, so no server thread is
+    held while the model runs. Takes the same body and returns the same payload
+    as ``ChatViewSet.send_message``.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'detail': 'Method not allowed'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    
+    try:
+        with metrics.stage('auth'):
+            auth = await sync_to_async(CachingTokenAuthentication().authenticate)(request)
+    except AuthenticationFailed as e:
+        return JsonResponse({'detail': str(e.detail)}, status=status.HTTP_401_UNAUTHORIZED)
+    if auth is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'},
+                            status=status.HTTP_401_UNAUTHORIZED)
+    user = auth[0]
+    
+    wait = check_message_rate(f'user:{user.pk}')
+    if wait:
+        response = JsonResponse({'detail': 'Request was throttled.'}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+        response['Retry-After'] = str(math.ceil(wait))
+        return response
+    
+    try:
+        conversation = await Conversation.objects.filter(user=user).aget(pk=pk)
+    except Conversation.DoesNotExist:
+        return JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+    await sync_to_async(wait_for_pending)(conversation.pk)
+    if conversation.archived_at is not None:
+        await sync_to_async(rehydrate)(conversation)
+    
+    try:
+        message_content = json.loads(request.body or b'{}').get('message', '')
+        
+        history = await sync_to_async(unsummarized_history)(conversation)
+        
+        # The first call loads the model, so keep that off the event loop too
+        llm_service = await sync_to_async(LLMService, thread_sensitive=False)()
+        history = await sync_to_async(llm_service.fold_history)(conversation, history, message_content)
+        try:
+            ai_response = await llm_service.get_response(
+                message_content, history,
+                conversation_id=conversation.id, summary=conversation.summary,
+                user_id=user.pk
+            )
+        except Exception:
+            await sync_to_async(persist_unanswered)(conversation, message_content)
+            raise
+        
+        user_message, ai_message = await sync_to_async(persist_turn)(conversation, message_content, ai_response)
+        
+        return JsonResponse({
+            'message': ai_response,
+            'user_message': MessageSerializer(user_message).data,
+            'ai_message': MessageSerializer(ai_message).data
+        })
+        
+    except LLMOverloadedError as e:
+        return _overloaded_response(e, response_class=JsonResponse)
+    except Exception as e:
+        logger.error(f"Error in send_message_async: {str(e)}")
+        return JsonResponse({
+            'error': 'Failed to process message',
+            'detail': str(e) if settings.DEBUG else 'Internal server error'
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -3,6 +3,12 @@ ASGI config for citizens_llm_chat project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Served through an ASGI server (e.g. ``uvicorn citizens_llm_chat.asgi:application``),
+``/chat/conversations/<id>/send_message_async/`` awaits generation on the
+inference executor instead of holding a worker thread for the whole reply, and
+``/ws/chat/conversations/<id>/`` carries a whole chat session over one WebSocket
+(see ``chat.consumers``). Everything else is plain Django.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
@@ -13,4 +19,14 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'citizens_llm_chat.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once the app registry is ready, since it loads models
+from chat.consumers import chat_socket  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        await chat_socket(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -1,15 +1,20 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from rest_framework.routers import DefaultRouter
-from chat.views import CustomAuthToken, ConversationViewSet
+from chat.views import CustomAuthToken, ChatViewSet, send_message_async, llm_ready, metrics_view, speech_audio, synthesize_speech
 from django.conf import settings
 from django.conf.urls.static import static
 
 router = DefaultRouter()
-router.register(r'chat/conversations', ConversationViewSet, basename='conversation')
+router.register(r'chat/conversations', ChatViewSet, basename='conversation')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('chat/login/', CustomAuthToken.as_view(), name='api_token_auth'),
+    path('chat/ready/', llm_ready, name='llm_ready'),
+    path('metrics', metrics_view, name='metrics'),
+    path('chat/conversations/<int:pk>/send_message_async/', send_message_async, name='send_message_async'),
+    path('chat/speech/', synthesize_speech, name='synthesize_speech'),
+    re_path(r'^chat/speech/(?P<key>[0-9a-f]{64})/$', speech_audio, name='speech_audio'),
     path('', include(router.urls)),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT) 
\ No newline at end of file
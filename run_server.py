@@ -2,7 +2,9 @@ import os
 from waitress import serve
 from citizens_llm_chat.wsgi import application
 import logging
+import signal
 import socket
+import sys
 
 # Configure logging with more detailed format
 logging.basicConfig(
@@ -77,6 +79,22 @@ def main():
             if not any(sensitive in key.lower() for sensitive in ['token', 'key', 'secret', 'password']):
                 logger.info(f"{key}: {os.environ[key]}")
 
+        # Optionally load the model before serving so the first user doesn't wait for it.
+        # 'background' starts serving right away while /chat/ready/ reports loading.
+        preload = os.environ.get('LLM_PRELOAD', 'false').lower()
+        if preload in ('true', 'background'):
+            from chat.services.llm_service import LLMService
+            logger.info(f"Preloading LLM ({'in background' if preload == 'background' else 'before serving'})")
+            LLMService.preload(background=preload == 'background')
+
+        # Replay turns a crash left in the write-behind journal before taking new ones,
+        # and exit cleanly on SIGTERM so the queue is flushed on the way out
+        from django.conf import settings
+        if settings.CHAT_WRITE_BEHIND_ENABLED:
+            from chat.services.persistence import get_write_behind
+            get_write_behind()
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
         # Start server with better error handling
         logger.info(f"Starting server on http://0.0.0.0:{port}")
         serve(application, **server_options)